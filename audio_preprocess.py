@@ -0,0 +1,194 @@
+"""Whisperに送る前の録音データの前処理
+
+ブラウザの録音（mic_recorder の WAV）は 44.1/48kHz のままで、話し始める前と話し終えた後の
+無音も含んでいる。ここでは NumPy だけで次の処理を行い、送信量と音声認識の処理時間を減らす。
+- モノラル化と 16kHz へのリサンプリング（Whisper は内部で 16kHz モノラルに変換するので情報は失われない）
+- エネルギーによる音声区間検出（VAD）で前後の無音を削り、長い間（ま）を短くする
+- 必要なら ffmpeg で Ogg/Opus に圧縮する（ffmpeg がなければ 16bit WAV のまま）
+"""
+import io
+import shutil
+import subprocess
+import wave
+
+import numpy as np
+
+TARGET_RATE = 16000
+FRAME_SECONDS = 0.03
+# 話し始め・話し終わりの前後に残す余白
+PAD_SECONDS = 0.3
+# これより長い無音は MAX_PAUSE_SECONDS に縮める
+MAX_PAUSE_SECONDS = 0.6
+# 雑音レベルよりこれだけ大きいフレームを音声とみなす
+VAD_MARGIN_DB = 12.0
+# 無音とみなす絶対的な下限（dBFS）
+VAD_FLOOR_DB = -50.0
+# 雑音レベルの見積もりに使う、録音の先頭・末尾の長さ（録音ボタンを押してから話し始めるまでの無音）
+EDGE_SECONDS = 0.15
+# 雑音レベルの見積もりがこれより大きい録音は、無音を含まない（全体が発話）とみなして削らない（dBFS）
+VAD_SPEECH_FLOOR_DB = -40.0
+# 大きいフレーム（上位10%）と雑音レベルの差がこれより小さい録音も、全体が発話とみなして削らない
+# （途切れずに話し、語尾だけ小声になった録音で、小声の部分を無音と誤判定しないため）
+VAD_MIN_RANGE_DB = 25.0
+OPUS_BITRATE = "24k"
+# WAVとして読めない録音で decode_wav / load が送出する例外
+DECODE_ERRORS = (wave.Error, ValueError, EOFError)
+
+
+def decode_wav(wav_bytes):
+    """WAVを (float32のサンプル配列[サンプル, チャンネル], サンプリングレート) に変換する"""
+    with wave.open(io.BytesIO(wav_bytes), "rb") as w:
+        channels = w.getnchannels()
+        width = w.getsampwidth()
+        rate = w.getframerate()
+        frames = w.readframes(w.getnframes())
+
+    if width == 1:
+        samples = (np.frombuffer(frames, dtype=np.uint8).astype(np.float32) - 128) / 128
+    elif width == 2:
+        samples = np.frombuffer(frames, dtype="<i2").astype(np.float32) / 32768
+    elif width == 4:
+        samples = np.frombuffer(frames, dtype="<i4").astype(np.float32) / 2147483648
+    else:
+        raise ValueError(f"対応していないサンプル幅です: {width}")
+    return samples.reshape(-1, channels), rate
+
+
+def encode_wav(samples, rate):
+    """モノラルの float32 配列を 16bit PCM の WAV にする"""
+    pcm = (np.clip(samples, -1.0, 1.0) * 32767).astype("<i2")
+    buf = io.BytesIO()
+    with wave.open(buf, "wb") as w:
+        w.setnchannels(1)
+        w.setsampwidth(2)
+        w.setframerate(rate)
+        w.writeframes(pcm.tobytes())
+    return buf.getvalue()
+
+
+def resample(samples, rate, target_rate=TARGET_RATE):
+    """FFTによる帯域制限付きリサンプリング（目標レートのナイキスト周波数より上は捨てる）"""
+    if rate == target_rate or len(samples) == 0:
+        return samples
+    n_out = int(round(len(samples) * target_rate / rate))
+    spectrum = np.fft.rfft(samples)
+    resampled = np.fft.irfft(spectrum[: n_out // 2 + 1], n_out)
+    return (resampled * (n_out / len(samples))).astype(np.float32)
+
+
+def voiced_frames(samples, rate):
+    """フレームごとに音声か無音かを判定した真偽値の配列と、1フレームのサンプル数を返す"""
+    frame = max(1, int(rate * FRAME_SECONDS))
+    n_frames = len(samples) // frame
+    if n_frames == 0:
+        return np.zeros(0, dtype=bool), frame
+    frames = samples[: n_frames * frame].reshape(n_frames, frame)
+    rms = np.sqrt(np.mean(frames ** 2, axis=1) + 1e-12)
+    db = 20 * np.log10(rms)
+    # 雑音レベルは下位10%のフレームと、先頭・末尾の区間の小さいほう
+    # （下位10%だけでは、無音のない録音で小声の部分が雑音とみなされる）
+    edge = max(1, int(EDGE_SECONDS / FRAME_SECONDS))
+    noise = min(np.percentile(db, 10), np.median(db[:edge]), np.median(db[-edge:]))
+    if noise > VAD_SPEECH_FLOOR_DB or np.percentile(db, 90) - noise < VAD_MIN_RANGE_DB:
+        # 相対的な基準が使えないので、絶対的な下限だけで判定する（雑音だけの録音はここで無音になる）
+        threshold = VAD_FLOOR_DB
+    else:
+        threshold = max(noise + VAD_MARGIN_DB, VAD_FLOOR_DB)
+    return db > threshold, frame
+
+
+def trim_silence(samples, rate):
+    """前後の無音を削り、長い無音を縮める。音声が見つからなければ None を返す"""
+    voiced, frame = voiced_frames(samples, rate)
+    if not voiced.any():
+        return None
+
+    pad = int(PAD_SECONDS / FRAME_SECONDS)
+    max_pause = int(MAX_PAUSE_SECONDS / FRAME_SECONDS)
+    # 音声フレームの前後 pad フレームを残す
+    keep = voiced.copy()
+    for shift in range(1, pad + 1):
+        keep[shift:] |= voiced[:-shift]
+        keep[:-shift] |= voiced[shift:]
+
+    # 残すフレームのうち、途中の長い無音は先頭の max_pause フレームだけにする
+    indices = np.flatnonzero(keep)
+    selected = []
+    run = 0
+    for i in range(indices[0], indices[-1] + 1):
+        if keep[i]:
+            run = 0
+            selected.append(i)
+        else:
+            run += 1
+            if run <= max_pause:
+                selected.append(i)
+    starts = np.array(selected) * frame
+    return np.concatenate([samples[s:s + frame] for s in starts])
+
+
+def encode_opus(wav_bytes):
+    """ffmpeg で Ogg/Opus に圧縮する（ffmpeg がない・失敗した場合は None）"""
+    ffmpeg = shutil.which("ffmpeg")
+    if not ffmpeg:
+        return None
+    try:
+        result = subprocess.run(
+            [ffmpeg, "-loglevel", "error", "-f", "wav", "-i", "pipe:0",
+             "-c:a", "libopus", "-b:a", OPUS_BITRATE, "-f", "ogg", "pipe:1"],
+            input=wav_bytes, capture_output=True, timeout=30, check=True,
+        )
+    except (subprocess.SubprocessError, OSError):
+        return None
+    return result.stdout or None
+
+
+def has_speech(samples, rate):
+    """音声らしい区間を含むか（区間ごとに書き起こすときに、無音の区間を飛ばす判定に使う）"""
+    return bool(voiced_frames(samples, rate)[0].any())
+
+
+def load(wav_bytes):
+    """WAVを読み、16kHzモノラルにして無音を削った (サンプル配列, 統計) を返す
+
+    音声区間が見つからなければサンプル配列は None。WAVとして読めなければ DECODE_ERRORS のいずれかを送出する。
+    """
+    stats = {"input_bytes": len(wav_bytes)}
+    samples, rate = decode_wav(wav_bytes)
+    stats["input_seconds"] = len(samples) / rate
+    mono = resample(samples.mean(axis=1), rate)
+    trimmed = trim_silence(mono, TARGET_RATE)
+    stats["output_seconds"] = 0.0 if trimmed is None else len(trimmed) / TARGET_RATE
+    return trimmed, stats
+
+
+def encode(samples, codec="wav"):
+    """16kHzモノラルのサンプル配列を送信用に変換し、(データ, ファイル名) を返す
+
+    codec="opus" を指定し ffmpeg が使える場合は Ogg/Opus、それ以外は16bit WAV。
+    """
+    data = encode_wav(samples, TARGET_RATE)
+    if codec == "opus":
+        opus = encode_opus(data)
+        if opus:
+            return opus, "input.ogg"
+    return data, "input.wav"
+
+
+def preprocess(wav_bytes, codec="wav"):
+    """録音を Whisper 向けに前処理し、(データ, ファイル名, 統計) を返す
+
+    音声区間が見つからなければデータは None（Whisperを呼ぶ必要がない）。
+    WAVとして読めない形式の場合は元のデータをそのまま返す。
+    """
+    try:
+        samples, stats = load(wav_bytes)
+    except DECODE_ERRORS:
+        return wav_bytes, "input.wav", {"input_bytes": len(wav_bytes), "output_bytes": len(wav_bytes)}
+
+    if samples is None:
+        stats["output_bytes"] = 0
+        return None, None, stats
+    data, filename = encode(samples, codec)
+    stats["output_bytes"] = len(data)
+    return data, filename, stats
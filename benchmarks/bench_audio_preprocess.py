@@ -0,0 +1,120 @@
+"""録音の前処理（audio_preprocess）で減る送信量と処理時間を測る
+
+使い方（リポジトリ直下で実行）:
+    python benchmarks/bench_audio_preprocess.py
+    python benchmarks/bench_audio_preprocess.py rec1.wav rec2.wav --codec opus --with-whisper
+
+WAVファイルを指定しなければ、48kHzステレオの合成サンプル（前後に無音、途中に長い間があるものと、
+無音がなく語尾だけ小声のもの）を使う。
+送信時間は --uplink-mbps の回線速度で見積もる。--with-whisper を付けると
+前処理の前後の音声で実際に whisper-1 を呼んで所要時間を比べる（環境変数 OPENAI_API_KEY が必要）。
+"""
+import argparse
+import io
+import os
+import statistics
+import sys
+import time
+
+import numpy as np
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+import audio_preprocess  # noqa: E402
+
+
+def synthetic_recording(rate=48000, seed=0, segments=None):
+    """雑音を含む48kHzステレオWAV
+
+    segments は (秒数, 声の大きさ) の並び（大きさ 0 は無音）。省略時は
+    無音1.5秒 → 発話2秒 → 間2秒 → 発話3秒 → 無音2秒。
+    """
+    rng = np.random.default_rng(seed)
+
+    def speech(seconds, gain):
+        t = np.arange(int(rate * seconds)) / rate
+        # 音節くらいの速さで振幅が揺れる、倍音を含む声のような音
+        envelope = 0.5 + 0.5 * np.sin(2 * np.pi * 4 * t) ** 2
+        voice = sum(np.sin(2 * np.pi * f * t) / k for k, f in enumerate((180, 360, 540, 900), 1))
+        return gain * 0.2 * envelope * voice / 2
+
+    if segments is None:
+        segments = [(1.5, 0), (2, 1), (2, 0), (3, 1), (2, 0)]
+    mono = np.concatenate([speech(seconds, gain) for seconds, gain in segments])
+    mono += rng.normal(0, 0.002, len(mono))
+    pcm = (np.clip(np.stack([mono, mono], axis=1), -1, 1) * 32767).astype("<i2")
+
+    import wave
+
+    buf = io.BytesIO()
+    with wave.open(buf, "wb") as w:
+        w.setnchannels(2)
+        w.setsampwidth(2)
+        w.setframerate(rate)
+        w.writeframes(pcm.tobytes())
+    return buf.getvalue()
+
+
+def call_whisper(data, filename):
+    from openai import OpenAI
+
+    client = OpenAI(api_key=os.environ["OPENAI_API_KEY"])
+    audio_file = io.BytesIO(data)
+    audio_file.name = filename
+    start = time.perf_counter()
+    client.audio.transcriptions.create(model="whisper-1", file=audio_file, language="ja", temperature=0.0)
+    return time.perf_counter() - start
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument("wavs", nargs="*")
+    parser.add_argument("--codec", choices=["wav", "opus"], default="wav")
+    parser.add_argument("--repeat", type=int, default=20, help="1件あたりの計測回数")
+    parser.add_argument("--uplink-mbps", type=float, default=2.0, help="送信時間の見積もりに使う上り回線速度")
+    parser.add_argument("--with-whisper", action="store_true")
+    args = parser.parse_args()
+
+    if args.wavs:
+        samples = []
+        for path in args.wavs:
+            with open(path, "rb") as f:
+                samples.append((os.path.basename(path), f.read()))
+    else:
+        samples = [
+            ("synthetic", synthetic_recording()),
+            # 前後に無音がなく、語尾の0.9秒だけ20dB小さい発話（削られずに3秒のまま残るべき）
+            ("continuous", synthetic_recording(segments=[(2.1, 1), (0.9, 0.1)])),
+        ]
+
+    bytes_per_second = args.uplink_mbps * 1e6 / 8
+    total_in = total_out = 0
+    saved_upload = []
+    for name, data in samples:
+        audio_preprocess.preprocess(data, codec=args.codec)  # 初回のみの準備を計測から外す
+        start = time.perf_counter()
+        for _ in range(args.repeat):
+            out, filename, stats = audio_preprocess.preprocess(data, codec=args.codec)
+        elapsed = (time.perf_counter() - start) / args.repeat
+
+        total_in += stats["input_bytes"]
+        total_out += stats["output_bytes"]
+        upload_saved = (stats["input_bytes"] - stats["output_bytes"]) / bytes_per_second
+        saved_upload.append(upload_saved - elapsed)
+        print(f"{name}: {stats['input_bytes']:,} B / {stats.get('input_seconds', 0):.1f}秒"
+              f" -> {stats['output_bytes']:,} B / {stats.get('output_seconds', 0):.1f}秒 ({filename})"
+              f"  前処理 {elapsed * 1000:.1f} ms, 送信短縮 {upload_saved * 1000:.0f} ms")
+
+        if args.with_whisper and out is not None:
+            before = call_whisper(data, "input.wav")
+            after = call_whisper(out, filename)
+            print(f"  whisper-1: 前処理なし {before:.2f}秒 / あり {after:.2f}秒")
+
+    print()
+    print(f"件数: {len(samples)}")
+    print(f"送信量: {total_in:,} B -> {total_out:,} B ({1 - total_out / max(1, total_in):.0%} 削減)")
+    print(f"1件あたりの短縮（送信短縮 - 前処理時間, 上り {args.uplink_mbps} Mbps）: 平均 {statistics.mean(saved_upload) * 1000:.0f} ms")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,100 @@
+"""アプリの起動の速さ（モジュールの読み込み時間と、ログイン画面が出るまでの時間）を測る
+
+1. アプリが読み込むモジュールごとに、新しいPythonプロセスで `-X importtime` を使って読み込み時間を測る
+   （streamlit 本体は読み込み済みとして、その分を除く）
+2. benchmarks/mock_services.py のモックに向けてアプリを起動し、起動直後の最初の接続で
+   ログイン画面が表示されるまでと、ログインしてから講義の一覧が表示されるまでの時間を測る
+
+使い方（リポジトリ直下で実行）:
+    python benchmarks/bench_cold_start.py
+    python benchmarks/bench_cold_start.py --max-login-seconds 0.5   # 超えたら終了コード1（退行の検出用）
+"""
+import argparse
+import asyncio
+import os
+import shutil
+import subprocess
+import sys
+import tempfile
+import time
+
+sys.path.insert(0, os.path.dirname(os.path.abspath(__file__)))
+
+import load_test  # noqa: E402
+import mock_services  # noqa: E402
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+# ログイン画面の前に読み込むもの / ログイン後に読み込むもの
+LOGIN_MODULES = ["streamlit.components.v1"]
+APP_MODULES = [
+    "streamlit_mic_recorder", "streamlit_webrtc", "openai", "gspread",
+    "dify_client", "sheet_logger", "tts_cache", "audio_preprocess", "material_index",
+    "keyword_scoring", "session_store",
+]
+
+
+def import_seconds(module):
+    """streamlit を読み込んだ後に module を読み込むのにかかる秒数（入っていなければ None）"""
+    result = subprocess.run(
+        [sys.executable, "-X", "importtime", "-c", f"import streamlit; import {module}"],
+        cwd=ROOT, capture_output=True, text=True,
+    )
+    if result.returncode != 0:
+        return None
+    for line in reversed(result.stderr.splitlines()):
+        parts = [p.strip() for p in line.split("|")]
+        if len(parts) == 3 and parts[2] == module:
+            return int(parts[1]) / 1e6
+    return 0.0
+
+
+async def first_paint(url, user):
+    """(ログイン画面が出るまで, ログインしてから講義の一覧が出るまで) の秒数"""
+    async with load_test.Student(url, user) as student:
+        start = time.perf_counter()
+        await student.run()
+        login_seconds = time.perf_counter() - start
+        start = time.perf_counter()
+        await student.login()
+        return login_seconds, time.perf_counter() - start
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument("--max-login-seconds", type=float, help="ログイン画面が出るまでの上限（超えたら失敗）")
+    parser.add_argument("--skip-imports", action="store_true")
+    args = parser.parse_args()
+
+    if not args.skip_imports:
+        print("モジュールの読み込み時間（streamlit 読み込み後の追加分）:")
+        for module in LOGIN_MODULES + APP_MODULES:
+            seconds = import_seconds(module)
+            where = "ログイン前" if module in LOGIN_MODULES else "ログイン後"
+            print(f"  {module:24s} {where}  " + ("未インストール" if seconds is None else f"{seconds * 1000:7.1f} ms"))
+
+    _, base_url = mock_services.serve(profile="zero")
+    directory = tempfile.mkdtemp(prefix="interview-cold-")
+    load_test.write_secrets(directory, base_url, 2)
+    port = load_test.free_port()
+    started = time.perf_counter()
+    server = load_test.start_app(directory, port)
+    boot_seconds = time.perf_counter() - started
+    url = f"ws://127.0.0.1:{port}/_stcore/stream"
+    try:
+        cold = asyncio.run(first_paint(url, load_test.student_name(0)))
+        warm = asyncio.run(first_paint(url, load_test.student_name(1)))
+    finally:
+        server.terminate()
+        server.wait(timeout=30)
+        shutil.rmtree(directory, ignore_errors=True)
+
+    print(f"サーバーの起動: {boot_seconds:.2f}秒")
+    print(f"ログイン画面まで: 最初の接続 {cold[0] * 1000:.0f} ms / 2人目 {warm[0] * 1000:.0f} ms")
+    print(f"ログインから講義の一覧まで: 最初の接続 {cold[1] * 1000:.0f} ms / 2人目 {warm[1] * 1000:.0f} ms")
+    if args.max_login_seconds is not None and cold[0] > args.max_login_seconds:
+        print(f"ログイン画面まで {cold[0]:.2f}秒かかり、上限 {args.max_login_seconds}秒を超えました")
+        sys.exit(1)
+
+
+if __name__ == "__main__":
+    main()
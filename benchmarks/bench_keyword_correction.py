@@ -0,0 +1,104 @@
+"""ローカル校正（keyword_correction）の速度と精度を書き起こしコーパスで測る
+
+使い方（リポジトリ直下で実行）:
+    python benchmarks/bench_keyword_correction.py
+    python benchmarks/bench_keyword_correction.py --corpus my_transcripts.jsonl --with-llm
+
+コーパスは1行1件のJSONL: {"keywords": 語句ファイル, "transcript": Whisperの出力, "expected": 正解の文}
+LLMに回さずにローカルの結果を使った件のうち、正解の文と違うものは失敗（NG）として数える。
+--with-llm を付けると、LLMに回した件数分だけ gpt-4o-mini も呼んで所要時間を比べる
+（環境変数 OPENAI_API_KEY が必要）。
+"""
+import argparse
+import json
+import os
+import statistics
+import sys
+import time
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+import keyword_correction  # noqa: E402
+import vocabulary  # noqa: E402
+
+DEFAULT_CORPUS = os.path.join(os.path.dirname(os.path.abspath(__file__)), "transcripts.jsonl")
+
+
+def percentile(values, p):
+    values = sorted(values)
+    return values[min(len(values) - 1, int(len(values) * p))]
+
+
+def call_llm(text, keywords_str):
+    from openai import OpenAI
+
+    client = OpenAI(api_key=os.environ["OPENAI_API_KEY"])
+    start = time.perf_counter()
+    client.chat.completions.create(
+        model="gpt-4o-mini",
+        messages=[
+            {"role": "system", "content": "あなたは優秀な校正者です。音声書き起こしにみられる誤字脱字などを修正してください。"},
+            {"role": "user", "content": f"{text}\n\n■ 重要語句: {keywords_str}"},
+        ],
+        temperature=0.0,
+    )
+    return time.perf_counter() - start
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument("--corpus", default=DEFAULT_CORPUS)
+    parser.add_argument("--repeat", type=int, default=200, help="1件あたりの計測回数")
+    parser.add_argument("--with-llm", action="store_true")
+    args = parser.parse_args()
+
+    root = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+    with open(args.corpus, encoding="utf-8") as f:
+        corpus = [json.loads(line) for line in f if line.strip()]
+
+    latencies = []
+    exact = 0
+    term_hits = 0
+    term_total = 0
+    skipped_llm = 0
+    failures = []
+    llm_seconds = []
+    for item in corpus:
+        index = vocabulary.get_index(os.path.join(root, item["keywords"]))
+        keyword_correction.correct(item["transcript"], index)  # 照合器の構築を計測から外す
+
+        start = time.perf_counter()
+        for _ in range(args.repeat):
+            result = keyword_correction.correct(item["transcript"], index)
+        latencies.append((time.perf_counter() - start) / args.repeat)
+
+        confident = keyword_correction.is_confident(result)
+        if confident:
+            skipped_llm += 1
+            exact += result.text == item["expected"]
+            if result.text != item["expected"]:
+                failures.append(item)
+            expected_terms = index.find_terms(item["expected"])
+            term_total += len(expected_terms)
+            term_hits += len(expected_terms & index.find_terms(result.text))
+        elif args.with_llm:
+            llm_seconds.append(call_llm(result.text, index.correction_prompt))
+
+        mark = ("NG   " if result.text != item["expected"] else "local") if confident else "LLM  "
+        print(f"[{mark}] conf={result.confidence:.2f} {item['transcript']} -> {result.text}")
+
+    print()
+    print(f"件数: {len(corpus)}")
+    print(f"ローカル校正の所要時間: 平均 {statistics.mean(latencies) * 1000:.3f} ms / p95 {percentile(latencies, 0.95) * 1000:.3f} ms")
+    print(f"LLMを省略できた割合: {skipped_llm / len(corpus):.0%}")
+    if skipped_llm:
+        print(f"省略した分の正解率: 完全一致 {exact / skipped_llm:.0%} / 重要語句の再現率 {term_hits / max(1, term_total):.0%}")
+    print(f"失敗（ローカルで確定した誤り）: {len(failures)}件")
+    for item in failures:
+        print(f"  {item['transcript']} (正解: {item['expected']})")
+    if llm_seconds:
+        print(f"LLM校正の所要時間: 平均 {statistics.mean(llm_seconds) * 1000:.0f} ms")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,73 @@
+"""重要語句の採点（keyword_scoring）の速度を、1件ずつとログ全体の一括で測る
+
+使い方（リポジトリ直下で実行）:
+    python benchmarks/bench_keyword_scoring.py
+    python benchmarks/bench_keyword_scoring.py --answers 100000 --turns-per-session 6
+
+書き起こしコーパス（transcripts.jsonl）の正解文を回答として繰り返し使い、
+会話ごとの語句カバー率を、語句の集合で求める素直な方法とビット列で求める方法で比べる。
+"""
+import argparse
+import json
+import os
+import sys
+import time
+
+import numpy as np
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+import keyword_scoring  # noqa: E402
+import vocabulary  # noqa: E402
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+DEFAULT_CORPUS = os.path.join(os.path.dirname(os.path.abspath(__file__)), "transcripts.jsonl")
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument("--corpus", default=DEFAULT_CORPUS)
+    parser.add_argument("--keywords", default="keywords01.txt")
+    parser.add_argument("--answers", type=int, default=50000)
+    parser.add_argument("--turns-per-session", type=int, default=5)
+    args = parser.parse_args()
+
+    with open(args.corpus, encoding="utf-8") as f:
+        sentences = [json.loads(line)["expected"] for line in f if line.strip()]
+    # 同じ文ばかりにならないよう、文を組み合わせて回答を作る
+    answers = [sentences[i % len(sentences)] + sentences[(i * 7 + 3) % len(sentences)] + f"（{i % 997}）"
+               for i in range(args.answers)]
+    groups = np.arange(args.answers) // args.turns_per_session
+
+    path = os.path.join(ROOT, args.keywords)
+    index = vocabulary.get_index(path)
+    scorer = keyword_scoring.get_scorer(path)
+    scorer.score(answers[0])  # 照合器の構築を計測から外す
+
+    start = time.perf_counter()
+    for text in answers[:1000]:
+        scorer.score(text)
+    single = (time.perf_counter() - start) / min(1000, len(answers))
+
+    start = time.perf_counter()
+    covered = {}
+    for text, group in zip(answers, groups):
+        covered.setdefault(group, set()).update(index.find_terms(text))
+    naive_counts = [len(covered[g]) for g in sorted(covered)]
+    naive = time.perf_counter() - start
+
+    start = time.perf_counter()
+    per_session = keyword_scoring.combine(scorer.score_many(answers), groups)
+    counts = keyword_scoring.popcount(per_session)
+    batch = time.perf_counter() - start
+    assert list(counts) == naive_counts
+
+    print(f"語句数: {scorer.total} / 回答: {args.answers}件 / 会話: {len(counts)}件")
+    print(f"1件の採点: {single * 1e6:.1f} µs")
+    print(f"一括（語句の集合）: {naive:.2f}秒（{args.answers / naive:,.0f} 件/秒）")
+    print(f"一括（ビット列）:   {batch:.2f}秒（{args.answers / batch:,.0f} 件/秒、{naive / batch:.1f}倍）")
+    print(f"会話あたりの語句カバー率: 平均 {counts.mean() / scorer.total:.0%}")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,39 @@
+"""区間ごとの書き起こしのつなぎ目（chunked_transcription.stitch）が正しくつながるかを確かめる
+
+使い方（リポジトリ直下で実行）:
+    python benchmarks/bench_stitch.py
+
+stitch_cases.jsonl の各行は {"left": 前の区間, "right": 次の区間, "expected": つないだ結果}。
+語尾の「です」などが重なりの外で一致して文が消えた例も入れてある。合わない行があれば終了コード1で終わる。
+"""
+import json
+import os
+import sys
+import time
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+import chunked_transcription  # noqa: E402
+
+DEFAULT_CASES = os.path.join(os.path.dirname(os.path.abspath(__file__)), "stitch_cases.jsonl")
+
+
+def main(argv):
+    path = argv[0] if argv else DEFAULT_CASES
+    with open(path, encoding="utf-8") as f:
+        cases = [json.loads(line) for line in f if line.strip()]
+
+    failures = 0
+    start = time.perf_counter()
+    for case in cases:
+        result = chunked_transcription.stitch(case["left"], case["right"])
+        if result != case["expected"]:
+            failures += 1
+            print(f"不一致: {case['left']} + {case['right']}\n  結果: {result}\n  正解: {case['expected']}")
+    elapsed = time.perf_counter() - start
+    print(f"{len(cases) - failures}/{len(cases)}件が一致（1件あたり {elapsed / max(1, len(cases)) * 1e6:.0f} µs）")
+    return 1 if failures else 0
+
+
+if __name__ == "__main__":
+    sys.exit(main(sys.argv[1:]))
@@ -0,0 +1,166 @@
+"""ワーカー数（serve_workers.py）を変えたときに、同じ人数の面談をどれだけ速くさばけるかを測る
+
+benchmarks/mock_services.py のモックを別プロセスで起動し、ワーカー数ごとに serve_workers.start_workers で
+アプリを起動して、load_test.py と同じ学生（WebSocket のクライアント）に面談を最後まで行わせる。
+学生 i は i 番目 % ワーカー数 のワーカーにつなぐ（前段のプロキシのスティッキーセッションの代わり）。
+スクリプトの実行にかかるCPUがボトルネックになるよう、既定ではモックの遅延を小さくし（fast）、
+レート制限も計測の邪魔にならない値にしておく。
+
+使い方（リポジトリ直下で実行）:
+    python benchmarks/bench_workers.py
+    python benchmarks/bench_workers.py --workers 1,2,4,8 --students 48 --max-turns 10
+
+ワーカー数がCPUのコア数を超えると伸びなくなる（結果と一緒にコア数を出す）。
+"""
+import argparse
+import asyncio
+import os
+import shutil
+import socket
+import subprocess
+import sys
+import tempfile
+import time
+
+import requests
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+sys.path.insert(0, ROOT)
+sys.path.insert(0, os.path.dirname(os.path.abspath(__file__)))
+
+import load_test  # noqa: E402
+import mock_services  # noqa: E402
+import serve_workers  # noqa: E402
+
+# 計測中にレート制限で待たされないようにする（1分あたりの回数, 瞬間的に許す回数）
+UNLIMITED = [1_000_000, 10_000]
+
+
+def start_mock(profile):
+    port = load_test.free_port()
+    mock = subprocess.Popen(
+        [sys.executable, os.path.join(os.path.dirname(os.path.abspath(__file__)), "mock_services.py"),
+         "--port", str(port), "--profile", profile],
+        stdout=subprocess.DEVNULL, stderr=subprocess.DEVNULL,
+    )
+    base_url = f"http://127.0.0.1:{port}"
+    deadline = time.monotonic() + 30
+    while time.monotonic() < deadline:
+        try:
+            requests.get(f"{base_url}/_stats", timeout=1)
+            return mock, base_url
+        except requests.ConnectionError:
+            time.sleep(0.1)
+    mock.kill()
+    raise RuntimeError("モックサーバーが起動しませんでした")
+
+
+async def run_class(args, urls):
+    """学生を各ワーカーに振り分けて面談させ、(結果, 全員が終わるまでの秒数) を返す"""
+    args.all_done = asyncio.Event()
+    results = [{"done": asyncio.Event()} for _ in range(args.students)]
+    started = time.perf_counter()
+    tasks = [asyncio.create_task(load_test.run_student(i, args, urls[i % len(urls)], results[i]))
+             for i in range(args.students)]
+    for r in results:
+        await r["done"].wait()
+    wall = time.perf_counter() - started
+    args.all_done.set()
+    await asyncio.gather(*tasks)
+    return results, wall
+
+
+async def warm_up(urls, first_index):
+    """ログイン後に読み込むモジュールがあるので、各ワーカーに1人ずつログインさせておく"""
+    for i, url in enumerate(urls):
+        async with load_test.Student(url, load_test.student_name(first_index + i)) as student:
+            await student.run()
+            await student.login()
+
+
+def measure(args, base_url, workers):
+    directory = tempfile.mkdtemp(prefix="interview-workers-")
+    load_test.write_secrets(directory, base_url, args.students + workers)
+    with open(os.path.join(directory, ".streamlit", "secrets.toml"), "a", encoding="utf-8") as f:
+        f.write("\n[rate_limits]\n")
+        for provider in ("dify", "whisper", "chat", "tts", "embeddings", "sheets"):
+            f.write(f"{provider} = {UNLIMITED}\n")
+    port = find_ports(workers)
+    processes = serve_workers.start_workers(
+        workers, port, os.path.join(directory, "shared_state.sqlite3"), cwd=directory,
+        streamlit_args=["--server.enableXsrfProtection", "false", "--browser.gatherUsageStats", "false"],
+        base_env=load_test.app_env(directory), stdout=subprocess.DEVNULL, stderr=subprocess.PIPE,
+    )
+    try:
+        for i, process in enumerate(processes):
+            load_test.wait_until_ready(process, port + i)
+        urls = [f"ws://127.0.0.1:{port + i}/_stcore/stream" for i in range(workers)]
+        asyncio.run(warm_up(urls, args.students))
+        results, wall = asyncio.run(run_class(args, urls))
+    finally:
+        serve_workers.stop_workers(processes)
+        shutil.rmtree(directory, ignore_errors=True)
+    turns = [t for r in results for t in r.get("turns", [])]
+    errors = [e for r in results for e in r.get("errors", [])]
+    return {
+        "workers": workers,
+        "turns": len(turns),
+        "wall": wall,
+        "throughput": len(turns) / wall,
+        "p95": load_test.percentile(turns, 0.95),
+        "completed": sum(r.get("completed", False) for r in results),
+        "errors": errors,
+    }
+
+
+def find_ports(count):
+    """連続して空いているポートの先頭を返す"""
+    for _ in range(100):
+        port = load_test.free_port()
+        if port + count > 65535:
+            continue
+        if all(port_is_free(port + i) for i in range(1, count)):
+            return port
+    raise RuntimeError("連続した空きポートが見つかりませんでした")
+
+
+def port_is_free(port):
+    with socket.socket() as s:
+        try:
+            s.bind(("127.0.0.1", port))
+        except OSError:
+            return False
+    return True
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument("--workers", default="1,2,4", help="カンマ区切りのワーカー数")
+    parser.add_argument("--students", type=int, default=24)
+    parser.add_argument("--profile", choices=sorted(mock_services.PROFILES), default="fast")
+    parser.add_argument("--think-seconds", type=float, default=0.0)
+    parser.add_argument("--max-turns", type=int, default=10)
+    parser.add_argument("--ramp-seconds", type=float, default=0.0)
+    args = parser.parse_args()
+
+    mock, base_url = start_mock(args.profile)
+    try:
+        rows = [measure(args, base_url, int(n)) for n in args.workers.split(",")]
+    finally:
+        mock.terminate()
+        mock.wait(timeout=10)
+
+    print(f"CPUコア数: {os.cpu_count()} / 学生: {args.students}人 / モック: {args.profile}")
+    print("ワーカー  送信数  所要時間  スループット   倍率  効率   p95   面談を終えた人数  エラー")
+    base = rows[0]["throughput"] / rows[0]["workers"]
+    for row in rows:
+        speedup = row["throughput"] / base
+        print(f"{row['workers']:>6}  {row['turns']:>6}  {row['wall']:>7.1f}秒  {row['throughput']:>7.2f} 件/秒"
+              f"  {speedup:>5.2f}  {speedup / row['workers']:>4.0%}  {row['p95']:>4.2f}秒"
+              f"  {row['completed']:>6}/{args.students}  {len(row['errors'])}件")
+    for error in sorted({e for row in rows for e in row["errors"]})[:10]:
+        print(f"  {error[:200]}")
+
+
+if __name__ == "__main__":
+    main()
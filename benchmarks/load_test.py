@@ -0,0 +1,315 @@
+"""1つのStreamlitプロセスで何人の学生の面談を同時にさばけるかを、モックサーバー相手に測る
+
+benchmarks/mock_services.py のモック（Dify・OpenAI・スプレッドシート）を起動し、外部APIの
+URLをすべてモックに向けた secrets.toml を一時ディレクトリに書いてから、その中で
+`streamlit run my_app_login3.py` を1プロセス起動する。各学生はブラウザの代わりに
+Streamlit の WebSocket（/_stcore/stream）へ直接つなぎ、ウィジェットの値を送って
+ログイン → 講義選択 → 面談が終わるまで回答を送信、を繰り返す。
+本番と同じく1つのサーバープロセスに全員のセッションが載るので、共有の接続プール・
+キャッシュ・ログ送信スレッドの効き方やメモリの増え方をそのまま測れる。
+
+使い方（リポジトリ直下で実行）:
+    python benchmarks/load_test.py --students 20
+    python benchmarks/load_test.py --students 50 --profile fast --error-rate 0.02 --think-seconds 1
+
+テキスト入力の経路だけを使う（録音は再現しないので、送信・回答・音声合成・ログが対象）。
+アプリの依存に加えて websockets が必要（pip install -r benchmarks/requirements.txt）。
+"""
+import argparse
+import asyncio
+import os
+import shutil
+import socket
+import statistics
+import subprocess
+import sys
+import tempfile
+import time
+import uuid
+
+import requests
+import websockets
+from streamlit.proto.BackMsg_pb2 import BackMsg
+from streamlit.proto.ForwardMsg_pb2 import ForwardMsg
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+sys.path.insert(0, ROOT)
+sys.path.insert(0, os.path.dirname(os.path.abspath(__file__)))
+
+import metrics  # noqa: E402
+import mock_services  # noqa: E402
+import session_store  # noqa: E402
+import tts_cache  # noqa: E402
+import turn_journal  # noqa: E402
+
+APP_PATH = os.path.join(ROOT, "my_app_login3.py")
+PASSWORD = "loadtest"
+# 面談の状態はサーバー側に残る（session_store.py）ので、実行ごとに別のユーザー名を使う
+RUN_ID = uuid.uuid4().hex[:6]
+COMPLETED_TEXT = "全ての学習項目"
+ANSWERS = [
+    "マグマの粘り気が強いと、火山は盛り上がった形になります。",
+    "粘り気が弱いと溶岩が広がって、傾斜が緩やかな火山になります。",
+    "火山灰には石英や長石などの無色鉱物と、輝石や角閃石などの有色鉱物が含まれています。",
+    "有色鉱物が多いと黒っぽく、無色鉱物が多いと白っぽくなります。",
+    "火山岩は地表近くで急に冷えて、深成岩は地下深くでゆっくり冷えてできます。",
+]
+FINISHED = {
+    ForwardMsg.ScriptFinishedStatus.FINISHED_SUCCESSFULLY,
+    ForwardMsg.ScriptFinishedStatus.FINISHED_FRAGMENT_RUN_SUCCESSFULLY,
+    ForwardMsg.ScriptFinishedStatus.FINISHED_WITH_COMPILE_ERROR,
+}
+
+
+def percentile(values, p):
+    values = sorted(values)
+    return values[min(len(values) - 1, int(len(values) * p))] if values else float("nan")
+
+
+def free_port():
+    with socket.socket() as s:
+        s.bind(("127.0.0.1", 0))
+        return s.getsockname()[1]
+
+
+def rss_bytes(pid):
+    """Linux の /proc から常駐メモリ量を読む"""
+    with open(f"/proc/{pid}/status") as f:
+        for line in f:
+            if line.startswith("VmRSS:"):
+                return int(line.split()[1]) * 1024
+    return 0
+
+
+def student_name(index):
+    return f"loadtest-{RUN_ID}-{index:03d}"
+
+
+def write_secrets(directory, base_url, students):
+    os.makedirs(os.path.join(directory, ".streamlit"), exist_ok=True)
+    users = "\n".join(f'{student_name(i)} = "{PASSWORD}"' for i in range(students))
+    with open(os.path.join(directory, ".streamlit", "secrets.toml"), "w", encoding="utf-8") as f:
+        f.write(f'''DIFY_API_KEY = "loadtest"
+OPENAI_API_KEY = "loadtest"
+DIFY_BASE_URL = "{base_url}/v1"
+OPENAI_BASE_URL = "{base_url}/openai/v1"
+spreadsheet_url = "https://docs.google.com/spreadsheets/d/loadtest"
+SHEETS_MOCK_URL = "{base_url}/sheets/loadtest"
+
+[passwords]
+{users}
+
+[connections.gsheets]
+''')
+
+
+def app_env(directory):
+    """アプリが書くファイル（音声キャッシュ・面談の状態・ログのジャーナル・メトリクス）を directory に置く環境変数
+
+    既定の置き場所はリポジトリ直下で本番と共通なので、モックの音声やログをそこに書かないようにする。
+    """
+    env = dict(os.environ)
+    env[tts_cache.CACHE_DIR_ENV] = os.path.join(directory, ".tts_cache")
+    env[session_store.STORE_ENV] = os.path.join(directory, ".session_store.sqlite3")
+    env[turn_journal.JOURNAL_ENV] = os.path.join(directory, ".turn_journal.sqlite3")
+    env[metrics.EXPORT_DIR_ENV] = directory
+    return env
+
+
+def start_app(directory, port):
+    """一時ディレクトリを作業ディレクトリにしてアプリを起動し、応答するまで待つ"""
+    server = subprocess.Popen(
+        [sys.executable, "-m", "streamlit", "run", APP_PATH,
+         "--server.headless", "true", "--server.port", str(port),
+         "--server.enableXsrfProtection", "false", "--browser.gatherUsageStats", "false"],
+        cwd=directory, env=app_env(directory), stdout=subprocess.DEVNULL, stderr=subprocess.PIPE,
+    )
+    return wait_until_ready(server, port)
+
+
+def wait_until_ready(server, port):
+    """サーバーが /_stcore/health に応答するまで待つ（stderr=PIPE で起動しておく）"""
+    deadline = time.monotonic() + 60
+    while time.monotonic() < deadline:
+        if server.poll() is not None:
+            raise RuntimeError(f"アプリが起動しませんでした: {server.stderr.read().decode(errors='replace')[-2000:]}")
+        try:
+            if requests.get(f"http://127.0.0.1:{port}/_stcore/health", timeout=1).ok:
+                return server
+        except requests.ConnectionError:
+            pass
+        time.sleep(0.2)
+    server.kill()
+    raise RuntimeError("アプリの起動がタイムアウトしました")
+
+
+class Student:
+    """ブラウザの代わりに WebSocket でアプリを操作する1人の学生"""
+
+    def __init__(self, url, user):
+        self.url = url
+        self.user = user
+        self.widgets = {}   # (種類, ラベル) -> (ウィジェットID, fragment_id)
+        self.texts = []     # 直前の実行で描画された文字列
+        self.errors = []
+        self.completed = False
+
+    async def __aenter__(self):
+        self.ws = await websockets.connect(self.url, subprotocols=["streamlit"], max_size=None)
+        return self
+
+    async def __aexit__(self, *exc):
+        await self.ws.close()
+
+    def _collect(self, msg):
+        if not msg.HasField("delta") or not msg.delta.HasField("new_element"):
+            return
+        element = msg.delta.new_element
+        kind = element.WhichOneof("type")
+        if kind in ("text_input", "text_area", "radio", "button"):
+            widget = getattr(element, kind)
+            self.widgets[kind, widget.label] = (widget.id, msg.delta.fragment_id)
+            if kind == "radio":
+                self.options = list(widget.options)
+        elif kind == "markdown":
+            self.texts.append(element.markdown.body)
+        elif kind == "alert":
+            self.texts.append(element.alert.body)
+            if COMPLETED_TEXT in element.alert.body:
+                self.completed = True
+        elif kind == "exception":
+            self.errors.append(f"{element.exception.type}: {element.exception.message}")
+
+    async def run(self, widgets=(), fragment_id=""):
+        """ウィジェットの値を送ってスクリプトを実行させ、st.rerun() の分も含めて終わるまで待つ"""
+        back = BackMsg()
+        state = back.rerun_script
+        state.fragment_id = fragment_id
+        for widget_id, field, value in widgets:
+            w = state.widget_states.widgets.add()
+            w.id = widget_id
+            setattr(w, field, value)
+        await self.ws.send(back.SerializeToString())
+        self.texts = []
+        while True:
+            msg = ForwardMsg()
+            msg.ParseFromString(await self.ws.recv())
+            self._collect(msg)
+            if msg.HasField("script_finished") and msg.script_finished in FINISHED:
+                return
+
+    def widget(self, kind, label):
+        return self.widgets[kind, label]
+
+    async def login(self):
+        await self.run([
+            (self.widget("text_input", "ユーザーID")[0], "string_value", self.user),
+            (self.widget("text_input", "パスワード")[0], "string_value", PASSWORD),
+            (self.widget("button", "ログイン")[0], "trigger_value", True),
+        ])
+
+
+async def run_student(index, args, url, result):
+    """1人の学生として面談を最後まで行い、result に計測値を入れる"""
+    user = student_name(index)
+    result.update(user=user, turns=[], errors=[], completed=False)
+    await asyncio.sleep(args.ramp_seconds * index / max(1, args.students))
+    try:
+        async with Student(url, user) as student:
+            await student.run()
+            await student.login()
+
+            start = time.perf_counter()
+            await student.run([
+                (student.widget("radio", "講義リスト")[0], "string_value", student.options[0]),
+                (student.widget("button", "学習を開始する")[0], "trigger_value", True),
+            ])
+            result["start_seconds"] = time.perf_counter() - start
+
+            for turn in range(args.max_turns):
+                if student.completed:
+                    break
+                await asyncio.sleep(args.think_seconds)
+                text_id, fragment_id = student.widget("text_area", "メッセージ入力")
+                button_id, _ = student.widget("button", "送信")
+                start = time.perf_counter()
+                await student.run([
+                    (text_id, "string_value", ANSWERS[turn % len(ANSWERS)]),
+                    (button_id, "trigger_value", True),
+                ], fragment_id=fragment_id)
+                result["turns"].append(time.perf_counter() - start)
+            result["completed"] = student.completed
+            result["errors"].extend(student.errors)
+            # 全員がつながっている間にメモリを測るので、それまでセッションを閉じない
+            result["done"].set()
+            await args.all_done.wait()
+    except Exception as e:
+        result["errors"].append(f"{type(e).__name__}: {e}")
+        result["done"].set()
+
+
+async def run_all(args, url, server_pid):
+    args.all_done = asyncio.Event()
+    results = [{"done": asyncio.Event()} for _ in range(args.students)]
+    started = time.perf_counter()
+    tasks = [asyncio.create_task(run_student(i, args, url, results[i])) for i in range(args.students)]
+    for r in results:
+        await r["done"].wait()
+    wall = time.perf_counter() - started
+    rss = rss_bytes(server_pid)
+    args.all_done.set()
+    await asyncio.gather(*tasks)
+    return results, wall, rss
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument("--students", type=int, default=10)
+    parser.add_argument("--profile", choices=sorted(mock_services.PROFILES), default="realistic")
+    parser.add_argument("--error-rate", type=float, default=0.0)
+    parser.add_argument("--think-seconds", type=float, default=0.0, help="学生が次の回答を入力するまでの時間")
+    parser.add_argument("--max-turns", type=int, default=10)
+    parser.add_argument("--ramp-seconds", type=float, default=0.0, help="全員がつなぎ終えるまでの時間")
+    args = parser.parse_args()
+
+    _, base_url = mock_services.serve(profile=args.profile, error_rate=args.error_rate)
+    directory = tempfile.mkdtemp(prefix="interview-load-")
+    # 最後の1人分は準備運転用
+    write_secrets(directory, base_url, args.students + 1)
+    port = free_port()
+    server = start_app(directory, port)
+    url = f"ws://127.0.0.1:{port}/_stcore/stream"
+    try:
+        # ログイン後に読み込むモジュールがあるので、1人ログインさせてから基準のメモリを測る
+        async def warm_up():
+            async with Student(url, student_name(args.students)) as student:
+                await student.run()
+                await student.login()
+        asyncio.run(warm_up())
+        rss_before = rss_bytes(server.pid)
+        results, wall, rss_after = asyncio.run(run_all(args, url, server.pid))
+    finally:
+        server.terminate()
+        server.wait(timeout=30)
+        shutil.rmtree(directory, ignore_errors=True)
+
+    turns = [t for r in results for t in r.get("turns", [])]
+    starts = [r["start_seconds"] for r in results if "start_seconds" in r]
+    errors = [e for r in results for e in r.get("errors", [])]
+    print(f"学生数: {args.students}（面談を終えた人数 {sum(r.get('completed', False) for r in results)}）")
+    print(f"所要時間: {wall:.1f}秒 / 送信 {len(turns)}件 / スループット {len(turns) / wall:.2f} 件/秒")
+    if turns:
+        print(f"送信から画面更新まで: p50 {percentile(turns, 0.5):.2f}秒 / p95 {percentile(turns, 0.95):.2f}秒"
+              f" / p99 {percentile(turns, 0.99):.2f}秒 / 最大 {max(turns):.2f}秒 / 平均 {statistics.mean(turns):.2f}秒")
+    if starts:
+        print(f"講義選択から最初の質問まで: p50 {percentile(starts, 0.5):.2f}秒 / p95 {percentile(starts, 0.95):.2f}秒")
+    print(f"サーバーのRSS: {rss_after / 2**20:.0f} MB（接続前から +{(rss_after - rss_before) / 2**20:.1f} MB、"
+          f"セッションあたり {(rss_after - rss_before) / max(1, args.students) / 1024:.0f} KB）")
+    print(f"エラー: {len(errors)}件")
+    for error in sorted(set(errors))[:10]:
+        print(f"  {error[:200]}")
+    print(f"モックへの呼び出し: {requests.get(f'{base_url}/_stats', timeout=5).json()}")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,323 @@
+"""負荷試験用の Dify / OpenAI / Googleスプレッドシート のモックサーバー
+
+アプリが呼ぶエンドポイントと同じ形の応答を、設定した遅延・エラー率で返す（料金はかからない）。
+    POST /v1/files/upload, /v1/chat-messages（blocking / streaming）
+    POST /openai/v1/audio/transcriptions, /openai/v1/chat/completions, /openai/v1/audio/speech, /openai/v1/embeddings
+    POST /sheets/<id>/append, GET /sheets/<id>/values?column=N（列の値）/ ?range=A2:H（2行目以降の行）
+    GET  /_stats（エンドポイントごとの呼び出し数・エラー数）
+
+使い方（リポジトリ直下で実行）:
+    python benchmarks/mock_services.py --port 8900 --profile realistic --error-rate 0.02
+
+アプリを向ける場合の .streamlit/secrets.toml:
+    DIFY_BASE_URL = "http://127.0.0.1:8900/v1"
+    OPENAI_BASE_URL = "http://127.0.0.1:8900/openai/v1"
+    SHEETS_MOCK_URL = "http://127.0.0.1:8900/sheets/loadtest"
+    （spreadsheet_url はGoogleスプレッドシートのURLのまま。SHEETS_MOCK_URL があるとログはモックに書かれる）
+"""
+import argparse
+import json
+import math
+import random
+import re
+import threading
+import time
+import uuid
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+from urllib.parse import parse_qs, urlparse
+
+# エンドポイントごとの遅延（中央値の秒数, 対数正規分布のσ）
+PROFILES = {
+    "realistic": {
+        "upload": (1.5, 0.4),
+        "chat_first_token": (1.2, 0.5),
+        "chat_chunk": (0.03, 0.5),
+        "chat_blocking": (4.0, 0.5),
+        "transcription": (1.0, 0.4),
+        "completion": (0.8, 0.4),
+        "speech": (0.9, 0.4),
+        "embeddings": (0.2, 0.3),
+        "sheets": (0.6, 0.5),
+    },
+}
+PROFILES["fast"] = {name: (median * 0.01, sigma) for name, (median, sigma) in PROFILES["realistic"].items()}
+PROFILES["zero"] = {name: (0.0, 0.0) for name in PROFILES["realistic"]}
+
+# エラーのときに返すステータス（429 には Retry-After を付ける）
+ERROR_STATUSES = (429, 500, 503)
+# この回数の発言で面談が終わる（is_finished を返す）
+FINISH_AFTER_TURNS = 5
+INTERVIEWER_QUESTIONS = [
+    "なるほど、よく覚えていますね。では、マグマの粘り気と火山の形にはどのような関係がありましたか？",
+    "いいですね。火山灰に含まれる鉱物には、どのような種類がありましたか？",
+    "そうですね。有色鉱物が多いと、岩石の色はどうなりますか？",
+    "よく説明できています。火山岩と深成岩では、でき方にどのような違いがありますか？",
+]
+FINAL_MESSAGE = "ありがとうございました。今日の授業の大事なところをしっかり振り返ることができましたね。"
+STUDENT_ANSWER = "マグマの粘り気が強いと、火山は盛り上がった形になって、火山灰は白っぽくなります。"
+# 合成音声として返すバイト数（1文字あたり）
+SPEECH_BYTES_PER_CHAR = 1500
+STREAM_CHUNK_CHARS = 4
+
+
+class Behavior:
+    """遅延とエラーの出し方（全リクエストで共有）"""
+
+    def __init__(self, profile, error_rate, seed=None):
+        self.profile = PROFILES[profile]
+        self.error_rate = error_rate
+        self.random = random.Random(seed)
+        self.lock = threading.Lock()
+        self.stats = {}
+
+    def latency(self, name):
+        median, sigma = self.profile[name]
+        if median <= 0:
+            return 0.0
+        with self.lock:
+            return median * math.exp(sigma * self.random.gauss(0, 1))
+
+    def sleep(self, name):
+        time.sleep(self.latency(name))
+
+    def error_status(self):
+        with self.lock:
+            if self.random.random() < self.error_rate:
+                return self.random.choice(ERROR_STATUSES)
+        return None
+
+    def count(self, endpoint, status):
+        with self.lock:
+            entry = self.stats.setdefault(endpoint, {"calls": 0, "errors": 0})
+            entry["calls"] += 1
+            entry["errors"] += status >= 400
+
+
+class MockState:
+    def __init__(self):
+        self.lock = threading.Lock()
+        self.turns = {}   # conversation_id -> 発言数
+        self.sheets = {}  # シートID -> 行のリスト
+
+    def next_answer(self, conversation_id):
+        with self.lock:
+            if not conversation_id:
+                conversation_id = uuid.uuid4().hex
+            turn = self.turns.get(conversation_id, 0) + 1
+            self.turns[conversation_id] = turn
+        finished = turn >= FINISH_AFTER_TURNS
+        answer = FINAL_MESSAGE if finished else INTERVIEWER_QUESTIONS[(turn - 1) % len(INTERVIEWER_QUESTIONS)]
+        return conversation_id, answer, finished
+
+
+class Handler(BaseHTTPRequestHandler):
+    protocol_version = "HTTP/1.1"
+    behavior = None
+    state = None
+
+    def log_message(self, format, *args):
+        pass
+
+    # --- 応答の書き出し ---
+
+    def _send(self, status, body=b"", content_type="application/json", headers=None):
+        if isinstance(body, (dict, list)):
+            body = json.dumps(body, ensure_ascii=False).encode("utf-8")
+        self.send_response(status)
+        self.send_header("Content-Type", content_type)
+        self.send_header("Content-Length", str(len(body)))
+        for name, value in (headers or {}).items():
+            self.send_header(name, value)
+        self.end_headers()
+        self.wfile.write(body)
+        self.behavior.count(self.endpoint, status)
+
+    def _fail_if_unlucky(self):
+        status = self.behavior.error_status()
+        if status is None:
+            return False
+        headers = {"Retry-After": "1"} if status == 429 else None
+        self._send(status, {"code": "mock_error", "message": f"mock error {status}"}, headers=headers)
+        return True
+
+    def _read_body(self):
+        length = int(self.headers.get("Content-Length") or 0)
+        return self.rfile.read(length) if length else b""
+
+    def _json_body(self):
+        body = self._read_body()
+        return json.loads(body) if body else {}
+
+    # --- ルーティング ---
+
+    def do_GET(self):
+        url = urlparse(self.path)
+        if url.path == "/_stats":
+            self.endpoint = "stats"
+            with self.behavior.lock:
+                stats = json.loads(json.dumps(self.behavior.stats))
+            with self.state.lock:
+                stats["sheet_rows"] = {k: len(v) for k, v in self.state.sheets.items()}
+            return self._send(200, stats)
+        match = re.fullmatch(r"/sheets/([^/]+)/values", url.path)
+        if match:
+            self.endpoint = "sheets_values"
+            query = parse_qs(url.query)
+            with self.state.lock:
+                rows = list(self.state.sheets.get(match.group(1), []))
+            if "range" in query:
+                start = int(re.match(r"[A-Z]+(\d+)", query["range"][0]).group(1))
+                return self._send(200, {"values": rows[start - 1:]})
+            column = int(query.get("column", ["1"])[0])
+            return self._send(200, {"values": [row[column - 1] for row in rows if len(row) >= column]})
+        self.endpoint = "unknown"
+        self._send(404, {"message": "not found"})
+
+    def do_POST(self):
+        path = urlparse(self.path).path
+        routes = {
+            "/v1/files/upload": self.upload,
+            "/v1/chat-messages": self.chat_messages,
+            "/openai/v1/audio/transcriptions": self.transcriptions,
+            "/openai/v1/chat/completions": self.completions,
+            "/openai/v1/audio/speech": self.speech,
+            "/openai/v1/embeddings": self.embeddings,
+        }
+        handler = routes.get(path)
+        match = re.fullmatch(r"/sheets/([^/]+)/append", path)
+        if handler:
+            self.endpoint = path.rsplit("/", 1)[-1]
+            return handler()
+        if match:
+            self.endpoint = "sheets_append"
+            return self.sheets_append(match.group(1))
+        self.endpoint = "unknown"
+        self._read_body()
+        self._send(404, {"message": "not found"})
+
+    # --- Dify ---
+
+    def upload(self):
+        self._read_body()
+        self.behavior.sleep("upload")
+        if self._fail_if_unlucky():
+            return
+        self._send(201, {"id": str(uuid.uuid4()), "name": "material.pdf", "created_at": int(time.time())})
+
+    def chat_messages(self):
+        payload = self._json_body()
+        if self._fail_if_unlucky():
+            return
+        conversation_id, answer, finished = self.state.next_answer(payload.get("conversation_id"))
+        metadata = {"workflow_outputs": {"is_finished": finished}}
+        if payload.get("response_mode") != "streaming":
+            self.behavior.sleep("chat_blocking")
+            return self._send(200, {
+                "event": "message", "message_id": uuid.uuid4().hex, "conversation_id": conversation_id,
+                "answer": answer, "metadata": metadata, "created_at": int(time.time()),
+            })
+
+        self.behavior.sleep("chat_first_token")
+        self.send_response(200)
+        self.send_header("Content-Type", "text/event-stream")
+        self.send_header("Transfer-Encoding", "chunked")
+        self.end_headers()
+        try:
+            for start in range(0, len(answer), STREAM_CHUNK_CHARS):
+                self._write_event({"event": "message", "conversation_id": conversation_id,
+                                   "answer": answer[start:start + STREAM_CHUNK_CHARS]})
+                self.behavior.sleep("chat_chunk")
+            self._write_event({"event": "message_end", "conversation_id": conversation_id, "metadata": metadata})
+            self.wfile.write(b"0\r\n\r\n")
+        except (BrokenPipeError, ConnectionResetError):
+            pass
+        self.behavior.count(self.endpoint, 200)
+
+    def _write_event(self, event):
+        data = f"data: {json.dumps(event, ensure_ascii=False)}\n\n".encode("utf-8")
+        self.wfile.write(f"{len(data):x}\r\n".encode("ascii") + data + b"\r\n")
+        self.wfile.flush()
+
+    # --- OpenAI ---
+
+    def transcriptions(self):
+        self._read_body()
+        self.behavior.sleep("transcription")
+        if self._fail_if_unlucky():
+            return
+        self._send(200, {"text": STUDENT_ANSWER})
+
+    def completions(self):
+        payload = self._json_body()
+        self.behavior.sleep("completion")
+        if self._fail_if_unlucky():
+            return
+        self._send(200, {
+            "id": f"chatcmpl-{uuid.uuid4().hex}", "object": "chat.completion", "created": int(time.time()),
+            "model": payload.get("model", "gpt-4o-mini"),
+            "choices": [{"index": 0, "message": {"role": "assistant", "content": STUDENT_ANSWER}, "finish_reason": "stop"}],
+            "usage": {"prompt_tokens": 0, "completion_tokens": 0, "total_tokens": 0},
+        })
+
+    def speech(self):
+        payload = self._json_body()
+        self.behavior.sleep("speech")
+        if self._fail_if_unlucky():
+            return
+        size = max(1, len(payload.get("input", ""))) * SPEECH_BYTES_PER_CHAR
+        self._send(200, b"\xff\xf3" * (size // 2), content_type="audio/mpeg")
+
+    def embeddings(self):
+        payload = self._json_body()
+        self.behavior.sleep("embeddings")
+        if self._fail_if_unlucky():
+            return
+        texts = payload.get("input") or []
+        if isinstance(texts, str):
+            texts = [texts]
+        data = []
+        for i, text in enumerate(texts):
+            rng = random.Random(text)
+            data.append({"object": "embedding", "index": i, "embedding": [rng.gauss(0, 1) for _ in range(64)]})
+        self._send(200, {"object": "list", "data": data, "model": payload.get("model"),
+                         "usage": {"prompt_tokens": 0, "total_tokens": 0}})
+
+    # --- スプレッドシート ---
+
+    def sheets_append(self, sheet_id):
+        payload = self._json_body()
+        self.behavior.sleep("sheets")
+        if self._fail_if_unlucky():
+            return
+        with self.state.lock:
+            self.state.sheets.setdefault(sheet_id, []).extend(payload.get("values", []))
+        self._send(200, {"updates": {"updatedRows": len(payload.get("values", []))}})
+
+
+def serve(port=0, profile="realistic", error_rate=0.0, seed=None):
+    """モックサーバーをバックグラウンドのスレッドで起動し、(サーバー, ベースURL) を返す"""
+    handler = type("MockHandler", (Handler,), {"behavior": Behavior(profile, error_rate, seed), "state": MockState()})
+    server = ThreadingHTTPServer(("127.0.0.1", port), handler)
+    server.daemon_threads = True
+    threading.Thread(target=server.serve_forever, name="mock-services", daemon=True).start()
+    return server, f"http://127.0.0.1:{server.server_address[1]}"
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument("--port", type=int, default=8900)
+    parser.add_argument("--profile", choices=sorted(PROFILES), default="realistic")
+    parser.add_argument("--error-rate", type=float, default=0.0)
+    parser.add_argument("--seed", type=int)
+    args = parser.parse_args()
+    server, base_url = serve(args.port, args.profile, args.error_rate, args.seed)
+    print(f"モックサーバー: {base_url}（Ctrl+C で終了）")
+    try:
+        while True:
+            time.sleep(3600)
+    except KeyboardInterrupt:
+        server.shutdown()
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,141 @@
+"""録音を重なりのある区間に分けて書き起こす
+
+録音が終わるのを待って全体を1回で書き起こすと、長い回答ほど停止後の待ち時間が長くなる。
+ここでは音声を WINDOW_SECONDS ごとの区間（前の区間と OVERLAP_SECONDS 重なる）に分け、
+区間が溜まるたびにワーカースレッドで書き起こしを始める。区間ごとの文字列は、
+重なり部分で共通する文字列を探してつなぎ合わせる（重なりの前後で2回書き起こされた部分を1回にする）。
+停止後に待つのは、最後の1区間の書き起こしだけになる。
+区間の書き起こしは全セッション共通のワーカーで、学生ごとに順番に行う（fair_executor）。
+"""
+import numpy as np
+
+import audio_preprocess
+from fair_executor import FairExecutor
+
+WINDOW_SECONDS = 8.0
+OVERLAP_SECONDS = 1.5
+# 録音後にまとめて書き起こす場合、これより長ければ区間に分けて並行に書き起こす
+PARALLEL_MIN_SECONDS = 20.0
+# 話す速さの目安（1秒あたりの文字数）。重なりの OVERLAP_SECONDS に入る文字数の見積もりに使う
+SPEAKING_CHARS_PER_SECOND = 8
+OVERLAP_CHARS = int(OVERLAP_SECONDS * SPEAKING_CHARS_PER_SECOND)
+# 区間の端で途切れた語として捨ててよい文字数（前の区間の末尾・次の区間の先頭）
+EDGE_SLACK_CHARS = 4
+# これより短い共通部分は偶然の一致とみなし、そのまま連結する
+MIN_OVERLAP_CHARS = 2
+TRANSCRIBE_MAX_WORKERS = 4
+
+_executor = FairExecutor(TRANSCRIBE_MAX_WORKERS, "transcribe")
+
+
+def stitch(left, right):
+    """重なりのある2つの書き起こしをつなぐ
+
+    重なりの部分は、前の区間の末尾と次の区間の先頭に書き起こされている。そこで、前の区間の末尾
+    （EDGE_SLACK_CHARS 文字以内）で終わり、次の区間の先頭（EDGE_SLACK_CHARS 文字以内）から始まる
+    共通部分のうち最も長いものを探し、前の区間はその部分まで、次の区間はその部分の後ろから使う
+    （区間の端で途切れた語は捨てる）。「です」のような語尾は文中に何度も出てくるので、
+    位置が合わない一致は使わない。見つからなければそのまま連結する。
+    """
+    if not left:
+        return right
+    if not right:
+        return left
+    tail = left[-(OVERLAP_CHARS + EDGE_SLACK_CHARS):]
+    head = right[:OVERLAP_CHARS + EDGE_SLACK_CHARS]
+    best = None  # (長さ, 捨てる文字数, 前の区間で一致が終わる位置, 次の区間で一致が終わる位置)
+    for b in range(min(EDGE_SLACK_CHARS, len(head) - 1) + 1):
+        for a in range(len(tail)):
+            size = 0
+            while a + size < len(tail) and b + size < len(head) and tail[a + size] == head[b + size]:
+                size += 1
+            if size < MIN_OVERLAP_CHARS or len(tail) - (a + size) > EDGE_SLACK_CHARS:
+                continue
+            # 長い一致を優先し、同じ長さなら端で捨てる文字が少ないほうを使う
+            dropped = len(tail) - (a + size) + b
+            if best is None or (size, -dropped) > (best[0], -best[1]):
+                best = (size, dropped, a + size, b + size)
+    if best is None:
+        return left + right
+    return left[:len(left) - len(tail) + best[2]] + right[best[3]:]
+
+
+def frame_to_mono(frame):
+    """streamlit-webrtc の音声フレーム（av.AudioFrame）を (float32のモノラル配列, サンプリングレート) にする"""
+    pcm = frame.to_ndarray()
+    channels = len(frame.layout.channels)
+    data = pcm if frame.format.is_planar else pcm.reshape(-1, channels).T
+    if np.issubdtype(data.dtype, np.integer):
+        data = data.astype(np.float32) / np.iinfo(data.dtype).max
+    return data.mean(axis=0).astype(np.float32), frame.sample_rate
+
+
+class ChunkedTranscriber:
+    """feed() で受け取った音声を区間ごとに書き起こす
+
+    transcribe(データ, ファイル名) は1区間分の音声を受け取り文字列を返す関数（ワーカースレッドで呼ばれる）。
+    区間の作成と draft()/finish() は同じスレッドから呼ぶ。user は書き起こしを学生ごとに順番に行うための値。
+    """
+
+    def __init__(self, transcribe, rate, codec="wav", window_seconds=WINDOW_SECONDS, overlap_seconds=OVERLAP_SECONDS,
+                 user=None):
+        self.transcribe = transcribe
+        self.user = user
+        self.rate = rate
+        self.codec = codec
+        self.window = int(window_seconds * rate)
+        self.step = self.window - int(overlap_seconds * rate)
+        self.chunks = []  # まだ区間に切り出していない音声（先頭は次の区間の開始位置）
+        self.buffered = 0
+        self.futures = []
+
+    def feed(self, samples, rate=None):
+        """音声を追加し、区間の長さに達していれば書き起こしを始める"""
+        if rate is not None and rate != self.rate:
+            raise ValueError(f"サンプリングレートが変わりました: {self.rate} -> {rate}")
+        self.chunks.append(np.asarray(samples, dtype=np.float32))
+        self.buffered += len(samples)
+        while self.buffered >= self.window:
+            audio = np.concatenate(self.chunks)
+            self._submit(audio[:self.window])
+            # 次の区間は、今の区間の終わりから重なりの分だけ戻った位置から始まる
+            rest = audio[self.step:]
+            self.chunks = [rest]
+            self.buffered = len(rest)
+
+    def _submit(self, samples):
+        self.futures.append(_executor.submit(self.user, 0, self._transcribe_window, samples))
+
+    def _transcribe_window(self, samples):
+        mono = audio_preprocess.resample(samples, self.rate)
+        if not audio_preprocess.has_speech(mono, audio_preprocess.TARGET_RATE):
+            return ""
+        return self.transcribe(*audio_preprocess.encode(mono, self.codec)).strip()
+
+    def draft(self):
+        """先頭から続けて書き起こしが済んだ区間をつないだ、途中経過の文字列"""
+        text = ""
+        for future in self.futures:
+            if not future.done() or future.exception() is not None:
+                break
+            text = stitch(text, future.result())
+        return text
+
+    def finish(self):
+        """残りの音声を最後の区間として書き起こし、全区間をつないだ文字列を返す（区間の失敗は例外として送出）"""
+        # 残りが直前の区間との重なりに収まっていれば、すでに書き起こし済み
+        if self.buffered > 0 and (not self.futures or self.buffered > self.window - self.step):
+            self._submit(np.concatenate(self.chunks))
+        self.chunks = []
+        self.buffered = 0
+        text = ""
+        for future in self.futures:
+            text = stitch(text, future.result())
+        return text
+
+
+def transcribe_all(samples, rate, transcribe, codec="wav", user=None):
+    """録音済みの音声を区間に分け、並行に書き起こしてつないだ文字列を返す"""
+    transcriber = ChunkedTranscriber(transcribe, rate, codec, user=user)
+    transcriber.feed(samples)
+    return transcriber.finish()
@@ -0,0 +1,171 @@
+"""Dify API のクライアント（全セッションで共有する接続プール付き）
+
+requests.post をその都度呼ぶと、毎回TCP+TLSの接続からやり直しになり、
+タイムアウトもないため応答が止まると学生のスクリプトスレッドが止まったままになる。
+ここでは1つの requests.Session を共有して keep-alive で接続を使い回し、
+接続・読み取りタイムアウト、バックオフ付きの再試行、サーキットブレーカーを備える。
+"""
+import random
+import threading
+import time
+
+import requests
+from requests.adapters import HTTPAdapter
+
+import rate_limiter
+
+BASE_URL = "https://api.dify.ai/v1"
+# (接続, 読み取り) タイムアウト秒。ストリーミングでは読み取りタイムアウトはイベント間の無通信時間に効く
+TIMEOUT = (5, 60)
+POOL_SIZE = 32
+MAX_RETRIES = 3
+RETRY_BASE_SECONDS = 0.5
+RETRY_MAX_SECONDS = 8.0
+# 連続してこの回数失敗したら、一定時間 Dify への送信を止めて「混雑中」を返す
+BREAKER_FAILURE_THRESHOLD = 5
+BREAKER_RESET_SECONDS = 30.0
+
+# アップロードは同じファイルを送り直しても害がないので、サーバーエラーでも再試行する
+UPLOAD_RETRY_STATUS = {429, 500, 502, 503, 504}
+# チャットは送り直すと二重に回答が作られうるので、処理されていないことが確実な場合だけ再試行する
+CHAT_RETRY_STATUS = {429}
+
+
+class DifyServiceBusy(Exception):
+    """Difyが応答しない状態が続いているため、送信を見合わせている"""
+
+
+class CircuitBreaker:
+    """連続した失敗で開き、一定時間後に1件だけ試して回復を確かめる"""
+
+    def __init__(self, failure_threshold=BREAKER_FAILURE_THRESHOLD, reset_seconds=BREAKER_RESET_SECONDS):
+        self.failure_threshold = failure_threshold
+        self.reset_seconds = reset_seconds
+        self.lock = threading.Lock()
+        self.failures = 0
+        self.opened_at = None
+        self.trial_in_progress = False
+
+    def allow(self):
+        with self.lock:
+            if self.opened_at is None:
+                return True
+            if time.monotonic() - self.opened_at < self.reset_seconds or self.trial_in_progress:
+                return False
+            # 半開状態: 1件だけ通して様子を見る
+            self.trial_in_progress = True
+            return True
+
+    def record_success(self):
+        with self.lock:
+            self.failures = 0
+            self.opened_at = None
+            self.trial_in_progress = False
+
+    def record_failure(self):
+        with self.lock:
+            self.failures += 1
+            self.trial_in_progress = False
+            if self.failures >= self.failure_threshold:
+                self.opened_at = time.monotonic()
+
+    @property
+    def is_open(self):
+        with self.lock:
+            return self.opened_at is not None
+
+
+def backoff_seconds(attempt, retry_after=None):
+    """再試行までの待ち時間（指数バックオフ + フルジッター。Retry-After があればそれに従う）"""
+    if retry_after:
+        try:
+            return min(RETRY_MAX_SECONDS, float(retry_after))
+        except ValueError:
+            pass
+    return random.uniform(0, min(RETRY_MAX_SECONDS, RETRY_BASE_SECONDS * 2 ** attempt))
+
+
+class DifyClient:
+    def __init__(self, api_key, base_url=BASE_URL):
+        self.base_url = base_url
+        self.session = requests.Session()
+        self.session.headers["Authorization"] = f"Bearer {api_key}"
+        adapter = HTTPAdapter(pool_connections=4, pool_maxsize=POOL_SIZE, max_retries=0)
+        self.session.mount("https://", adapter)
+        self.session.mount("http://", adapter)
+        self.breaker = CircuitBreaker()
+
+    def _request(self, path, retry_status, retry_exceptions, **kwargs):
+        if not self.breaker.allow():
+            raise DifyServiceBusy("Difyが混雑しています")
+
+        url = f"{self.base_url}{path}"
+        for attempt in range(MAX_RETRIES + 1):
+            try:
+                response = self.session.post(url, timeout=TIMEOUT, **kwargs)
+            except retry_exceptions:
+                if attempt == MAX_RETRIES:
+                    self.breaker.record_failure()
+                    raise
+                time.sleep(backoff_seconds(attempt))
+                self._rewind(kwargs)
+                continue
+            except requests.RequestException:
+                self.breaker.record_failure()
+                raise
+
+            if response.status_code == 429:
+                # 他のセッションも含めて、しばらく Dify への送信を控える
+                rate_limiter.throttle("dify", response.headers.get("Retry-After"))
+            if response.status_code in retry_status and attempt < MAX_RETRIES:
+                delay = backoff_seconds(attempt, response.headers.get("Retry-After"))
+                response.close()
+                time.sleep(delay)
+                self._rewind(kwargs)
+                continue
+            if response.status_code >= 500:
+                self.breaker.record_failure()
+            else:
+                self.breaker.record_success()
+            return response
+
+    @staticmethod
+    def _rewind(kwargs):
+        # 再試行の前に、アップロード中のファイルを先頭に戻す
+        for value in (kwargs.get("files") or {}).values():
+            if isinstance(value, tuple) and hasattr(value[1], "seek"):
+                value[1].seek(0)
+
+    def upload_file(self, file_obj, filename, user_id, mime_type="application/pdf"):
+        """/files/upload にファイルを送る（レスポンスをそのまま返す）"""
+        return self._request(
+            "/files/upload",
+            UPLOAD_RETRY_STATUS,
+            (requests.ConnectionError, requests.Timeout),
+            files={"file": (filename, file_obj, mime_type)},
+            data={"user": user_id},
+        )
+
+    def chat_messages(self, payload, stream=False):
+        """/chat-messages に送る（レスポンスをそのまま返す）"""
+        return self._request(
+            "/chat-messages",
+            CHAT_RETRY_STATUS,
+            (requests.ConnectTimeout,),
+            json=payload,
+            stream=stream,
+        )
+
+
+_lock = threading.Lock()
+_clients = {}
+
+
+def get_client(api_key, base_url=BASE_URL):
+    """APIキー・接続先ごとに1つのクライアントをプロセス全体で共有する"""
+    with _lock:
+        client = _clients.get((api_key, base_url))
+        if client is None:
+            client = DifyClient(api_key, base_url)
+            _clients[(api_key, base_url)] = client
+        return client
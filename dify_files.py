@@ -0,0 +1,132 @@
+"""Difyにアップロードした講義資料のファイルIDをプロセス全体で共有するキャッシュ
+
+Streamlitはセッションごとにスクリプトを再実行するが、importしたモジュールは
+プロセス内で1度しか読み込まれないため、ここに置いた状態は全セッションで共有される。
+Difyのファイル参照はワークスペース(テナント)単位なので、あるユーザーの名前で
+アップロードしたファイルIDを他の学生の会話で使っても問題ない。
+
+serve_workers.py で複数ワーカーを動かしている場合は、ファイルIDを shared_state にも置き、
+アップロードもワーカー全体で1回にする（各ワーカーのメモリ上の表はその手前のキャッシュになる）。
+"""
+import hashlib
+import os
+import threading
+import time
+
+import shared_state
+
+# Difyのアップロードファイルは一定期間で参照できなくなるため、保持期間より短めに期限を設定する
+FILE_ID_TTL_SECONDS = 12 * 60 * 60
+# 他のワーカーのアップロードを待つ上限（アップロードの途中でワーカーが落ちた場合は、この後に引き継ぐ）
+UPLOAD_LEASE_SECONDS = 120
+SHARED_NAMESPACE = "dify_file_id"
+
+_lock = threading.Lock()
+_entries = {}     # (講義名, sha256) -> (file_id, 有効期限)
+_inflight = {}    # (講義名, sha256) -> アップロード完了を知らせる threading.Event
+_hash_cache = {}  # ファイルパス -> (mtime, size, sha256)
+
+
+def file_sha256(file_path):
+    """ファイル内容のSHA-256を返す（更新時刻とサイズが変わらない限り再計算しない）"""
+    stat = os.stat(file_path)
+    cached = _hash_cache.get(file_path)
+    if cached and cached[0] == stat.st_mtime and cached[1] == stat.st_size:
+        return cached[2]
+
+    h = hashlib.sha256()
+    with open(file_path, "rb") as f:
+        for block in iter(lambda: f.read(1024 * 1024), b""):
+            h.update(block)
+    digest = h.hexdigest()
+    _hash_cache[file_path] = (stat.st_mtime, stat.st_size, digest)
+    return digest
+
+
+def get_file_id(material_name, file_path, upload_func):
+    """講義資料のDifyファイルIDを返す。未取得・期限切れの場合のみ upload_func(file_path) を呼ぶ
+
+    同じ資料のアップロードが既に進行中なら、その完了を待って結果を共有する（single-flight）。
+    アップロードに失敗した場合は None を返す。
+    """
+    key = (material_name, file_sha256(file_path))
+
+    with _lock:
+        entry = _entries.get(key)
+        if entry and entry[1] > time.time():
+            return entry[0]
+        event = _inflight.get(key)
+        is_leader = event is None
+        if is_leader:
+            event = threading.Event()
+            _inflight[key] = event
+
+    if not is_leader:
+        # 他のセッションのアップロード完了を待つ
+        event.wait()
+        with _lock:
+            entry = _entries.get(key)
+        return entry[0] if entry else None
+
+    file_id = None
+    state = shared_state.get_state()
+    try:
+        if state is None:
+            file_id = upload_func(file_path)
+            expires_at = time.time() + FILE_ID_TTL_SECONDS
+        else:
+            file_id, expires_at = state.run_once(
+                f"dify_upload:{_shared_key(key)}",
+                lambda: state.get(SHARED_NAMESPACE, _shared_key(key)),
+                lambda: _upload_shared(state, key, file_path, upload_func),
+                UPLOAD_LEASE_SECONDS,
+            )
+    finally:
+        with _lock:
+            if file_id:
+                _entries[key] = (file_id, expires_at)
+            del _inflight[key]
+        event.set()
+    return file_id
+
+
+def _shared_key(key):
+    return "\0".join(key)
+
+
+def _upload_shared(state, key, file_path, upload_func):
+    """アップロードして、成功したら他のワーカーにも見えるように置く。(file_id, 有効期限) を返す"""
+    file_id = upload_func(file_path)
+    expires_at = time.time() + FILE_ID_TTL_SECONDS
+    if file_id:
+        state.put(SHARED_NAMESPACE, _shared_key(key), file_id, expires_at)
+    return file_id, expires_at
+
+
+def invalidate(material_name, file_path, file_id):
+    """Difyに拒否されたファイルIDをキャッシュから外す（別のIDに更新済みなら何もしない）"""
+    key = (material_name, file_sha256(file_path))
+    with _lock:
+        entry = _entries.get(key)
+        if entry and entry[0] == file_id:
+            del _entries[key]
+    state = shared_state.get_state()
+    if state is not None:
+        state.delete(SHARED_NAMESPACE, _shared_key(key), file_id)
+
+
+def remember(material_name, file_path, file_id, expires_at):
+    """別のプロセス（事前準備のコマンドなど）がアップロードしたファイルIDを登録する
+
+    ファイル内容が変わっていれば、そのIDは使わずに次回の get_file_id で改めてアップロードされる。
+    """
+    key = (material_name, file_sha256(file_path))
+    with _lock:
+        entry = _entries.get(key)
+        if expires_at > time.time() and (entry is None or entry[1] < expires_at):
+            _entries[key] = (file_id, expires_at)
+    state = shared_state.get_state()
+    if state is not None and expires_at > time.time():
+        shared = state.get(SHARED_NAMESPACE, _shared_key(key))
+        if shared is None or shared[1] < expires_at:
+            state.put(SHARED_NAMESPACE, _shared_key(key), file_id, expires_at)
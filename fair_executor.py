@@ -0,0 +1,81 @@
+"""学生ごとの順番待ち列から、数の限られたワーカースレッドに仕事を1件ずつ渡す実行器
+
+ThreadPoolExecutor の待ち行列は投げられた順（FIFO）なので、1人の学生が長い回答の文を何件も
+投げると、後から来た学生の仕事はその全部が終わるまで始まらない。rate_limiter が学生ごとに
+順番に通すようにしていても、その手前のスレッドプールで順番が決まってしまう。
+ここでは優先度ごと・学生ごとに列を分け、ワーカーが空くたびに、優先度の高い列から
+学生を順番に回して1件ずつ渡す（rate_limiter の列と同じ順番）。同じ学生の仕事は投げた順に実行する。
+"""
+import threading
+from collections import OrderedDict, deque
+from concurrent.futures import Future
+
+
+class FairExecutor:
+    """submit(user, priority, fn, ...) で仕事を並べ、Future を返す（priority は小さいほど先）"""
+
+    def __init__(self, max_workers, thread_name_prefix):
+        self.max_workers = max_workers
+        self.thread_name_prefix = thread_name_prefix
+        self.cond = threading.Condition()
+        # 優先度 -> OrderedDict(学生 -> 並んでいる仕事の deque)。先頭の学生が次に実行される
+        self.levels = {}
+        self.queued = 0
+        self.threads = []
+        self.idle = 0
+
+    def submit(self, user, priority, fn, *args, **kwargs):
+        future = Future()
+        with self.cond:
+            users = self.levels.setdefault(priority, OrderedDict())
+            users.setdefault(user, deque()).append((future, fn, args, kwargs))
+            self.queued += 1
+            # ワーカーは、待っている仕事が空いているワーカーより多いときだけ作る
+            if self.queued > self.idle and len(self.threads) < self.max_workers:
+                thread = threading.Thread(
+                    target=self._work, name=f"{self.thread_name_prefix}_{len(self.threads)}", daemon=True
+                )
+                self.threads.append(thread)
+                thread.start()
+            self.cond.notify()
+        return future
+
+    def _next(self):
+        """次に実行する仕事を列から取り出す（self.cond を持った状態で呼ぶ。なければ None）"""
+        for priority in sorted(self.levels):
+            users = self.levels[priority]
+            if not users:
+                continue
+            user, waiting = next(iter(users.items()))
+            job = waiting.popleft()
+            self.queued -= 1
+            # 実行した学生は最後尾に回す（次は別の学生の番）
+            del users[user]
+            if waiting:
+                users[user] = waiting
+            return job
+        return None
+
+    def _work(self):
+        while True:
+            with self.cond:
+                job = self._next()
+                while job is None:
+                    self.idle += 1
+                    self.cond.wait()
+                    self.idle -= 1
+                    job = self._next()
+            future, fn, args, kwargs = job
+            if not future.set_running_or_notify_cancel():
+                continue
+            try:
+                result = fn(*args, **kwargs)
+            except BaseException as e:
+                future.set_exception(e)
+            else:
+                future.set_result(result)
+
+    def waiting(self):
+        """優先度ごとの、まだ始まっていない仕事の件数"""
+        with self.cond:
+            return {priority: sum(map(len, users.values())) for priority, users in sorted(self.levels.items())}
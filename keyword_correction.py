@@ -0,0 +1,234 @@
+"""音声認識結果の重要語句をローカルで校正する
+
+Whisperの書き起こしに対して、LLMを呼ぶ前に次の処理を行う。
+- 明らかなフィラー（えー、あのー、えっと等）の削除
+- 語句ファイルにない全部かな書きの読み（「かくせんせき」など）を正式表記に置き換え
+- 語句の表記・読みと編集距離が近い箇所（「はんれえがん」など）を正式表記に置き換え
+
+置き換えの確からしさと、判断に迷う箇所の有無から信頼度(0〜1)を求め、
+信頼度が低い場合だけ呼び出し側がLLMによる校正に回す。
+語句ファイルの表記から作った読みは同音の別の語（「ちょうせき」→潮汐）と区別できないので、
+それによる置き換えは下書きとして行い、必ずLLMで確かめる。
+"""
+import re
+from collections import namedtuple
+
+import vocabulary
+
+# この信頼度を超えればLLMを呼ばずにローカルの校正結果をそのまま使う（ちょうどの場合はLLMに回す）
+CONFIDENCE_THRESHOLD = 0.85
+# 編集距離による置き換えを行う最小の類似度（1 - 距離 / 語句の長さ）
+ACCEPT_SIMILARITY = 0.8
+# この類似度以上・ACCEPT_SIMILARITY未満の箇所は「誤認識かもしれない」とみなして信頼度を下げる
+AMBIGUOUS_SIMILARITY = 0.6
+# 編集距離で照合する語句の最小の長さ（短い語句は誤置換が多いため完全一致のみ）
+MIN_FUZZY_LENGTH = 4
+# 語句ファイルにない、読みから作った表記での置き換えの信頼度（CONFIDENCE_THRESHOLD 未満なので必ずLLMに回る）
+GENERATED_READING_CONFIDENCE = 0.8
+
+FILLER_PATTERN = re.compile(r"(?:えー+っと|えー+と?|えっと|あのー+|そのー+|うーん+|んー+|まー+)[、，,\s]*")
+# 語句ファイルにない岩石・鉱物名らしき箇所（「りゅうもんがん」「深成がん」など）。
+# 正規化後（カタカナ）の文字列に対して使い、見つかったらLLMに任せる
+SUSPICIOUS_TERM_PATTERN = re.compile(r"(?<=[\u30a1-\u30fa\u4e00-\u9fff])(?:ガン|セキ)(?=[ハガヲニトノモヤデ、。]|$)")
+# 語の途中とみなす文字（漢字・カタカナ）。語句より短い箇所の直前・直後がこれなら、別の語の一部として置き換えない
+WORD_CHAR_PATTERN = re.compile(r"[\u4e00-\u9fff\u3005\u30a1-\u30fa\u30fc]")
+# 語の区切りとみなす助詞（正規化後のカタカナ）
+PARTICLES = "ハガヲニトノモヤデヘ"
+# 語句ファイルのどれにも当てはまらない、ひらがなだけの名詞らしき箇所（「かざんばいが」）。
+# 文頭・記号・漢字・助詞の直後から4文字以上続き、「が・を・は」の直前で終わるもの（「いろいろと」のような副詞は除く）。
+# 見つかったらLLMに任せる
+KANA_NOUN_PATTERN = re.compile(r"(?:^|(?<=[^\u3041-\u3096\u30fc]|[のとやにをはが]))[\u3041-\u3096\u30fc]{4,}(?=[がをは])")
+# 無音や雑音に対してWhisperが出力しがちな定型文
+HALLUCINATION_PATTERNS = ("ご視聴ありがとうございました", "チャンネル登録", "字幕")
+
+CorrectionResult = namedtuple("CorrectionResult", ["text", "confidence", "corrections"])
+
+
+def edit_distance(a, b, limit):
+    """レーベンシュタイン距離。limit を超えることが確定した時点で limit + 1 を返す"""
+    if abs(len(a) - len(b)) > limit:
+        return limit + 1
+    prev = list(range(len(b) + 1))
+    for i, ca in enumerate(a, 1):
+        cur = [i] + [0] * len(b)
+        row_min = i
+        for j, cb in enumerate(b, 1):
+            cur[j] = min(prev[j] + 1, cur[j - 1] + 1, prev[j - 1] + (ca != cb))
+            row_min = min(row_min, cur[j])
+        if row_min > limit:
+            return limit + 1
+        prev = cur
+    return prev[-1]
+
+
+class FuzzyMatcher:
+    """語句の正規化表記・読みに近い箇所を探す（2文字組の共通数で候補を絞ってから編集距離を測る）"""
+
+    def __init__(self, index):
+        self.patterns = {}
+        self.generated = set()  # 語句ファイルになく、読みから作った表記
+        # 編集距離で照合しない3文字の語句の、1文字を除いた形 -> 正式表記（「柱状ず」のような崩れを見つける）
+        self.near_short = {}
+        for word, canonical in index.alias_to_canonical.items():
+            form = vocabulary.normalize(word)
+            if len(form) >= MIN_FUZZY_LENGTH:
+                self.patterns.setdefault(form, canonical)
+            elif len(form) == MIN_FUZZY_LENGTH - 1 and not vocabulary.is_kana(form):
+                for m in range(len(form)):
+                    self.near_short.setdefault((m, form[:m] + form[m + 1:]), canonical)
+            for reading in vocabulary.reading_variants(word):
+                if len(reading) >= MIN_FUZZY_LENGTH and reading not in self.patterns:
+                    self.patterns[reading] = canonical
+                    self.generated.add(reading)
+        self.bigrams = {}
+        for form in self.patterns:
+            for k in range(len(form) - 1):
+                self.bigrams.setdefault(form[k:k + 2], []).append((form, k))
+
+    def candidates(self, text):
+        """(開始位置, 終了位置, 語句, 正式表記, 類似度) を類似度の高い順に返す"""
+        # 語句の何文字目と文中の何文字目が対応しそうかを、共通する2文字組の数で数える
+        votes = {}
+        for i in range(len(text) - 1):
+            for form, k in self.bigrams.get(text[i:i + 2], ()):
+                key = (form, i - k)
+                votes[key] = votes.get(key, 0) + 1
+
+        found = []
+        for (form, start), count in votes.items():
+            limit = max(1, int(len(form) * (1 - AMBIGUOUS_SIMILARITY)))
+            # 編集距離 limit 以内なら、共通する2文字組は少なくとも (len - 1) - 2 * limit 個ある
+            if count < max(1, len(form) - 1 - 2 * limit):
+                continue
+            best = None
+            for length in range(len(form) - limit, len(form) + limit + 1):
+                for s in (start - 1, start, start + 1):
+                    if s < 0 or s + length > len(text) or length <= 0:
+                        continue
+                    d = edit_distance(text[s:s + length], form, limit)
+                    if d <= limit and (best is None or d < best[0]):
+                        best = (d, s, s + length)
+            if best:
+                similarity = 1 - best[0] / len(form)
+                found.append((best[1], best[2], form, self.patterns[form], similarity))
+        found.sort(key=lambda c: (-c[4], c[0]))
+        return found
+
+
+_matchers = {}
+
+
+def get_fuzzy_matcher(index):
+    matcher = _matchers.get(id(index))
+    if matcher is None or matcher[0] is not index:
+        matcher = (index, FuzzyMatcher(index))
+        _matchers[id(index)] = matcher
+    return matcher[1]
+
+
+def is_confident(result):
+    """LLMを呼ばずにローカルの校正結果を使ってよいか"""
+    return result.confidence > CONFIDENCE_THRESHOLD
+
+
+def _inside_word(text, a, b):
+    """text[a:b] の直前か直後が語の続き（漢字・カタカナ）か"""
+    return (a > 0 and WORD_CHAR_PATTERN.match(text[a - 1])) or (b < len(text) and WORD_CHAR_PATTERN.match(text[b]))
+
+
+def _kana_continues(normalized, start, stop):
+    """normalized[start:stop]（かなの読み）の直前か直後に、助詞でないかなが続くか（「キセキミタイニ」）"""
+    before = normalized[start - 1] if start > 0 else ""
+    after = normalized[stop] if stop < len(normalized) else ""
+    return any(vocabulary.is_kana(ch) and ch not in PARTICLES and ch != "ー" for ch in before + after)
+
+
+def _near_short_term(normalized, covered, matcher):
+    """3文字の語句の1文字がかなに崩れた箇所（「柱状ず」）があるか"""
+    for i in range(len(normalized) - 2):
+        seg = normalized[i:i + 3]
+        if all(covered[i:i + 3]):
+            continue
+        for m, ch in enumerate(seg):
+            if vocabulary.is_kana(ch) and ch not in PARTICLES and (m, seg[:m] + seg[m + 1:]) in matcher.near_short:
+                return True
+    return False
+
+
+def correct(text, index):
+    """重要語句の誤認識をローカルで直し、CorrectionResult(文, 信頼度, 置き換え一覧) を返す"""
+    if any(p in text for p in HALLUCINATION_PATTERNS):
+        return CorrectionResult(text, 0.0, [])
+
+    cleaned = FILLER_PATTERN.sub("", text).strip()
+    if not index:
+        return CorrectionResult(cleaned, 1.0, [])
+
+    normalized, origin = vocabulary.normalize_with_map(cleaned)
+    matcher = get_fuzzy_matcher(index)
+    replacements = []  # (正規化文字列上の開始, 終了, 置き換え後, 類似度)
+    covered = [False] * len(normalized)
+    exact = [None] * len(normalized)  # 完全一致した語句の (開始, 終了)
+    confidence = 1.0
+
+    # 1. 完全一致: 語句ファイルにある表記はそのまま、読みだけが一致した全部かな書きは正式表記に
+    for start, stop, (canonical, in_file) in index.matcher.find_longest(normalized):
+        if not in_file:
+            # 読みが一致しても同音の別の語かもしれないので、置き換えは下書きとしてLLMに確かめさせる。
+            # 前後にかなが続く場合（「きせきみたいに」）は別の語の一部の可能性が高いので、置き換えもしない
+            confidence = min(confidence, GENERATED_READING_CONFIDENCE)
+            if not _kana_continues(normalized, start, stop):
+                replacements.append((start, stop, canonical, 1.0))
+        for k in range(start, stop):
+            covered[k] = True
+            exact[k] = (start, stop)
+
+    # 2. 編集距離: 完全一致した箇所と重ならない、語句に近い箇所
+    for start, stop, form, canonical, similarity in matcher.candidates(normalized):
+        if any(covered[start:stop]):
+            # 短い語句（「鉱物」）の完全一致の前後に、一致しなかった文字を含めると長い語句（「無色鉱物」）に
+            # 近くなる場合は、同音の誤変換（「無職鉱物」）かもしれないのでLLMに任せる
+            spans = {exact[k] for k in range(start, stop) if covered[k]}
+            partly = not all(covered[start:stop])
+            if partly and None not in spans and all(start <= lo and hi <= stop and hi - lo < len(form) for lo, hi in spans):
+                confidence = min(confidence, similarity, AMBIGUOUS_SIMILARITY)
+            continue
+        a, b = origin[start], origin[stop - 1] + 1
+        if stop - start < len(form) and _inside_word(cleaned, a, b):
+            # 語句より短い箇所が語の途中にある（「火山噴出量」の「火山噴出」）のは、別の正しい語
+            continue
+        if similarity >= ACCEPT_SIMILARITY:
+            replacements.append((start, stop, canonical, similarity))
+            # 置き換えた箇所の類似度が低いほど信頼度を下げる（ACCEPT_SIMILARITY で閾値ちょうどになり、LLMに回る）
+            scaled = CONFIDENCE_THRESHOLD + (1 - CONFIDENCE_THRESHOLD) * (similarity - ACCEPT_SIMILARITY) / (1 - ACCEPT_SIMILARITY)
+            confidence = min(confidence, scaled)
+            if form in matcher.generated:
+                confidence = min(confidence, GENERATED_READING_CONFIDENCE)
+        else:
+            # 判断に迷う箇所はLLMに任せる
+            confidence = min(confidence, similarity)
+        for k in range(start, stop):
+            covered[k] = True
+
+    # 3. どの語句にも当てはまらなかった、語句らしき読みがな
+    for m in SUSPICIOUS_TERM_PATTERN.finditer(normalized):
+        if not any(covered[m.start() - 1:m.end()]):
+            confidence = min(confidence, 0.5)
+    if _near_short_term(normalized, covered, matcher):
+        confidence = min(confidence, AMBIGUOUS_SIMILARITY)
+    # ひらがなは正規化で1文字ずつ対応するので、cleaned 上の位置から covered を引ける
+    position = {i: k for k, i in enumerate(origin)}
+    for m in KANA_NOUN_PATTERN.finditer(cleaned):
+        if not any(covered[position[i]] for i in range(m.start(), m.end()) if i in position):
+            confidence = min(confidence, 0.5)
+
+    corrections = []
+    result = cleaned
+    # 後ろから置き換えれば、前の箇所の位置はずれない
+    for start, stop, canonical, similarity in sorted(replacements, reverse=True):
+        a = origin[start]
+        b = origin[stop - 1] + 1
+        corrections.append((cleaned[a:b], canonical, similarity))
+        result = result[:a] + canonical + result[b:]
+    corrections.reverse()
+    return CorrectionResult(result, confidence, corrections)
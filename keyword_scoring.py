@@ -0,0 +1,168 @@
+"""生徒の回答が講義の重要語句をどれだけ使っているかのローカル採点
+
+語句ファイル（keywords*.txt）の正式表記ごとに1ビットを割り当て、回答に出てきた語句
+（別表記・かな書きの読みも正式表記にまとめる）を NumPy の uint64 のビット列で表す。
+照合には vocabulary.KeywordIndex の Aho-Corasick オートマトンを使い、回答を1回走査するだけで済む。
+ビット列はまとめて OR・数え上げできるので、会話ごと・講義ごとの集計もログ全体に対して一度に行える。
+
+アプリでは面談中の進み具合の表示に、log_export.py では会話ごとの語句カバー率の集計に使う。
+
+ログ全体の採点（リポジトリ直下で実行。log_export.py で書き出したものを読む）:
+    python keyword_scoring.py
+    python keyword_scoring.py --archive path/to/archive
+"""
+import argparse
+import os
+import sys
+import threading
+
+import numpy as np
+
+import vocabulary
+
+
+class KeywordScorer:
+    """1つの語句索引に対する採点器。ビット列は長さ words の uint64 配列"""
+
+    def __init__(self, index):
+        self.index = index
+        self.terms = list(index.canonical_terms)
+        self.positions = {term: i for i, term in enumerate(self.terms)}
+        self.words = max(1, (len(self.terms) + 63) // 64)
+
+    def empty(self):
+        return np.zeros(self.words, dtype=np.uint64)
+
+    def score(self, text):
+        """回答に出てきた語句のビット列を返す"""
+        bits = self.empty()
+        for term in self.index.find_terms(text):
+            i = self.positions[term]
+            bits[i // 64] |= np.uint64(1) << np.uint64(i % 64)
+        return bits
+
+    def score_many(self, texts):
+        """回答ごとのビット列を (件数, words) の配列で返す（同じ文は1度だけ照合する）"""
+        cache = {}
+        result = np.zeros((len(texts), self.words), dtype=np.uint64)
+        for row, text in enumerate(texts):
+            bits = cache.get(text)
+            if bits is None:
+                bits = cache[text] = self.score(text)
+            result[row] = bits
+        return result
+
+    def terms_of(self, bits):
+        """ビット列に含まれる語句の正式表記を、語句ファイルの順に返す"""
+        flags = np.unpackbits(np.asarray(bits, dtype=np.uint64).view(np.uint8), bitorder="little")
+        return [self.terms[i] for i in np.flatnonzero(flags[:len(self.terms)])]
+
+    @property
+    def total(self):
+        return len(self.terms)
+
+
+def popcount(bits):
+    """最後の軸ごとに立っているビットの数を返す"""
+    bits = np.ascontiguousarray(bits, dtype=np.uint64)
+    return np.unpackbits(bits.view(np.uint8), axis=-1).sum(axis=-1)
+
+
+def combine(bits, groups):
+    """グループ（会話など）ごとにビット列を OR でまとめる
+
+    groups は bits の各行が属するグループの番号（0 から始まる連番）。(グループ数, words) を返す。
+    """
+    order = np.argsort(groups, kind="stable")
+    sorted_groups = np.asarray(groups)[order]
+    starts = np.flatnonzero(np.r_[True, sorted_groups[1:] != sorted_groups[:-1]])
+    return np.bitwise_or.reduceat(bits[order], starts, axis=0)
+
+
+_lock = threading.Lock()
+_scorers = {}  # 語句ファイルの絶対パス -> KeywordScorer
+
+
+def get_scorer(keyword_file):
+    """語句ファイルの採点器を返す（語句ファイルが更新されて索引が作り直されたら採点器も作り直す）"""
+    index = vocabulary.get_index(keyword_file)
+    path = os.path.abspath(keyword_file)
+    with _lock:
+        scorer = _scorers.get(path)
+        if scorer is None or scorer.index is not index:
+            scorer = KeywordScorer(index)
+            _scorers[path] = scorer
+        return scorer
+
+
+def score_sessions(turns, keywords_path_of):
+    """ターンの表（session, material, user_answer 列）を会話ごとに採点する
+
+    keywords_path_of(講義名) は語句ファイルのパス（ない講義は None）を返す関数。
+    [{"session", "material", "keywords_used", "keywords_total", "terms"}, ...] を返す。
+    """
+    records = []
+    for material, rows in turns.groupby("material"):
+        path = keywords_path_of(material)
+        if path is None:
+            continue
+        scorer = get_scorer(path)
+        sessions, groups = np.unique(rows["session"].to_numpy(), return_inverse=True)
+        per_session = combine(scorer.score_many(rows["user_answer"].tolist()), groups)
+        for session, bits, used in zip(sessions, per_session, popcount(per_session)):
+            records.append({
+                "session": session,
+                "material": material,
+                "keywords_used": int(used),
+                "keywords_total": scorer.total,
+                "terms": scorer.terms_of(bits),
+            })
+    return records
+
+
+def term_frequencies(turns, keywords_path_of):
+    """講義の語句ごとに、その語句を使った会話の数と割合を返す"""
+    records = []
+    for material, rows in turns.groupby("material"):
+        path = keywords_path_of(material)
+        if path is None:
+            continue
+        scorer = get_scorer(path)
+        sessions, groups = np.unique(rows["session"].to_numpy(), return_inverse=True)
+        per_session = combine(scorer.score_many(rows["user_answer"].tolist()), groups)
+        flags = np.unpackbits(per_session.view(np.uint8), axis=-1, bitorder="little")[:, :scorer.total]
+        counts = flags.sum(axis=0)
+        for term, count in zip(scorer.terms, counts):
+            records.append({"material": material, "term": term, "sessions": int(count),
+                            "share": float(count) / len(sessions)})
+    return records
+
+
+def main(argv):
+    import pandas as pd
+
+    import log_export
+    import material_registry
+
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument("--archive", default=log_export.ARCHIVE_DIR)
+    args = parser.parse_args(argv)
+
+    turns = log_export.read_turns(args.archive)
+    if turns is None or turns.empty:
+        print("書き出されたログがありません（先に python log_export.py を実行してください）")
+        return
+    keywords_path_of = log_export.keywords_path_getter(material_registry.get_registry())
+    frequencies = pd.DataFrame(term_frequencies(turns, keywords_path_of))
+    path = os.path.join(args.archive, "aggregates", "term_coverage.parquet")
+    os.makedirs(os.path.dirname(path), exist_ok=True)
+    frequencies.to_parquet(f"{path}.tmp", index=False)
+    os.replace(f"{path}.tmp", path)
+    print(f"{len(turns)}ターンを採点しました -> {path}")
+    for material, rows in frequencies.groupby("material"):
+        rarely = rows.nsmallest(5, "share")
+        print(f"{material}: 使われにくい語句 " + " / ".join(f"{t}({s:.0%})" for t, s in zip(rarely["term"], rarely["share"])))
+
+
+if __name__ == "__main__":
+    main(sys.argv[1:])
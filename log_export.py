@@ -0,0 +1,210 @@
+"""会話ログのスプレッドシートを、集計しやすい列指向の形式（Parquet）に書き出すコマンド
+
+先生がシートの行をそのまま読む代わりに、前回の続きの行だけをシートから読み、
+講義・日付ごとに分けた Parquet に追記する。あわせて、学生ごと・会話ごとの集計
+（ターン数、面談が終わるまでの時間、重要語句をどれだけ使えたか）を作り直しておくので、
+ダッシュボードはシートのAPIを呼ばずに、数千件の会話をすぐに読める。
+
+    .log_archive/turns/material=<講義名>/date=<YYYY-MM-DD>/part-<シートの行番号>.parquet
+    .log_archive/aggregates/sessions.parquet   会話ごと
+    .log_archive/aggregates/students.parquet   学生 × 講義ごと
+
+使い方（リポジトリ直下で実行。接続先と認証情報は .streamlit/secrets.toml から読む）:
+    python log_export.py
+    python log_export.py --secrets path/to/secrets.toml --out path/to/archive
+    python log_export.py --rebuild-aggregates   # シートを読まずに集計だけ作り直す
+
+書き出したファイルは pyarrow.dataset や DuckDB で、ハイブ形式のパーティションとして読める。
+"""
+import argparse
+import json
+import os
+import sys
+import tomllib
+
+import keyword_scoring
+import material_registry
+import sheet_logger
+
+ARCHIVE_DIR = os.path.join(os.path.dirname(os.path.abspath(__file__)), ".log_archive")
+SECRETS_PATH = os.path.join(".streamlit", "secrets.toml")
+# my_app_login3.py が書く列（7列目はターンキー、8列目は is_finished）
+COLUMNS = ["session", "user", "material", "system_question", "user_answer", "created_at", "turn_key", "is_finished"]
+LAST_COLUMN = "H"
+TIMESTAMP_FORMAT = "%Y-%m-%d %H:%M:%S"
+TIMEZONE = "Asia/Tokyo"
+# 一度に読む行数（大きなシートでも1回の応答が大きくなりすぎないように）
+FETCH_ROWS = 5000
+
+
+def load_secrets(path=SECRETS_PATH):
+    """(サービスアカウント情報, スプレッドシートのURL, モックのURL) を返す（モックは SHEETS_MOCK_URL がある場合だけ）"""
+    with open(path, "rb") as f:
+        secrets = tomllib.load(f)
+    return secrets["connections"]["gsheets"], secrets["spreadsheet_url"], secrets.get("SHEETS_MOCK_URL")
+
+
+def load_state(out_dir):
+    try:
+        with open(os.path.join(out_dir, "_state.json"), encoding="utf-8") as f:
+            return json.load(f)
+    except FileNotFoundError:
+        return {}
+
+
+def save_state(out_dir, state):
+    path = os.path.join(out_dir, "_state.json")
+    with open(f"{path}.tmp", "w", encoding="utf-8") as f:
+        json.dump(state, f, ensure_ascii=False, indent=2)
+    os.replace(f"{path}.tmp", path)
+
+
+def fetch_rows(worksheet, start_row, limit=FETCH_ROWS):
+    """start_row 行目（1始まり）から最大 limit 行を返す"""
+    return worksheet.get_values(f"A{start_row}:{LAST_COLUMN}{start_row + limit - 1}")
+
+
+def to_frame(rows, first_row):
+    """シートの行を型付きの DataFrame にする（見出し行や日時の読めない行は捨てる）"""
+    import pandas as pd
+
+    padded = [(list(row) + [""] * len(COLUMNS))[:len(COLUMNS)] for row in rows]
+    df = pd.DataFrame(padded, columns=COLUMNS)
+    df.insert(0, "sheet_row", range(first_row, first_row + len(df)))
+    df["created_at"] = pd.to_datetime(df["created_at"], format=TIMESTAMP_FORMAT, errors="coerce").dt.tz_localize(TIMEZONE)
+    df = df[df["created_at"].notna()].copy()
+    df["turn_index"] = pd.to_numeric(df["turn_key"].str.rsplit(":", n=1).str[-1], errors="coerce").astype("Int64")
+    df["is_finished"] = df["is_finished"].astype(str).str.upper().isin(["TRUE", "1"])
+    df["date"] = df["created_at"].dt.strftime("%Y-%m-%d")
+    return df
+
+
+def write_partitions(df, out_dir):
+    """講義・日付ごとのパーティションに書く（同じ行から書いたファイルは上書きされるので、やり直しても重複しない）"""
+    import pyarrow as pa
+    import pyarrow.dataset as ds
+
+    if df.empty:
+        return
+    ds.write_dataset(
+        pa.Table.from_pandas(df, preserve_index=False),
+        os.path.join(out_dir, "turns"),
+        format="parquet",
+        partitioning=ds.partitioning(pa.schema([("material", pa.string()), ("date", pa.string())]), flavor="hive"),
+        basename_template=f"part-{int(df['sheet_row'].iloc[0])}-{{i}}.parquet",
+        existing_data_behavior="overwrite_or_ignore",
+    )
+
+
+def read_turns(out_dir):
+    """書き出したターンをすべて読む（空なら None）"""
+    import pyarrow.dataset as ds
+
+    path = os.path.join(out_dir, "turns")
+    if not os.path.isdir(path):
+        return None
+    return ds.dataset(path, format="parquet", partitioning="hive").to_table().to_pandas()
+
+
+def keywords_path_getter(registry):
+    """講義名から語句ファイルのパスを返す関数（materials.json にない講義は None）"""
+    def keywords_path_of(material):
+        return registry.get(material).keywords_path if material in registry.names() else None
+    return keywords_path_of
+
+
+def keyword_coverage(turns, registry):
+    """会話ごとに、生徒の回答に出てきた重要語句（数と一覧）と講義の語句数を返す"""
+    import pandas as pd
+
+    records = keyword_scoring.score_sessions(turns, keywords_path_getter(registry))
+    return pd.DataFrame(records, columns=["session", "material", "keywords_used", "keywords_total", "terms"])
+
+
+def build_aggregates(turns, registry):
+    """(会話ごとの集計, 学生 × 講義ごとの集計) を返す"""
+    turns = turns.sort_values(["session", "created_at"])
+    finished_at = turns[turns["is_finished"]].groupby("session")["created_at"].min().rename("finished_at")
+    sessions = (
+        turns.groupby(["session", "user", "material"])
+        .agg(turns=("sheet_row", "size"), started_at=("created_at", "min"), last_at=("created_at", "max"))
+        .reset_index()
+        .join(finished_at, on="session")
+        .merge(keyword_coverage(turns, registry), on=["session", "material"], how="left")
+    )
+    sessions["finished"] = sessions["finished_at"].notna()
+    # 最初の回答から、面談が終わった回答までの時間
+    sessions["minutes_to_finish"] = (sessions["finished_at"] - sessions["started_at"]).dt.total_seconds() / 60
+    sessions["keyword_coverage"] = sessions["keywords_used"] / sessions["keywords_total"].where(sessions["keywords_total"] > 0)
+
+    students = (
+        sessions.groupby(["user", "material"])
+        .agg(
+            sessions=("session", "size"),
+            turns=("turns", "sum"),
+            finished_sessions=("finished", "sum"),
+            median_minutes_to_finish=("minutes_to_finish", "median"),
+            best_keyword_coverage=("keyword_coverage", "max"),
+            first_at=("started_at", "min"),
+            last_at=("last_at", "max"),
+        )
+        .reset_index()
+    )
+    return sessions, students
+
+
+def write_aggregates(out_dir, registry):
+    turns = read_turns(out_dir)
+    if turns is None or turns.empty:
+        return 0, 0
+    sessions, students = build_aggregates(turns, registry)
+    directory = os.path.join(out_dir, "aggregates")
+    os.makedirs(directory, exist_ok=True)
+    for name, frame in (("sessions", sessions), ("students", students)):
+        path = os.path.join(directory, f"{name}.parquet")
+        frame.to_parquet(f"{path}.tmp", index=False)
+        os.replace(f"{path}.tmp", path)
+    return len(sessions), len(students)
+
+
+def export(worksheet, spreadsheet_url, out_dir=ARCHIVE_DIR):
+    """前回の続きからシートを読んでパーティションに追記する。追記した行数を返す
+
+    読んだ位置は _state.json に残す。別のシートに向けた場合は最初から読み直す。
+    """
+    os.makedirs(out_dir, exist_ok=True)
+    state = load_state(out_dir)
+    next_row = state.get("next_row", 1) if state.get("spreadsheet_url") == spreadsheet_url else 1
+    exported = 0
+    while True:
+        rows = fetch_rows(worksheet, next_row)
+        if not rows:
+            break
+        df = to_frame(rows, next_row)
+        write_partitions(df, out_dir)
+        exported += len(df)
+        next_row += len(rows)
+        # ファイルを書き終えてから位置を進める（途中で止まっても、次回は同じ行から書き直す）
+        save_state(out_dir, {"spreadsheet_url": spreadsheet_url, "next_row": next_row})
+        if len(rows) < FETCH_ROWS:
+            break
+    return exported
+
+
+def main(argv):
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument("--secrets", default=SECRETS_PATH)
+    parser.add_argument("--out", default=ARCHIVE_DIR)
+    parser.add_argument("--rebuild-aggregates", action="store_true", help="シートを読まずに集計だけ作り直す")
+    args = parser.parse_args(argv)
+
+    if not args.rebuild_aggregates:
+        creds, spreadsheet_url, mock_url = load_secrets(args.secrets)
+        worksheet = sheet_logger.open_worksheet(creds, spreadsheet_url, mock_url)
+        print(f"追記した行: {export(worksheet, mock_url or spreadsheet_url, args.out)}")
+    sessions, students = write_aggregates(args.out, material_registry.get_registry())
+    print(f"集計: 会話 {sessions}件 / 学生 × 講義 {students}件 -> {os.path.join(args.out, 'aggregates')}")
+
+
+if __name__ == "__main__":
+    main(sys.argv[1:])
@@ -0,0 +1,195 @@
+"""講義資料PDFの本文索引（ページごとのテキスト抽出・チャンク分割・埋め込みベクトル）
+
+チャットのたびにPDFそのものを添付すると、Dify側で毎回PDF全体を解析し、全文がモデルの文脈に入る。
+ここでは事前に1度だけPDFを解析して、本文の断片（チャンク）と埋め込みベクトルを
+.material_index/<PDFのSHA-256>/ に保存しておき、各ターンでは生徒の回答に関係する断片だけを送る。
+ベクトルは正規化した float16 の .npy で、メモリマップで読み込むので講義数が増えてもメモリをほとんど使わない。
+
+事前の作成（リポジトリ直下で実行。環境変数 OPENAI_API_KEY が必要）:
+    python material_index.py geology01.pdf geology03.pdf
+"""
+import json
+import os
+import re
+import shutil
+import sys
+import tempfile
+import threading
+import unicodedata
+
+import numpy as np
+
+import dify_files
+
+INDEX_DIR = os.path.join(os.path.dirname(os.path.abspath(__file__)), ".material_index")
+EMBEDDING_MODEL = "text-embedding-3-small"
+EMBEDDING_BATCH_SIZE = 96
+# 1チャンクの目安の文字数と、前のチャンクと重ねる文字数
+CHUNK_CHARS = 300
+CHUNK_OVERLAP_CHARS = 60
+TOP_K = 4
+MAX_PASSAGE_CHARS = 1500
+
+# 各ページに入っている、本文と関係のない行
+BOILERPLATE_PATTERN = re.compile(r"^Copyright ©.*$", re.MULTILINE)
+# PDFの箇条書き記号などに使われる私用領域の文字
+PRIVATE_USE_PATTERN = re.compile("[\ue000-\uf8ff]")
+SENTENCE_PATTERN = re.compile(r"[^。！？!?]+[。！？!?]?")
+
+
+def clean_text(text):
+    text = unicodedata.normalize("NFKC", text)
+    text = BOILERPLATE_PATTERN.sub("", text)
+    text = PRIVATE_USE_PATTERN.sub("", text)
+    return re.sub(r"\s+", " ", text).strip()
+
+
+def extract_pages(pdf_path):
+    """[(ページ番号, 本文), ...] を返す（本文のないページは除く）"""
+    from pypdf import PdfReader
+
+    pages = []
+    for number, page in enumerate(PdfReader(pdf_path).pages, 1):
+        text = clean_text(page.extract_text() or "")
+        if text:
+            pages.append((number, text))
+    return pages
+
+
+def chunk_pages(pages, chunk_chars=CHUNK_CHARS, overlap_chars=CHUNK_OVERLAP_CHARS):
+    """ページごとに文の区切りでまとめたチャンク [{"page", "text"}, ...] を返す
+
+    次のチャンクの先頭には、前のチャンクの末尾の文を overlap_chars 文字分ほど重ねる。
+    """
+    chunks = []
+    for number, text in pages:
+        sentences = [s.strip() for s in SENTENCE_PATTERN.findall(text) if s.strip()]
+        current = []
+        for sentence in sentences:
+            if current and sum(len(s) for s in current) + len(sentence) > chunk_chars:
+                chunks.append({"page": number, "text": "".join(current)})
+                overlap = []
+                for s in reversed(current):
+                    if sum(len(o) for o in overlap) + len(s) > overlap_chars:
+                        break
+                    overlap.insert(0, s)
+                current = overlap
+            current.append(sentence)
+        if current:
+            chunks.append({"page": number, "text": "".join(current)})
+    return chunks
+
+
+def embed_all(texts, embed):
+    """embed(文字列のリスト) -> ベクトルのリスト をバッチごとに呼び、正規化した float16 の配列を返す"""
+    vectors = []
+    for start in range(0, len(texts), EMBEDDING_BATCH_SIZE):
+        vectors.extend(embed(texts[start:start + EMBEDDING_BATCH_SIZE]))
+    matrix = np.asarray(vectors, dtype=np.float32)
+    matrix /= np.linalg.norm(matrix, axis=1, keepdims=True) + 1e-12
+    return matrix.astype(np.float16)
+
+
+class MaterialIndex:
+    def __init__(self, chunks, embeddings):
+        self.chunks = chunks
+        self.embeddings = embeddings  # (チャンク数, 次元) の float16。メモリマップのこともある
+
+    @classmethod
+    def load(cls, directory):
+        with open(os.path.join(directory, "chunks.json"), encoding="utf-8") as f:
+            chunks = json.load(f)["chunks"]
+        embeddings = np.load(os.path.join(directory, "embeddings.npy"), mmap_mode="r")
+        return cls(chunks, embeddings)
+
+    def search(self, query_vector, k=TOP_K):
+        """クエリのベクトルとのコサイン類似度が高い順に [(類似度, チャンク), ...] を返す"""
+        if not self.chunks:
+            return []
+        query = np.asarray(query_vector, dtype=np.float32)
+        query /= np.linalg.norm(query) + 1e-12
+        scores = self.embeddings.astype(np.float32) @ query
+        k = min(k, len(scores))
+        top = np.argpartition(-scores, k - 1)[:k]
+        return [(float(scores[i]), self.chunks[i]) for i in top[np.argsort(-scores[top])]]
+
+    def passages(self, query_vector, k=TOP_K, max_chars=MAX_PASSAGE_CHARS):
+        """関係の深い断片を、資料の中の順番に並べて1つの文字列にする（Difyの入力変数に入れる用）"""
+        hits = [chunk for _, chunk in self.search(query_vector, k)]
+        order = {id(chunk): i for i, chunk in enumerate(self.chunks)}
+        lines = []
+        total = 0
+        for chunk in sorted(hits, key=lambda c: order[id(c)]):
+            line = f"[p.{chunk['page']}] {chunk['text']}"
+            if lines and total + len(line) > max_chars:
+                break
+            lines.append(line)
+            total += len(line)
+        return "\n".join(lines)
+
+
+def index_path(pdf_path, index_dir=INDEX_DIR):
+    return os.path.join(index_dir, dify_files.file_sha256(pdf_path))
+
+
+def build(pdf_path, embed, index_dir=INDEX_DIR):
+    """PDFの索引を作って保存する（同じ内容のPDFの索引がすでにあれば作らない）"""
+    directory = index_path(pdf_path, index_dir)
+    if os.path.exists(os.path.join(directory, "embeddings.npy")):
+        return MaterialIndex.load(directory)
+
+    chunks = chunk_pages(extract_pages(pdf_path))
+    embeddings = embed_all([c["text"] for c in chunks], embed) if chunks else np.zeros((0, 0), np.float16)
+    # 書きかけの索引を読まないよう、一時ディレクトリに書いてから名前を変える
+    os.makedirs(index_dir, exist_ok=True)
+    tmp = tempfile.mkdtemp(dir=index_dir)
+    try:
+        with open(os.path.join(tmp, "chunks.json"), "w", encoding="utf-8") as f:
+            json.dump({"source": os.path.basename(pdf_path), "model": EMBEDDING_MODEL, "chunks": chunks}, f, ensure_ascii=False)
+        np.save(os.path.join(tmp, "embeddings.npy"), embeddings)
+        os.replace(tmp, directory)
+    except OSError:
+        shutil.rmtree(tmp, ignore_errors=True)
+        if not os.path.exists(directory):
+            raise
+    return MaterialIndex.load(directory)
+
+
+_lock = threading.Lock()
+_indexes = {}
+
+
+def get_index(pdf_path, index_dir=INDEX_DIR):
+    """作成済みの索引を返す（プロセス全体で共有。PDFが更新されたら読み直す。未作成なら None）"""
+    directory = index_path(pdf_path, index_dir)
+    with _lock:
+        index = _indexes.get(pdf_path)
+        if index is not None and index[0] == directory:
+            return index[1]
+    if not os.path.exists(os.path.join(directory, "embeddings.npy")):
+        return None
+    loaded = MaterialIndex.load(directory)
+    with _lock:
+        _indexes[pdf_path] = (directory, loaded)
+    return loaded
+
+
+def openai_embedder(client):
+    """OpenAIの埋め込みAPIを使う embed 関数を返す"""
+    def embed(texts):
+        response = client.embeddings.create(model=EMBEDDING_MODEL, input=texts)
+        return [d.embedding for d in response.data]
+    return embed
+
+
+def main(argv):
+    from openai import OpenAI
+
+    embed = openai_embedder(OpenAI(api_key=os.environ["OPENAI_API_KEY"]))
+    for pdf_path in argv:
+        index = build(pdf_path, embed)
+        print(f"{pdf_path}: {len(index.chunks)} チャンク -> {index_path(pdf_path)}")
+
+
+if __name__ == "__main__":
+    main(sys.argv[1:])
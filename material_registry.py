@@ -0,0 +1,198 @@
+"""講義資料の一覧（materials.json）と、講義ごとの資料を必要になった時点で読み込む仕組み
+
+講義を追加するときはコードではなく materials.json に1行足す:
+    {"name": "講義名", "pdf": "資料.pdf", "keywords": "語句.txt", "greeting": "最初の質問（省略可）"}
+パスは materials.json のあるディレクトリからの相対パスで、実行時の作業ディレクトリには依存しない。
+
+起動時に読むのは一覧だけで、PDFのハッシュ・DifyのファイルID・語句の索引・本文の索引・
+最初の質問の音声は、その講義が初めて選ばれたときに用意する（講義数が増えても起動時間は変わらない）。
+事前にまとめて用意しておく場合（リポジトリ直下で実行。環境変数 DIFY_API_KEY / OPENAI_API_KEY が必要）:
+    python material_registry.py warm
+"""
+import argparse
+import json
+import os
+import sys
+import threading
+import time
+
+import dify_files
+import material_index
+import vocabulary
+
+BASE_DIR = os.path.dirname(os.path.abspath(__file__))
+MANIFEST_PATH = os.path.join(BASE_DIR, "materials.json")
+# 事前準備のコマンドがアップロードしたファイルIDの控え（{講義名: {"sha256", "file_id", "uploaded_at"}}）
+STATE_PATH = os.path.join(BASE_DIR, ".materials_state.json")
+# 事前に音声を用意するときの設定（my_app_login3.py の TTS_MODEL / TTS_VOICE / STATIC_FIRST_MSG と合わせる）
+DEFAULT_TTS_MODEL = "tts-1-hd"
+DEFAULT_TTS_VOICE = "nova"
+DEFAULT_GREETING = "授業内容について学んだことを教えてください。"
+
+
+class Material:
+    """1つの講義の資料。各資料は初めて使われたときに読み込む"""
+
+    def __init__(self, name, pdf, keywords, greeting=None, base_dir=BASE_DIR):
+        self.name = name
+        self.pdf_path = os.path.join(base_dir, pdf)
+        self.keywords_path = os.path.join(base_dir, keywords)
+        self.greeting = greeting
+        self._state_loaded = False
+
+    @property
+    def sha256(self):
+        return dify_files.file_sha256(self.pdf_path)
+
+    @property
+    def keyword_index(self):
+        """語句ファイルの索引（ファイルがなければ空の索引）"""
+        return vocabulary.get_index(self.keywords_path)
+
+    @property
+    def passage_index(self):
+        """material_index で作成済みの本文の索引（未作成なら None）"""
+        return material_index.get_index(self.pdf_path)
+
+    def file_id(self, upload_func):
+        """DifyのファイルID（事前準備でアップロード済みならそれを使い、なければ upload_func(パス) を呼ぶ）"""
+        if not self._state_loaded:
+            self._state_loaded = True
+            entry = load_state().get(self.name)
+            if entry and entry.get("sha256") == self.sha256:
+                expires_at = entry["uploaded_at"] + dify_files.FILE_ID_TTL_SECONDS
+                dify_files.remember(self.name, self.pdf_path, entry["file_id"], expires_at)
+        return dify_files.get_file_id(self.name, self.pdf_path, upload_func)
+
+
+class MaterialRegistry:
+    def __init__(self, materials):
+        self.materials = {m.name: m for m in materials}
+
+    @classmethod
+    def load(cls, manifest_path=MANIFEST_PATH):
+        with open(manifest_path, encoding="utf-8") as f:
+            manifest = json.load(f)
+        base_dir = os.path.dirname(os.path.abspath(manifest_path))
+        return cls([
+            Material(entry["name"], entry["pdf"], entry["keywords"], entry.get("greeting"), base_dir)
+            for entry in manifest["materials"]
+        ])
+
+    def names(self):
+        return list(self.materials)
+
+    def get(self, name):
+        return self.materials[name]
+
+    def __iter__(self):
+        return iter(self.materials.values())
+
+    def __len__(self):
+        return len(self.materials)
+
+
+_lock = threading.Lock()
+_registries = {}  # manifest_path -> (mtime, MaterialRegistry)
+
+
+def get_registry(manifest_path=MANIFEST_PATH):
+    """materials.json の内容（プロセス全体で共有。ファイルが更新されたら読み直す）"""
+    mtime = os.path.getmtime(manifest_path)
+    with _lock:
+        cached = _registries.get(manifest_path)
+        if cached and cached[0] == mtime:
+            return cached[1]
+    registry = MaterialRegistry.load(manifest_path)
+    with _lock:
+        _registries[manifest_path] = (mtime, registry)
+    return registry
+
+
+def load_state(state_path=STATE_PATH):
+    try:
+        with open(state_path, encoding="utf-8") as f:
+            return json.load(f)
+    except (OSError, ValueError):
+        return {}
+
+
+def save_state(state, state_path=STATE_PATH):
+    tmp = f"{state_path}.tmp"
+    with open(tmp, "w", encoding="utf-8") as f:
+        json.dump(state, f, ensure_ascii=False, indent=2)
+    os.replace(tmp, state_path)
+
+
+def warm(registry, upload=None, embed=None, synthesize=None,
+         tts_model=DEFAULT_TTS_MODEL, tts_voice=DEFAULT_TTS_VOICE, default_greeting=DEFAULT_GREETING):
+    """全講義の資料を用意する（None を渡した処理は行わない）
+
+    upload(パス) -> ファイルID: Difyへのアップロード（結果は STATE_PATH に控え、アプリが起動後に使う）
+    embed(文字列のリスト) -> ベクトルのリスト: 本文の索引の作成
+    synthesize(model, voice, text) -> 音声: 最初の質問の音声を tts_cache のディスクキャッシュに入れる
+    """
+    import tts_cache
+
+    state = load_state()
+    for material in registry:
+        start = time.perf_counter()
+        done = [f"sha256={material.sha256[:12]}", f"語句 {len(material.keyword_index.all_words)}件"]
+        if embed is not None:
+            index = material_index.build(material.pdf_path, embed)
+            done.append(f"本文 {len(index.chunks)}チャンク")
+        if upload is not None:
+            entry = state.get(material.name)
+            fresh = (entry and entry.get("sha256") == material.sha256
+                     and entry["uploaded_at"] + dify_files.FILE_ID_TTL_SECONDS > time.time())
+            if not fresh:
+                file_id = upload(material.pdf_path)
+                state[material.name] = {"sha256": material.sha256, "file_id": file_id, "uploaded_at": time.time()}
+                save_state(state)
+            done.append(f"file_id={state[material.name]['file_id']}")
+        if synthesize is not None:
+            tts_cache.get_or_synthesize(tts_model, tts_voice, material.greeting or default_greeting, synthesize)
+            done.append("挨拶の音声")
+        print(f"{material.name}: {', '.join(done)} ({time.perf_counter() - start:.1f}秒)")
+
+
+def main(argv):
+    parser = argparse.ArgumentParser(description="講義資料の事前準備")
+    parser.add_argument("command", choices=["list", "warm"])
+    parser.add_argument("--manifest", default=MANIFEST_PATH)
+    parser.add_argument("--skip-upload", action="store_true")
+    parser.add_argument("--skip-index", action="store_true")
+    parser.add_argument("--skip-tts", action="store_true")
+    args = parser.parse_args(argv)
+
+    registry = MaterialRegistry.load(args.manifest)
+    if args.command == "list":
+        for material in registry:
+            print(f"{material.name}\t{material.pdf_path}\t{material.keywords_path}")
+        return
+
+    upload = embed = synthesize = None
+    if not args.skip_upload:
+        import dify_client
+
+        client = dify_client.get_client(os.environ["DIFY_API_KEY"])
+
+        def upload(path):
+            with open(path, "rb") as f:
+                response = client.upload_file(f, os.path.basename(path), "warmup")
+            response.raise_for_status()
+            return response.json()["id"]
+    if not (args.skip_index and args.skip_tts):
+        from openai import OpenAI
+
+        openai_client = OpenAI(api_key=os.environ["OPENAI_API_KEY"])
+        if not args.skip_index:
+            embed = material_index.openai_embedder(openai_client)
+        if not args.skip_tts:
+            def synthesize(model, voice, text):
+                return openai_client.audio.speech.create(model=model, voice=voice, input=text).content
+    warm(registry, upload, embed, synthesize)
+
+
+if __name__ == "__main__":
+    main(sys.argv[1:])
@@ -0,0 +1,36 @@
+"""セッションごとのメモリ使用量の見積もり（サーバーの台数・メモリを学生数から見積もるため）"""
+import sys
+
+# 同じ学生が使う値でも、プロセス全体で共有しているものは数えない
+_SHARED_TYPES = (type, type(sys))
+
+
+def deep_sizeof(obj, seen=None):
+    """オブジェクトとその中身のおおよそのバイト数"""
+    if seen is None:
+        seen = set()
+    if id(obj) in seen or isinstance(obj, _SHARED_TYPES):
+        return 0
+    seen.add(id(obj))
+    size = sys.getsizeof(obj)
+    if isinstance(obj, dict):
+        size += sum(deep_sizeof(k, seen) + deep_sizeof(v, seen) for k, v in obj.items())
+    elif isinstance(obj, (list, tuple, set, frozenset)):
+        size += sum(deep_sizeof(item, seen) for item in obj)
+    elif hasattr(obj, "__dict__"):
+        size += deep_sizeof(vars(obj), seen)
+    return size
+
+
+def session_report(session_state):
+    """session_state の各キーのバイト数を大きい順に [(キー, バイト数), ...] で返す"""
+    seen = set()
+    rows = []
+    for key in list(session_state.keys()):
+        try:
+            value = session_state[key]
+        except KeyError:
+            continue
+        rows.append((str(key), deep_sizeof(value, seen)))
+    rows.sort(key=lambda r: r[1], reverse=True)
+    return rows
@@ -0,0 +1,231 @@
+"""外部APIの呼び出しとターンの各段階の所要時間・失敗数・送受信量の集計
+
+呼び出しごとの所要時間と送受信量をヒストグラムに、失敗を種類別の件数に積み上げる。
+集計はプロセス全体で共有し、管理者用のサイドバーで p50/p95/p99 を見られるほか、
+Prometheus のテキスト形式で書き出せる（node_exporter の textfile collector などで取り込む）。
+"""
+import functools
+import os
+import threading
+import time
+from collections import deque
+from contextlib import contextmanager
+
+import shared_state
+
+SECONDS_BUCKETS = (0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0, 10.0, 30.0, 60.0)
+BYTES_BUCKETS = (256, 1024, 4096, 16384, 65536, 262144, 1048576, 4194304, 16777216)
+# パーセンタイルは直近のこの件数から求める（ヒストグラムの累計は別に持つ）
+RECENT_SAMPLES = 1024
+# 複数ワーカーの場合は、ワーカーごとのファイルに worker ラベルを付けて書き出す（集計は Prometheus 側で行う）
+EXPORT_DIR_ENV = "INTERVIEW_METRICS_DIR"
+EXPORT_PATH = os.path.join(
+    os.environ.get(EXPORT_DIR_ENV) or os.path.dirname(os.path.abspath(__file__)),
+    ".metrics.prom" if shared_state.WORKER_ID is None else f".metrics.{shared_state.WORKER_ID}.prom",
+)
+EXPORT_INTERVAL_SECONDS = 15.0
+PREFIX = "interview"
+
+
+class Histogram:
+    def __init__(self, buckets):
+        self.buckets = buckets
+        self.counts = [0] * (len(buckets) + 1)  # 最後は +Inf
+        self.total = 0.0
+        self.count = 0
+        self.recent = deque(maxlen=RECENT_SAMPLES)
+
+    def observe(self, value):
+        for i, bound in enumerate(self.buckets):
+            if value <= bound:
+                self.counts[i] += 1
+                break
+        else:
+            self.counts[-1] += 1
+        self.total += value
+        self.count += 1
+        self.recent.append(value)
+
+    def percentile(self, p):
+        if not self.recent:
+            return None
+        values = sorted(self.recent)
+        return values[min(len(values) - 1, int(len(values) * p))]
+
+
+_lock = threading.Lock()
+_durations = {}  # (系列名, ラベルのタプル) -> Histogram（秒）
+_sizes = {}      # (系列名, ラベルのタプル) -> Histogram（バイト）
+_errors = {}     # (系列名, ラベルのタプル) -> 件数
+
+
+def _labels(**labels):
+    return tuple(sorted(labels.items()))
+
+
+def observe(series, seconds, **labels):
+    with _lock:
+        key = (series, _labels(**labels))
+        hist = _durations.get(key)
+        if hist is None:
+            hist = _durations[key] = Histogram(SECONDS_BUCKETS)
+        hist.observe(seconds)
+
+
+def observe_size(series, size, **labels):
+    with _lock:
+        key = (series, _labels(**labels))
+        hist = _sizes.get(key)
+        if hist is None:
+            hist = _sizes[key] = Histogram(BYTES_BUCKETS)
+        hist.observe(size)
+
+
+def count_error(series, error, **labels):
+    with _lock:
+        key = (series, _labels(error=error, **labels))
+        _errors[key] = _errors.get(key, 0) + 1
+
+
+class _Call:
+    def __init__(self, call):
+        self.call = call
+
+    def size(self, size):
+        """この呼び出しの送受信量（バイト）を記録する"""
+        observe_size("call_payload_bytes", size, call=self.call)
+
+
+@contextmanager
+def track(call):
+    """with の中の所要時間を記録し、例外が出たら種類別に数えてそのまま送出する
+
+        with metrics.track("whisper") as m:
+            m.size(len(audio_bytes))
+            ...
+    """
+    start = time.perf_counter()
+    try:
+        yield _Call(call)
+    except Exception as e:
+        count_error("call_errors_total", type(e).__name__, call=call)
+        raise
+    finally:
+        observe("call_seconds", time.perf_counter() - start, call=call)
+
+
+def timed(call):
+    """関数の所要時間と例外を call の名前で記録するデコレータ"""
+    def decorator(fn):
+        @functools.wraps(fn)
+        def wrapper(*args, **kwargs):
+            with track(call):
+                return fn(*args, **kwargs)
+        return wrapper
+    return decorator
+
+
+def observe_turn(summary):
+    """TurnPipeline.summary() の全体と各段階の所要時間を記録する"""
+    observe("turn_seconds", summary["wall"], kind=summary["kind"])
+    for name, _, duration in summary["stages"]:
+        observe("turn_stage_seconds", duration, kind=summary["kind"], stage=name)
+    for name, at in summary["marks"].items():
+        observe("turn_mark_seconds", at, kind=summary["kind"], mark=name)
+
+
+def snapshot():
+    """管理画面用に [{"series", "labels", "count", "errors", "p50", "p95", "p99", "avg_bytes"}, ...] を返す"""
+    with _lock:
+        rows = []
+        for (series, labels), hist in sorted(_durations.items()):
+            label_dict = dict(labels)
+            errors = sum(count for (s, l), count in _errors.items()
+                         if s == "call_errors_total" and series == "call_seconds"
+                         and dict(l).get("call") == label_dict.get("call"))
+            size = _sizes.get(("call_payload_bytes", labels)) if series == "call_seconds" else None
+            rows.append({
+                "series": series,
+                "labels": ", ".join(f"{k}={v}" for k, v in labels),
+                "count": hist.count,
+                "errors": errors,
+                "p50": hist.percentile(0.5),
+                "p95": hist.percentile(0.95),
+                "p99": hist.percentile(0.99),
+                "avg_bytes": size.total / size.count if size and size.count else None,
+            })
+        return rows
+
+
+def _format_labels(labels, extra=()):
+    items = list(labels) + list(extra)
+    if shared_state.WORKER_ID is not None:
+        items.append(("worker", shared_state.WORKER_ID))
+    if not items:
+        return ""
+    escaped = (str(v).replace("\\", "\\\\").replace('"', '\\"').replace("\n", "\\n") for _, v in items)
+    return "{" + ",".join(f'{k}="{v}"' for (k, _), v in zip(items, escaped)) + "}"
+
+
+def _format_histograms(lines, histograms):
+    by_series = {}
+    for (series, labels), hist in histograms.items():
+        by_series.setdefault(series, []).append((labels, hist))
+    for series, entries in sorted(by_series.items()):
+        name = f"{PREFIX}_{series}"
+        lines.append(f"# TYPE {name} histogram")
+        for labels, hist in sorted(entries):
+            cumulative = 0
+            for bound, count in zip(list(hist.buckets) + ["+Inf"], hist.counts):
+                cumulative += count
+                lines.append(f"{name}_bucket{_format_labels(labels, [('le', bound)])} {cumulative}")
+            lines.append(f"{name}_sum{_format_labels(labels)} {hist.total:.6f}")
+            lines.append(f"{name}_count{_format_labels(labels)} {hist.count}")
+
+
+def prometheus_text():
+    """Prometheus のテキスト形式で全系列を返す"""
+    lines = []
+    with _lock:
+        _format_histograms(lines, _durations)
+        _format_histograms(lines, _sizes)
+        by_series = {}
+        for (series, labels), count in _errors.items():
+            by_series.setdefault(series, []).append((labels, count))
+        for series, entries in sorted(by_series.items()):
+            name = f"{PREFIX}_{series}"
+            lines.append(f"# TYPE {name} counter")
+            for labels, count in sorted(entries):
+                lines.append(f"{name}{_format_labels(labels)} {count}")
+    return "\n".join(lines) + "\n"
+
+
+def write_textfile(path=EXPORT_PATH):
+    """prometheus_text() をファイルに書き出す（読み手が書きかけを読まないよう、別名で書いてから置き換える）"""
+    tmp = f"{path}.tmp"
+    with open(tmp, "w", encoding="utf-8") as f:
+        f.write(prometheus_text())
+    os.replace(tmp, path)
+
+
+_exporter = None
+
+
+def start_exporter(path=EXPORT_PATH, interval=EXPORT_INTERVAL_SECONDS):
+    """一定間隔でファイルに書き出すスレッドを始める（プロセス内で1度だけ）"""
+    global _exporter
+    with _lock:
+        if _exporter is not None:
+            return _exporter
+
+        def run():
+            while True:
+                time.sleep(interval)
+                try:
+                    write_textfile(path)
+                except OSError:
+                    pass
+
+        _exporter = threading.Thread(target=run, name="metrics-exporter", daemon=True)
+        _exporter.start()
+        return _exporter
@@ -6,9 +6,10 @@ from openai import OpenAI
 from streamlit_mic_recorder import mic_recorder
 import io
 import yaml # 設定保存用
-from streamlit_gsheets import GSheetsConnection
 import datetime
 
+import sheet_logger
+
 # --- 1. ユーザー情報の設定 ---
 names = ["田中 太郎", "佐藤 花子"]
 usernames = ["tanaka", "sato"]
@@ -39,8 +40,12 @@ elif st.session_state["authentication_status"]:
     name = st.session_state["name"]
     client = OpenAI(api_key=st.secrets["OPENAI_API_KEY"])
 
-    # --- ★スプレッドシート接続の準備 ---
-    conn = st.connection("gsheets", type=GSheetsConnection)
+    # --- ★スプレッドシート接続の準備（ログはジャーナル経由でバックグラウンド送信） ---
+    log_writer = sheet_logger.get_writer(
+        st.secrets["connections"]["gsheets"],
+        st.secrets["spreadsheet_url"],
+        6  # ログ行(5列)の次の列にターンキーを書く
+    )
 
     with st.sidebar:
         st.write(f"ようこそ、{name} さん")
@@ -162,34 +167,13 @@ elif st.session_state["authentication_status"]:
                 # 現在の時刻
                 now = datetime.datetime.now(datetime.timezone(datetime.timedelta(hours=9))).strftime('%Y-%m-%d %H:%M:%S')
                 
-                # 【重要】ttl=0 を追加してキャッシュを無効化し、常に最新のスプレッドシートを読み込む
-                # また、空の行を読み込まないように引数を調整
-                existing_data = conn.read(
-                    spreadsheet=st.secrets["spreadsheet_url"], 
-                    ttl=0  # キャッシュを0秒にする（毎回新しく読み込む）
-                )
-                
-                # 新しい行を作成
-                new_row = {
-                    "date": now,
-                    "user_id": username,
-                    "user_input": user_input,
-                    "ai_response": full_response,
-                    "conversation_id": st.session_state.conversation_id
-                }
-                
-                # データを追記
-                import pandas as pd
-                new_row_df = pd.DataFrame([new_row])
-                
-                # 既存データが空の場合でも動くように処理
-                if existing_data.empty:
-                    updated_df = new_row_df
-                else:
-                    updated_df = pd.concat([existing_data, new_row_df], ignore_index=True)
+                # 新しい行を作成（列順: date, user_id, user_input, ai_response, conversation_id）
+                new_row = [now, username, user_input, full_response, st.session_state.conversation_id]
                 
-                # スプレッドシートを更新
-                conn.update(spreadsheet=st.secrets["spreadsheet_url"], data=updated_df)
+                # シート全体を読み直して書き戻すのではなく、ローカルのジャーナルに1行追記するだけ
+                # （会話ID + ターン番号で一意なので、送信の再試行で重複しない）
+                turn_index = sum(1 for m in st.session_state.messages if m["role"] == "user")
+                log_writer.enqueue(f"{st.session_state.conversation_id}:{turn_index}", new_row)
                 
             except Exception as e:
                 st.error(f"ログ保存エラー: {e}")
@@ -1,35 +1,16 @@
 import streamlit as st
-import requests
 import os
 import datetime
-import pandas as pd
-from streamlit_gsheets import GSheetsConnection
 import json
-import base64
 import io
-
-# --- 追加ライブラリ ---
-from streamlit_mic_recorder import mic_recorder
-from openai import OpenAI
-import gspread
-
-# --- スプレッドシート接続 ---
-conn = st.connection("gsheets", type=GSheetsConnection)
-
-# --- 設定 ---
-DIFY_API_KEY = st.secrets["DIFY_API_KEY"]
-openai_client = OpenAI(api_key=st.secrets["OPENAI_API_KEY"])
-
-BASE_URL = "https://api.dify.ai/v1"
-FILE_VARIABLE_KEY = "material"
-MATERIALS = {
-    "地学基礎　第1講": {"pdf": "geology01.pdf", "keywords": "keywords01.txt"},
-    "地学基礎　第3講": {"pdf": "geology03.pdf", "keywords": "keywords03.txt"}
-}
-
-headers = {
-    "Authorization": f"Bearer {DIFY_API_KEY}"
-}
+import uuid
+import hashlib
+import time
+import queue
+from contextlib import contextmanager
+import streamlit.components.v1 as components
+from streamlit import runtime
+from streamlit.runtime.scriptrunner import get_script_run_ctx
 
 # --- ログイン機能（パスワード認証版） ---
 def login():
@@ -63,95 +44,286 @@ def login():
                     st.error("ユーザーIDが見つかりません。")
         st.stop()
 
+# ==========================================
+# ログイン画面（重いライブラリやクライアントを用意する前に表示する）
+# ==========================================
+st.set_page_config(page_title="講義復習支援チャットボット", page_icon="🤖")
+st.title("講義復習支援チャットボット")
+login()
+
+# --- 追加ライブラリ（ここから下はログイン後にだけ読み込む。2回目以降の実行では読み込み済み） ---
+from streamlit_mic_recorder import mic_recorder
+try:
+    # 任意の依存。入っていれば録音しながら書き起こす（なければ録音後にまとめて書き起こす）
+    from streamlit_webrtc import webrtc_streamer, WebRtcMode
+except ImportError:
+    webrtc_streamer = None
+
+import dify_files
+import tts_pipeline
+import tts_cache
+import sheet_logger
+import vocabulary
+import keyword_correction
+import memory_report
+import dify_client
+import turn_pipeline
+import audio_preprocess
+import chunked_transcription
+import material_index
+import material_registry
+import metrics
+import keyword_scoring
+import rate_limiter
+import session_store
+import shared_state
+
+# --- 設定 ---
+@st.cache_resource
+def get_openai_client(api_key, base_url):
+    """OpenAIのクライアントを接続プールごとプロセス全体で共有する（openai は最初の1回だけ読み込む）"""
+    from openai import OpenAI
+    return OpenAI(api_key=api_key, base_url=base_url)
+
+DIFY_API_KEY = st.secrets["DIFY_API_KEY"]
+# 接続先は secrets で差し替えられる（負荷試験では benchmarks/mock_services.py に向ける）
+OPENAI_BASE_URL = st.secrets.get("OPENAI_BASE_URL")
+openai_client = get_openai_client(st.secrets["OPENAI_API_KEY"], OPENAI_BASE_URL)
+
+BASE_URL = st.secrets.get("DIFY_BASE_URL", dify_client.BASE_URL)
+dify = dify_client.get_client(DIFY_API_KEY, BASE_URL)
+FILE_VARIABLE_KEY = "material"
+# 講義資料の渡し方。"file": PDFを毎回添付する / "passages": 回答に関係する本文の断片だけを送る
+# （"passages" には material_index.py で作った索引と、Difyアプリ側の段落型の入力変数 passages が必要）
+MATERIAL_MODE = "file"
+PASSAGES_VARIABLE_KEY = "passages"
+# 講義の一覧は materials.json（講義の追加はコードを変えずにそこへ足す）
+materials = material_registry.get_registry()
+# 外部APIの1分あたりの上限（OpenAI の Tier などに合わせて secrets の [rate_limits] で指定する）
+rate_limiter.configure(st.secrets.get("rate_limits", {}))
+
+BUSY_MESSAGE = "ただいまAIが混雑しています。少し時間をおいてから、もう一度送信してください。"
+
+TTS_MODEL = "tts-1-hd"
+TTS_VOICE = "nova"
+# 音声を配信する枠のセッションごとの数（ブラウザは再生キューに積んだ時点で取りに来るので、数文分あれば足りる）
+AUDIO_URL_SLOTS = 16
+STATIC_FIRST_MSG = "授業内容について学んだことを教えてください。"
+# Whisperに送る録音の形式（"opus" は ffmpeg がある場合だけ有効。なければWAVで送る）
+AUDIO_CODEC = "opus"
+
 # --- Dify連携関数群 ---
+@contextmanager
+def api_slot(provider, priority=rate_limiter.INTERACTIVE):
+    """外部APIの呼び出しを全セッション共通の順番待ちに並ばせる
+
+    スクリプトのスレッドから呼んだ場合は、待っている間その場所に順番を表示する。
+    """
+    notice = st.empty() if get_script_run_ctx(suppress_warning=True) else None
+    def show_position(ahead):
+        if ahead:
+            notice.info(f"⏳ アクセスが集中しています。順番待ち中です（あなたの前に{ahead}件）")
+        else:
+            notice.info("⏳ アクセスが集中しています。まもなく順番です")
+    with rate_limiter.slot(provider, current_user, priority, show_position if notice else None):
+        if notice:
+            notice.empty()
+        yield
+
 def upload_local_file_to_dify(file_path, user_id):
     if not os.path.exists(file_path):
         st.error(f"ファイルが見つかりません: {file_path}")
         return None
-    url = f"{BASE_URL}/files/upload"
     with open(file_path, "rb") as f:
-        files = {'file': (os.path.basename(file_path), f, 'application/pdf')}
-        data = {'user': user_id}
         try:
-            response = requests.post(url, headers=headers, files=files, data=data)
-            response.raise_for_status()
+            with api_slot("dify"), metrics.track("dify_upload") as m:
+                m.size(os.path.getsize(file_path))
+                response = dify.upload_file(f, os.path.basename(file_path), user_id)
+                response.raise_for_status()
             return response.json().get('id')
+        except dify_client.DifyServiceBusy:
+            st.warning(BUSY_MESSAGE)
+            return None
         except Exception as e:
             st.error(f"内部アップロードエラー: {e}")
             return None
 
-def send_chat_message(query, conversation_id, file_id_to_send, user_id, material_name):
-    url = f"{BASE_URL}/chat-messages"
+def get_material_file_id(material_name, user_id):
+    """講義資料のDifyファイルIDを取得する（全セッション共通のキャッシュ経由）"""
+    material = materials.get(material_name)
+    if not os.path.exists(material.pdf_path):
+        st.error(f"ファイルが見つかりません: {material.pdf_path}")
+        return None
+    return material.file_id(lambda path: upload_local_file_to_dify(path, user_id))
+
+def uses_passages(material_name):
+    """この講義で、PDFの代わりに本文の断片を送るか（索引が未作成ならPDFを添付する）"""
+    return MATERIAL_MODE == "passages" and materials.get(material_name).passage_index is not None
+
+def retrieve_passages(material_name, question, answer):
+    """直前の質問と生徒の回答に関係する講義資料の断片を返す（断片を使わない・検索に失敗した場合は None）"""
+    if not uses_passages(material_name):
+        return None
+    try:
+        index = materials.get(material_name).passage_index
+        with api_slot("embeddings"):
+            query_vector = material_index.openai_embedder(openai_client)([f"{question}\n{answer}"])[0]
+        return index.passages(query_vector)
+    except Exception as e:
+        st.error(f"資料検索エラー: {e}")
+        return None
+
+def is_stale_file_error(response):
+    """Difyがファイル参照を拒否したエラーかどうか（保持期限切れのファイルIDなど）"""
+    if response.status_code not in (400, 404):
+        return False
+    try:
+        body = response.json()
+    except ValueError:
+        return False
+    detail = f"{body.get('code', '')} {body.get('message', '')}".lower()
+    return "file" in detail
+
+def build_chat_payload(query, conversation_id, file_id_to_send, user_id, material_name, passages=None):
     inputs = {"material_name": material_name}
-    if file_id_to_send:
+    if passages is not None:
+        inputs[PASSAGES_VARIABLE_KEY] = passages
+    elif file_id_to_send:
         inputs[FILE_VARIABLE_KEY] = {
             "type": "document", 
             "transfer_method": "local_file",
             "upload_file_id": file_id_to_send
         }
-    payload = {
+    return {
         "inputs": inputs,
         "query": query,
-        "response_mode": "blocking",
+        "response_mode": "streaming",
         "conversation_id": conversation_id,
         "user": user_id,
     }
+
+def post_chat_message(query, conversation_id, file_id_to_send, user_id, material_name, passages=None):
+    """chat-messages にストリーミングでPOSTする。ファイルIDが失効していたら再アップロードして1度だけ送り直す"""
+    payload = build_chat_payload(query, conversation_id, file_id_to_send, user_id, material_name, passages)
+    with api_slot("dify"), metrics.track("dify_chat") as m:
+        m.size(len(json.dumps(payload, ensure_ascii=False).encode("utf-8")))
+        response = dify.chat_messages(payload, stream=True)
+        retry = passages is None and file_id_to_send and is_stale_file_error(response)
+        if not retry:
+            raise_for_chat_status(response)
+    if retry:
+        dify_files.invalidate(material_name, materials.get(material_name).pdf_path, file_id_to_send)
+        file_id_to_send = get_material_file_id(material_name, user_id)
+        st.session_state.current_file_id = file_id_to_send
+        payload = build_chat_payload(query, conversation_id, file_id_to_send, user_id, material_name)
+        with api_slot("dify"), metrics.track("dify_chat") as m:
+            m.size(len(json.dumps(payload, ensure_ascii=False).encode("utf-8")))
+            response = dify.chat_messages(payload, stream=True)
+            raise_for_chat_status(response)
+    return response
+
+def raise_for_chat_status(response):
+    """エラー応答なら例外を送出する（metrics.track の中で呼び、エラーとして数えさせる）"""
+    if response.status_code == 400:
+        # 400エラーの時はDifyからの詳細メッセージを表示
+        st.error(f"Difyエラー詳細: {response.text}") 
+    response.raise_for_status()
+
+def iter_sse_events(response):
+    """DifyのSSEレスポンスから `data:` 行のJSONイベントを順に取り出す"""
+    for line in response.iter_lines():
+        if not line:
+            continue
+        decoded_line = line.decode("utf-8")
+        if not decoded_line.startswith("data:"):
+            continue
+        yield json.loads(decoded_line[5:].strip())
+
+def stream_chat_message(query, conversation_id, file_id_to_send, user_id, material_name, result, passages=None):
+    """Difyの回答をストリーミングで受け取り、届いた断片から順に返すジェネレータ
+
+    終了後の result には回答全体をまとめた辞書（conversation_id / answer / metadata）が入る。
+    エラー時は result が空のまま終わる。
+    """
+    answer = ""
+    final = {"conversation_id": conversation_id, "answer": "", "metadata": {}}
+    workflow_outputs = {}
     try:
-        response = requests.post(url, headers=headers, json=payload)
-        if response.status_code == 400:
-            # 400エラーの時はDifyからの詳細メッセージを表示
-            st.error(f"Difyエラー詳細: {response.text}") 
-        response.raise_for_status()
-        return response.json()
+        # dify_chat は応答が返り始めるまで、dify_stream は回答を受け取り終えるまでの時間
+        with metrics.track("dify_stream"), post_chat_message(
+            query, conversation_id, file_id_to_send, user_id, material_name, passages
+        ) as response:
+            for chunk in iter_sse_events(response):
+                event = chunk.get("event")
+                if chunk.get("conversation_id"):
+                    final["conversation_id"] = chunk["conversation_id"]
+
+                if event in ("message", "agent_message"):
+                    text = chunk.get("answer", "")
+                    answer += text
+                    yield text
+                elif event == "message_replace":
+                    # 出力が差し替えられた場合（コンテンツモデレーション等）
+                    answer = chunk.get("answer", "")
+                elif event == "workflow_finished":
+                    workflow_outputs = (chunk.get("data") or {}).get("outputs") or {}
+                elif event == "message_end":
+                    final["metadata"] = chunk.get("metadata") or {}
+                elif event == "error":
+                    metrics.count_error("call_errors_total", chunk.get("code") or "error", call="dify_stream")
+                    st.error(f"Difyエラー詳細: {chunk.get('code')} {chunk.get('message')}")
+                    return
+                # ping などその他のイベントは読み飛ばす
+    except dify_client.DifyServiceBusy:
+        st.warning(BUSY_MESSAGE)
+        return
     except Exception as e:
         st.error(f"通信エラー: {e}")
-        return None
+        return
+
+    # is_finished は message_end の metadata にあればそれを使い、なければワークフローの出力を参照する
+    if "workflow_outputs" not in final["metadata"] and workflow_outputs:
+        final["metadata"]["workflow_outputs"] = workflow_outputs
+    final["answer"] = answer
+    result.update(final)
 
 # --- ログ保存機能 ---
-def save_log_to_sheet(session, user, material, system_question, user_answer):
+LOG_KEY_COLUMN = 7  # ログ行の7列目にターンキーを書く（8列目以降は is_finished）
+
+def get_log_writer():
+    # Secretsからサービスアカウント情報を取得して直接認証
+    # st.secrets["connections"]["gsheets"] の構造に合わせて指定してください
+    # SHEETS_MOCK_URL は負荷試験でモックに書くときだけ設定する（本番では設定しない）
+    return sheet_logger.get_writer(
+        st.secrets["connections"]["gsheets"], st.secrets["spreadsheet_url"], LOG_KEY_COLUMN,
+        st.secrets.get("SHEETS_MOCK_URL"),
+    )
+
+@metrics.timed("log_enqueue")
+def save_log_to_sheet(session, user, material, system_question, user_answer, turn_index, turn=None, is_finished=False):
+    """ログ行をローカルのジャーナルに書く（シートへの反映はバックグラウンドでまとめて行う）
+
+    turn を渡した場合、ジャーナルへの書き込みもワーカーで行い、他の処理と重ねる。
+    is_finished（この回答で面談が終わったか）はターンキーの後ろの列に書く。
+    """
     try:
         created_date = datetime.datetime.now(datetime.timezone(datetime.timedelta(hours=9))).strftime('%Y-%m-%d %H:%M:%S')
-        new_row = [session, user, material, system_question, user_answer, created_date]
-        
-        # Secretsからサービスアカウント情報を取得して直接認証
-        # st.secrets["connections"]["gsheets"] の構造に合わせて指定してください
-        creds_dict = st.secrets["connections"]["gsheets"]
-        gc = gspread.service_account_from_dict(creds_dict)
-        
-        # スプレッドシートを開いて1行追記
-        sh = gc.open_by_url(st.secrets["spreadsheet_url"])
-        ws = sh.get_worksheet(0)
-        ws.append_row(new_row)
-        
+        new_row = [session, user, material, system_question, user_answer, created_date, is_finished]
+        writer = get_log_writer()
+        if turn:
+            turn.submit("log", writer.enqueue, f"{session}:{turn_index}", new_row)
+        else:
+            writer.enqueue(f"{session}:{turn_index}", new_row)
     except Exception as e:
         st.error(f"ログ保存エラー (追記失敗): {e}")
 
-def transcribe_audio(audio_bytes, keyword_file):
-    try:
-        # 1. キーワードファイルの読み込みと整形
-        vocab_prompt = ""
-        if os.path.exists(keyword_file):
-            with open(keyword_file, "r", encoding="utf-8") as f:
-                content = f.read()
-                
-            all_keywords = []
-            # 行ごとに分割（改行区切り対応）
-            for line in content.splitlines():
-                # 各行をさらにカンマで分割（カンマ区切り対応）
-                parts = line.split(',')
-                for p in parts:
-                    clean_word = p.strip()
-                    if clean_word:
-                        all_keywords.append(clean_word)
-            
-            # 重複を除去してカンマ区切りの文字列にする
-            unique_keywords = list(dict.fromkeys(all_keywords))
-            vocab_prompt = ",".join(unique_keywords)
-        
-        # 2. 音声認識の実行
-        audio_file = io.BytesIO(audio_bytes)
-        audio_file.name = "input.wav"
-        
+def request_transcription(audio_bytes, filename, vocab_prompt):
+    """Whisperで1回書き起こす（ワーカースレッドからも呼ばれるので st.* は使わない）"""
+    audio_file = io.BytesIO(audio_bytes)
+    audio_file.name = filename
+
+    with api_slot("whisper"), metrics.track("whisper") as m:
+        m.size(len(audio_bytes))
         transcript = openai_client.audio.transcriptions.create(
             model="whisper-1", 
             file=audio_file, 
@@ -159,33 +331,98 @@ def transcribe_audio(audio_bytes, keyword_file):
             prompt=vocab_prompt, # 指示文なし。単語の羅列を直接渡すのが正解。
             temperature=0.0
         )
-        return transcript.text
+    return transcript.text
+
+def transcribe_audio(samples, keyword_file, raw_audio=None):
+    """前処理済み（16kHzモノラル）の録音を書き起こす
+
+    前処理できなかった録音は samples を None にして、元のデータを raw_audio に渡す（そのまま送る）。
+    """
+    try:
+        # 1. キーワード索引（講義ごとに1度だけ作られ、ファイル更新時のみ作り直される）
+        vocab_prompt = vocabulary.get_index(keyword_file).whisper_prompt
+        
+        # 2. 音声認識の実行（長い録音は重なりのある区間に分けて並行に書き起こす）
+        def request(audio_bytes, filename):
+            return request_transcription(audio_bytes, filename, vocab_prompt)
+        if samples is None:
+            return request(raw_audio, "input.wav")
+        if len(samples) > chunked_transcription.PARALLEL_MIN_SECONDS * audio_preprocess.TARGET_RATE:
+            return chunked_transcription.transcribe_all(samples, audio_preprocess.TARGET_RATE, request, AUDIO_CODEC, current_user)
+        return request(*audio_preprocess.encode(samples, AUDIO_CODEC))
     except Exception as e:
         st.error(f"音声認識エラー: {e}")
         return ""
 
+def run_live_transcription(ctx, keyword_file, draft_slot):
+    """録音中の音声を受け取りながら区間ごとに書き起こし、下書きを入力欄の位置に表示する
+
+    停止ボタンでスクリプトが中断されても続きを使えるよう、書き起こしの途中経過は session_state に置く。
+    """
+    vocab_prompt = vocabulary.get_index(keyword_file).whisper_prompt
+    def request(audio_bytes, filename):
+        return request_transcription(audio_bytes, filename, vocab_prompt)
+
+    if "live_turn" not in st.session_state:
+        st.session_state.live_turn = turn_pipeline.TurnPipeline("live", current_user)
+    shown = None
+    while ctx.state.playing:
+        try:
+            frames = ctx.audio_receiver.get_frames(timeout=1)
+        except queue.Empty:
+            continue
+        for frame in frames:
+            samples, rate = chunked_transcription.frame_to_mono(frame)
+            if st.session_state.get("live_transcriber") is None:
+                st.session_state.live_transcriber = chunked_transcription.ChunkedTranscriber(
+                    request, rate, AUDIO_CODEC, user=current_user
+                )
+            st.session_state.live_transcriber.feed(samples, rate)
+        draft = st.session_state.live_transcriber.draft() if st.session_state.get("live_transcriber") else ""
+        if draft != shown:
+            shown = draft
+            # 無効化した入力欄で下書きを見せる（毎回新しいキーで作り直す）
+            st.session_state.live_draft_count = st.session_state.get("live_draft_count", 0) + 1
+            draft_slot.text_area(
+                label="メッセージ入力",
+                value=draft,
+                key=f"{input_key}_draft_{st.session_state.live_draft_count}",
+                label_visibility="collapsed",
+                disabled=True
+            )
+
+def finish_live_transcription(keyword_file):
+    """録音の停止後、最後の区間だけを書き起こして全体をつなぎ、校正して入力欄に入れる"""
+    transcriber = st.session_state.pop("live_transcriber", None)
+    turn = st.session_state.pop("live_turn", None) or turn_pipeline.TurnPipeline("live", current_user)
+    if transcriber is None:
+        return
+    with st.spinner("音声処理中..."):
+        try:
+            with turn.stage("transcribe"):
+                transcribed_text = transcriber.finish()
+        except Exception as e:
+            st.error(f"音声認識エラー: {e}")
+            return
+        if transcribed_text:
+            with turn.stage("correct"):
+                st.session_state.temp_user_input = correct_transcript(transcribed_text, keyword_file)
+            finish_turn(turn)
+            rerun_chat_panel()
+
 def correct_transcript(text, keyword_file):
-    """Whisperの誤認識をLLMで直す関数"""
+    """Whisperの誤認識を直す関数（まずローカルで直し、自信がない場合だけLLMを使う）"""
     try:
-        # 1. キーワードファイルの読み込みと整形
-        keywords_str = ""
-        if os.path.exists(keyword_file):
-            with open(keyword_file, "r", encoding="utf-8") as f:
-                content = f.read()
-                
-            all_keywords = []
-            # 行ごとに分割（改行区切り対応）
-            for line in content.splitlines():
-                # 各行をさらにカンマで分割（カンマ区切り対応）
-                parts = line.split(',')
-                for p in parts:
-                    clean_word = p.strip()
-                    if clean_word:
-                        all_keywords.append(clean_word)
-            
-            # 重複を除去してカンマ区切りの文字列にする
-            unique_keywords = list(dict.fromkeys(all_keywords))
-            keywords_str = ",".join(unique_keywords)
+        # 1. キーワード索引から校正用の語句一覧を取り出す
+        index = vocabulary.get_index(keyword_file)
+        keywords_str = index.correction_prompt
+
+        # 2. 重要語句の誤認識をローカルで校正し、十分確かならLLMを呼ばずに返す
+        with metrics.track("correct_local"):
+            local = keyword_correction.correct(text, index)
+        if keyword_correction.is_confident(local):
+            return local.text
+        text = local.text
 
         prompt = f"""
         生徒が中学理科の授業について振り返った際の録音を文字起こししましたが、認識精度の限界により誤字脱字があるかもしれないので、修正してください。
@@ -201,40 +438,196 @@ def correct_transcript(text, keyword_file):
 
         {f"■ 授業内容に含まれる重要語句（この単語への誤変換が疑われる場合に参考にせよ）: {keywords_str}" if keywords_str else ""}
         """
-        response = openai_client.chat.completions.create(
-            model="gpt-4o-mini", # 高速・安価なモデル
-            messages=[
-                {"role": "system", "content": "あなたは優秀な校正者です。音声書き起こしにみられる誤字脱字などを修正してください。"},
-                {"role": "user", "content": prompt}
-            ],
-            temperature=0.0
-        )
+        with api_slot("chat"), metrics.track("correct_llm") as m:
+            m.size(len(prompt.encode("utf-8")))
+            response = openai_client.chat.completions.create(
+                model="gpt-4o-mini", # 高速・安価なモデル
+                messages=[
+                    {"role": "system", "content": "あなたは優秀な校正者です。音声書き起こしにみられる誤字脱字などを修正してください。"},
+                    {"role": "user", "content": prompt}
+                ],
+                temperature=0.0
+            )
         return response.choices[0].message.content.strip()
     except:
         return text
 
-def text_to_speech_autoplay(text):
-    try:
+def call_tts_api(model, voice, text, user=None):
+    # 音声合成はワーカーで行い、対話の呼び出し（回答・書き起こし）を先に通す
+    with rate_limiter.slot("tts", user, rate_limiter.BACKGROUND), metrics.track("tts") as m:
         response = openai_client.audio.speech.create(
-            model="tts-1-hd", voice="nova", input=text
+            model=model, voice=voice, input=text
         )
-        audio_bytes = response.content
-        audio_base64 = base64.b64encode(audio_bytes).decode('utf-8')
-        audio_tag = f'<audio autoplay="true" style="display:none"><source src="data:audio/mp3;base64,{audio_base64}" type="audio/mp3"></audio>'
-        return audio_tag
-    except Exception as e:
-        st.error(f"音声合成エラー: {e}")
-        return None
+        m.size(len(response.content))
+    return response.content
+
+def synthesize_speech(text, user=None):
+    """テキストを音声(mp3)に変換して共有の音声ストアに置き、その参照キーを返す
+
+    ワーカースレッドから呼ばれるため st.* は使わない（user はスクリプトのスレッドで取り出して渡す）。
+    """
+    def synthesize(model, voice, text):
+        return call_tts_api(model, voice, text, user)
+    return tts_cache.synthesize_to_key(TTS_MODEL, TTS_VOICE, text, synthesize, OPENAI_BASE_URL)
+
+def start_speech_pipeline(turn=None):
+    """1ターン分の文単位音声合成パイプラインを作る（turn を渡すと合成時間を記録する）
+
+    合成は学生ごとに順番に行う（最初の文は他の学生の2文目以降より先）。
+    """
+    user = current_user
+    def synthesize(text):
+        return synthesize_speech(text, user)
+    if turn:
+        synthesize = turn.timed("tts", synthesize)
+    return tts_pipeline.TTSPipeline(synthesize, uuid.uuid4().hex[:8], user)
+
+def audio_url(segment):
+    """音声セグメントを Streamlit の /media/ で配信し、そのURLを返す（音声はページに埋め込まない）
+
+    同じセグメントには同じURLを使い回す。配信の枠はセッションごとに AUDIO_URL_SLOTS 個を順に使うので、
+    古い音声は配信をやめてメモリから消える（同じ音声は全セッションで1つだけ持たれる）。
+    """
+    url = segment.get("url")
+    if url is None:
+        audio_bytes = tts_cache.get_audio(segment["ref"])
+        if audio_bytes is None:
+            return None
+        slot = st.session_state.audio_url_slot
+        st.session_state.audio_url_slot = (slot + 1) % AUDIO_URL_SLOTS
+        media = runtime.get_instance().media_file_mgr
+        url = segment["url"] = media.add(audio_bytes, "audio/mpeg", f"tts-audio-{slot}")
+        media.remove_orphaned_files()
+    return url
+
+def play_audio_segments(segments, turn=None):
+    """合成済みの音声セグメントを再生キューに積み、rerun後にも届けられるよう保持する"""
+    if segments:
+        st.session_state.audio_segments.extend(segments)
+        components.html(tts_pipeline.audio_queue_html(segments, audio_url), height=0)
+        if turn:
+            turn.mark("first_audio")
+
+def report_speech_errors(pipeline):
+    if pipeline.errors:
+        st.error(f"音声合成エラー: {pipeline.errors[0]}")
+
+def rerun_chat_panel():
+    """チャット欄（fragment）だけを再実行する
+
+    fragment の再実行中でなければ（画面全体の実行の途中でチャット欄が描かれている場合）
+    scope="fragment" は使えないので、画面全体を再実行する。
+    """
+    if get_script_run_ctx().fragment_ids_this_run:
+        st.rerun(scope="fragment")
+    st.rerun()
+
+def save_session():
+    """面談の状態と増えた分の発言をサーバー側に書く（再読み込み・再接続の後に続きから再開できるように）"""
+    st.session_state.saved_message_count = session_store.get_store().save(
+        current_user,
+        st.session_state.selected_material,
+        st.session_state.conversation_id,
+        st.session_state.current_file_id,
+        st.session_state.last_bot_message,
+        st.session_state.is_completed,
+        st.session_state.messages,
+        st.session_state.get("saved_message_count", 0),
+    )
+
+def restore_session():
+    """保存されている面談があれば session_state に戻す（外部APIは呼ばない）"""
+    saved = session_store.get_store().load(current_user, st.session_state.selected_material)
+    if saved is None:
+        return
+    st.session_state.conversation_id = saved.conversation_id
+    st.session_state.current_file_id = saved.current_file_id
+    st.session_state.last_bot_message = saved.last_bot_message
+    st.session_state.is_completed = saved.is_completed
+    st.session_state.messages = saved.messages()
+    st.session_state.saved_message_count = saved.message_count
+
+def keyword_progress(keyword_file):
+    """この面談で生徒が使った重要語句のビット列を返す（前回から増えた発言だけを採点する）"""
+    scorer = keyword_scoring.get_scorer(keyword_file)
+    # 採点器はプロセス全体で共有なので、セッションには本体ではなく識別子（語句ファイルと索引）だけを置く
+    scorer_key = (os.path.abspath(keyword_file), id(scorer.index))
+    messages = st.session_state.messages
+    cached = st.session_state.get("keyword_progress")
+    if cached is None or cached[0] != scorer_key or cached[1] > len(messages):
+        cached = (scorer_key, 0, scorer.empty())
+    _, scored, bits = cached
+    for msg in messages[scored:]:
+        if msg["role"] == "user":
+            bits = bits | scorer.score(msg["content"])
+    st.session_state.keyword_progress = (scorer_key, len(messages), bits)
+    return scorer, bits
+
+def finish_turn(turn):
+    """ターンの計測を締めて、直近の所要時間として残す"""
+    turn.finish()
+    summary = turn.summary()
+    metrics.observe_turn(summary)
+    st.session_state.turn_timings = (st.session_state.get("turn_timings", []) + [summary])[-4:]
+
+def deliver_pending_speech(container):
+    """前のターンで合成中だった音声を、できた順に再生キューへ送る（rerun後の画面を先に表示してから行う）"""
+    pending = st.session_state.get("pending_speech")
+    if not pending:
+        return
+    turn, pipeline = pending
+    with container:
+        for segment in pipeline.iter_remaining():
+            play_audio_segments([segment], turn)
+    report_speech_errors(pipeline)
+    st.session_state.pending_speech = None
+    for name, error in turn.errors():
+        st.error(f"{name} の処理でエラー: {error}")
+    finish_turn(turn)
 
 # ==========================================
 # メイン処理
 # ==========================================
-st.set_page_config(page_title="講義復習支援チャットボット", page_icon="🤖")
-st.title("講義復習支援チャットボット")
+# 全員が聞く最初の挨拶は、プロセス起動時に一度だけ音声を用意しておく
+tts_cache.prewarm(TTS_MODEL, TTS_VOICE, [STATIC_FIRST_MSG], call_tts_api, OPENAI_BASE_URL)
+# 処理時間の統計を一定間隔で Prometheus のテキスト形式に書き出す（プロセス内で1度だけ始まる）
+metrics.start_exporter()
 
-login()
 current_user = st.session_state.username
 st.sidebar.write(f"ログイン中: {current_user}")
+is_admin = current_user in st.secrets.get("admin_users", [])
+
+if is_admin:
+    with st.sidebar.expander("🔧 音声キャッシュ"):
+        cache_stats = tts_cache.stats()
+        st.write(f"ヒット率: {cache_stats['hit_rate']:.0%}（メモリ {cache_stats['memory_hits']} / ディスク {cache_stats['disk_hits']} / ミス {cache_stats['misses']}）")
+        st.write(f"節約できた合成時間: 約{cache_stats['saved_seconds']:.1f}秒")
+        st.write(f"節約できた料金: 約${cache_stats['saved_usd']:.4f}")
+    with st.sidebar.expander("🔧 処理時間の統計"):
+        def ms(value):
+            return None if value is None else round(value * 1000)
+        st.table([
+            {"系列": row["series"], "ラベル": row["labels"], "件数": row["count"], "失敗": row["errors"],
+             "p50(ms)": ms(row["p50"]), "p95(ms)": ms(row["p95"]), "p99(ms)": ms(row["p99"]),
+             "平均サイズ(KB)": None if row["avg_bytes"] is None else round(row["avg_bytes"] / 1024, 1)}
+            for row in metrics.snapshot()
+        ])
+        st.download_button("Prometheus形式で保存", metrics.prometheus_text(), file_name="metrics.prom")
+    with st.sidebar.expander("🔧 APIの順番待ち"):
+        if shared_state.WORKER_ID is not None:
+            st.caption(f"ワーカー {shared_state.WORKER_ID}（順番待ちはこのワーカーの分、残り回数は全ワーカー共通）")
+        st.table(rate_limiter.stats())
+    with st.sidebar.expander("🔧 ログ書き込み"):
+        st.write(get_log_writer().stats())
+    with st.sidebar.expander("🔧 メモリ使用量"):
+        rows = memory_report.session_report(st.session_state)
+        session_bytes = sum(size for _, size in rows)
+        shared_bytes = tts_cache.stats()["memory_bytes"]
+        st.write(f"このセッション: {session_bytes / 1024:.1f} KB")
+        st.table([{"キー": key, "KB": round(size / 1024, 1)} for key, size in rows[:10]])
+        students = st.number_input("同時に使う学生数", min_value=1, value=40, step=1)
+        st.write(f"共有の音声ストア: {shared_bytes / 1024 / 1024:.1f} MB（上限 {tts_cache.MEMORY_LIMIT_BYTES / 1024 / 1024:.0f} MB）")
+        st.write(f"見積もり: 約{(session_bytes * students + tts_cache.MEMORY_LIMIT_BYTES) / 1024 / 1024:.1f} MB（セッション分 × 学生数 + 音声ストア上限）")
 
 # セッション変数
 if "messages" not in st.session_state:
@@ -247,10 +640,12 @@ if "selected_material" not in st.session_state:
     st.session_state.selected_material = None
 if "last_bot_message" not in st.session_state:
     st.session_state.last_bot_message = ""
-if "audio_html" not in st.session_state:
-    st.session_state.audio_html = None
-if "prev_audio_bytes" not in st.session_state:
-    st.session_state.prev_audio_bytes = None
+if "audio_segments" not in st.session_state:
+    st.session_state.audio_segments = []
+if "audio_url_slot" not in st.session_state:
+    st.session_state.audio_url_slot = 0
+if "prev_audio_digest" not in st.session_state:
+    st.session_state.prev_audio_digest = None
 if "temp_user_input" not in st.session_state:
     st.session_state.temp_user_input = ""
 if "input_to_process" not in st.session_state:
@@ -259,11 +654,14 @@ if "is_completed" not in st.session_state:
     st.session_state.is_completed = False
 
 # 1. 講義資料の選択インターフェース
+if st.session_state.selected_material and st.session_state.selected_material not in materials.materials:
+    # materials.json から外された講義を選んでいた場合は選び直してもらう
+    st.session_state.selected_material = None
 if not st.session_state.selected_material:
     st.subheader("📚 学習する講義資料を選択してください")
     selected = st.radio(
         "講義リスト",
-        options=list(MATERIALS.keys()),
+        options=materials.names(),
         index=None
     )
     
@@ -275,26 +673,34 @@ if not st.session_state.selected_material:
             st.warning("講義資料を選択してください。")
     st.stop() # 選択されるまで下の処理（チャット）に進まない
 
-material_info = MATERIALS[st.session_state.selected_material]
-target_material_path = material_info["pdf"]
-target_keyword_path = material_info["keywords"]
+material = materials.get(st.session_state.selected_material)
+target_material_path = material.pdf_path
+target_keyword_path = material.keywords_path
+first_message = material.greeting or STATIC_FIRST_MSG
+# 講義ごとの最初の質問は、その講義が初めて選ばれたときに音声を用意する
+tts_cache.prewarm(TTS_MODEL, TTS_VOICE, [first_message], call_tts_api, OPENAI_BASE_URL)
 
 # --- 緊急リセット ---
 if st.sidebar.button("⚠️ 会話をリセット"):
+    session_store.get_store().delete(current_user, st.session_state.selected_material)
     for key in list(st.session_state.keys()):
         if key not in ["username"]: # ログイン情報は残す
             del st.session_state[key]
     st.rerun()
 
+# 2. 再読み込み・再接続の後は、保存しておいた面談から続ける（アップロードも音声合成もやり直さない）
+if not st.session_state.messages:
+    restore_session()
+
 # 3. 自動初期化（修正版：APIを叩かず、静的に開始する）
 if not st.session_state.conversation_id:
     # まだメッセージ履歴がない場合のみ実行
     if not st.session_state.messages:
         with st.spinner("インタビュアーを準備中..."):
             
-            # 1. ファイルアップロードだけは済ませておく（ID確保）
-            if not st.session_state.current_file_id:
-                file_id = upload_local_file_to_dify(target_material_path, current_user)
+            # 1. ファイルアップロードだけは済ませておく（ID確保。アップロード済みならキャッシュから取得）
+            if not st.session_state.current_file_id and not uses_passages(st.session_state.selected_material):
+                file_id = get_material_file_id(st.session_state.selected_material, current_user)
                 if file_id:
                     st.session_state.current_file_id = file_id
                 else:
@@ -302,7 +708,7 @@ if not st.session_state.conversation_id:
                     st.stop()
             
             # 2. Difyには何も送らず、ここで勝手に第一声を表示する
-            static_first_msg = "授業内容について学んだことを教えてください。"
+            static_first_msg = first_message
             
             # 画面表示用リストに追加
             st.session_state.messages.append({"role": "assistant", "content": static_first_msg})
@@ -311,24 +717,27 @@ if not st.session_state.conversation_id:
             st.session_state.last_bot_message = static_first_msg
             
             # 音声生成（ここだけはOpenAI APIを叩きますが、Difyは叩きません）
-            st.session_state.audio_html = text_to_speech_autoplay(static_first_msg)
+            pipeline = start_speech_pipeline()
+            pipeline.submit_text(static_first_msg)
+            st.session_state.audio_segments = list(pipeline.iter_remaining())
+            report_speech_errors(pipeline)
+            save_session()
             
             # 画面更新して表示
             st.rerun()
 
 # 4. チャット履歴の表示
+# 確定済みの履歴は画面全体の再実行時にだけ描画し、その後の発言はフラグメント（下の chat_panel）の中で描画する。
+# 1ターンごとの再実行はフラグメント内に限られるため、会話が長くなっても再実行のコストは増えない。
+LIVE_MESSAGES_LIMIT = 8  # フラグメント内の発言がこれを超えたら、全体を再実行して確定済みの履歴に移す
+
+st.session_state.archived_count = len(st.session_state.messages)
 chat_container = st.container(height=400)
 
 with chat_container:
     for msg in st.session_state.messages:
         with st.chat_message(msg["role"]):
             st.write(msg["content"])
-    if st.session_state.audio_html:
-        st.markdown(st.session_state.audio_html, unsafe_allow_html=True)
-
-if st.session_state.is_completed:
-    st.success("🎉 全ての学習項目を確認しました。お疲れ様でした！")
-    st.balloons() # お祝いの演出
 
 # 5. 入力エリア & 6. 入力処理ロジック（統合・順序修正版）
 def submit_text():
@@ -339,76 +748,193 @@ def submit_text():
 if "input_method" not in st.session_state:
     st.session_state.input_method = "text"
 
-# --- 5. 入力エリア ---
-col_input, col_send, col_mic = st.columns([5, 1, 1])
 input_key = f"chat_input_text_{current_user}"
 
-if st.session_state.temp_user_input:
-    st.session_state[input_key] = st.session_state.temp_user_input
-    st.session_state.temp_user_input = ""
-
-with col_input:
-    st.text_area(
-        label="メッセージ入力",
-        key=input_key,
-        placeholder="音声入力後に修正できます",
-        label_visibility="collapsed",
-        on_change=submit_text
-    )
-
-with col_send:
-    # 修正：temp_user_input ではなく input_key (現在の入力内容) を参照
-    if st.button("送信", use_container_width=True):
-        st.session_state.input_to_process = st.session_state[input_key]
-        # rerunすると現在の入力方法(text or voice)を維持したまま送信処理へ進む
+@st.fragment
+def chat_panel():
+    """新しい発言・入力エリア・送信処理（ここだけが1ターンごとに再実行される）"""
+    if len(st.session_state.messages) - st.session_state.archived_count > LIVE_MESSAGES_LIMIT:
         st.rerun()
 
-# --- A. マイク入力と音声処理（先出し） ---
-with col_mic:
-    audio = mic_recorder(
-        start_prompt="🎤", 
-        stop_prompt="🟥", 
-        key='recorder', 
-        format="wav"
-    )
+    if dify.breaker.is_open:
+        st.warning(BUSY_MESSAGE)
+
+    live_container = st.container()
+    with live_container:
+        for msg in st.session_state.messages[st.session_state.archived_count:]:
+            with st.chat_message(msg["role"]):
+                st.write(msg["content"])
+        if st.session_state.audio_segments:
+            # 前回の実行で作った音声のURLは、rerun後に1度だけ改めて届ける（再生済みのものはブラウザ側で読み飛ばされる）
+            components.html(tts_pipeline.audio_queue_html(st.session_state.audio_segments, audio_url), height=0)
+            st.session_state.audio_segments = []
+
+    scorer, keyword_bits = keyword_progress(target_keyword_path)
+    if scorer.total:
+        used = int(keyword_scoring.popcount(keyword_bits))
+        st.progress(used / scorer.total, text=f"📘 説明に使えた重要語句: {used} / {scorer.total}")
+
+    if st.session_state.is_completed:
+        st.success("🎉 全ての学習項目を確認しました。お疲れ様でした！")
+        if not st.session_state.get("balloons_shown"):
+            st.session_state.balloons_shown = True
+            st.balloons() # お祝いの演出
+
+    # --- 5. 入力エリア ---
+    col_input, col_send, col_mic = st.columns([5, 1, 1])
+
+    if st.session_state.temp_user_input:
+        st.session_state[input_key] = st.session_state.temp_user_input
+        st.session_state.temp_user_input = ""
+
+    with col_input:
+        # 録音しながら書き起こす場合は、この位置に下書きを表示する
+        input_slot = st.empty()
+        input_slot.text_area(
+            label="メッセージ入力",
+            key=input_key,
+            placeholder="音声入力後に修正できます",
+            label_visibility="collapsed",
+            on_change=submit_text
+        )
 
-# 音声データがある場合、すぐに処理して session_state を更新する
-if audio:
-    if audio['bytes'] != st.session_state.prev_audio_bytes:
-        st.session_state.prev_audio_bytes = audio['bytes']
-        with st.spinner("音声処理中..."): # 文言を短く
-            transcribed_text = transcribe_audio(audio['bytes'], target_keyword_path)
-            if transcribed_text:
-                # miniモデルで高速校正
-                st.session_state.temp_user_input = correct_transcript(transcribed_text, target_keyword_path)
-                st.rerun() # 文字が入った状態で即座に再描画
-
-# --- C. 送信処理（Enterが押された後の処理） ---
-# コールバック(submit_text)によって input_to_process に値が入っていたら実行
-final_prompt = None
-
-if st.session_state.input_to_process:
-    final_prompt = st.session_state.input_to_process
-    st.session_state.input_to_process = None
-    st.session_state.audio_html = None
+    with col_send:
+        # 修正：temp_user_input ではなく input_key (現在の入力内容) を参照
+        if st.button("送信", use_container_width=True):
+            st.session_state.input_to_process = st.session_state[input_key]
+            # rerunすると現在の入力方法(text or voice)を維持したまま送信処理へ進む
+            rerun_chat_panel()
+
+    # --- A. マイク入力と音声処理（先出し） ---
+    live_ctx = None
+    audio = None
+    with col_mic:
+        if webrtc_streamer is not None:
+            live_ctx = webrtc_streamer(
+                key="live_recorder",
+                mode=WebRtcMode.SENDONLY,
+                audio_receiver_size=256,
+                media_stream_constraints={"audio": True, "video": False},
+            )
+        else:
+            audio = mic_recorder(
+                start_prompt="🎤", 
+                stop_prompt="🟥", 
+                key='recorder', 
+                format="wav"
+            )
 
-# 送信実行
-if final_prompt:
-    st.session_state.messages.append({"role": "user", "content": final_prompt})
-    
-    with chat_container:
-        with st.chat_message("user"):
-            st.write(final_prompt)
-
-    with st.spinner("思考中..."):
-        response = send_chat_message(
-            query=final_prompt,
-            conversation_id=st.session_state.conversation_id,
-            file_id_to_send=st.session_state.current_file_id,
-            user_id=current_user,
-            material_name=st.session_state.selected_material
-        )
+    # 録音しながら書き起こす場合: 録音中は下書きを更新し続け、停止後は最後の区間だけを待つ
+    if live_ctx is not None:
+        if live_ctx.state.playing:
+            run_live_transcription(live_ctx, target_keyword_path, input_slot)
+        elif st.session_state.get("live_transcriber") is not None:
+            finish_live_transcription(target_keyword_path)
+
+    # 音声データがある場合、すぐに処理して session_state を更新する
+    if audio:
+        # 録音データそのものは保持せず、内容のハッシュだけで「新しい録音か」を判定する
+        audio_digest = hashlib.sha256(audio['bytes']).hexdigest()
+        # mic_recorder が session_state に残す録音データの控えも不要なので手放す
+        st.session_state.pop("recorder_output", None)
+        if audio_digest != st.session_state.prev_audio_digest:
+            st.session_state.prev_audio_digest = audio_digest
+            turn = turn_pipeline.TurnPipeline("voice", current_user)
+            with st.spinner("音声処理中..."): # 文言を短く
+                # 前後の無音を削り、16kHzモノラルに縮めてから送る（無音だけならWhisperを呼ばない）
+                raw_audio = None
+                with turn.stage("preprocess"):
+                    try:
+                        samples, _ = audio_preprocess.load(audio['bytes'])
+                    except audio_preprocess.DECODE_ERRORS:
+                        # WAVとして読めない形式なら前処理せず、元のデータをそのまま送る
+                        samples, raw_audio = None, audio['bytes']
+                if samples is None and raw_audio is None:
+                    transcribed_text = ""
+                    st.info("声が聞き取れませんでした。もう一度録音してください。")
+                else:
+                    with turn.stage("transcribe"):
+                        transcribed_text = transcribe_audio(samples, target_keyword_path, raw_audio)
+                if transcribed_text:
+                    # まずローカルで、必要ならminiモデルで高速校正
+                    with turn.stage("correct"):
+                        st.session_state.temp_user_input = correct_transcript(transcribed_text, target_keyword_path)
+                    finish_turn(turn)
+                    rerun_chat_panel() # 文字が入った状態で即座に再描画
+
+    # --- B. 前のターンの残りの音声（画面の描画が済んでから、合成できた順に届ける） ---
+    if not st.session_state.input_to_process:
+        deliver_pending_speech(live_container)
+
+    if is_admin and st.session_state.get("turn_timings"):
+        with st.expander("⏱ 直近のターンの所要時間"):
+            for summary in reversed(st.session_state.turn_timings):
+                st.write(f"{summary['kind']}: 全体 {summary['wall']:.2f}秒 / 各段階の合計 {summary['sum']:.2f}秒")
+                if "first_audio" in summary["marks"]:
+                    st.write(f"最初の音声まで: {summary['marks']['first_audio']:.2f}秒")
+                st.table([{"段階": name, "開始(秒)": round(start, 2), "所要(秒)": round(duration, 2)}
+                          for name, start, duration in summary["stages"]])
+
+    # --- C. 送信処理（Enterが押された後の処理） ---
+    # コールバック(submit_text)によって input_to_process に値が入っていたら実行
+    final_prompt = None
+
+    if st.session_state.input_to_process:
+        final_prompt = st.session_state.input_to_process
+        st.session_state.input_to_process = None
+        st.session_state.audio_segments = []
+        # 次の発言が来たら、前のターンの未再生の音声は届けない
+        st.session_state.pending_speech = None
+
+    # 送信実行
+    if final_prompt:
+        st.session_state.messages.append({"role": "user", "content": final_prompt})
         
+        with live_container:
+            with st.chat_message("user"):
+                st.write(final_prompt)
+
+        with live_container:
+            with st.chat_message("assistant"):
+                response_placeholder = st.empty()
+                response_placeholder.write("思考中...")
+                response = {}
+                streamed_text = ""
+                # 文が完成するたびに音声合成を始め、できた順に再生する
+                turn = turn_pipeline.TurnPipeline("send", current_user)
+                pipeline = start_speech_pipeline(turn)
+                splitter = tts_pipeline.SentenceSplitter()
+                # 講義資料は、回答に関係する断片だけを送る（使えない場合はPDFを添付する）
+                with turn.stage("retrieve"):
+                    passages = retrieve_passages(st.session_state.selected_material, st.session_state.last_bot_message, final_prompt)
+                if passages is None and not st.session_state.current_file_id:
+                    st.session_state.current_file_id = get_material_file_id(st.session_state.selected_material, current_user)
+                dify_started = time.perf_counter()
+                for text in stream_chat_message(
+                    query=final_prompt,
+                    conversation_id=st.session_state.conversation_id,
+                    file_id_to_send=st.session_state.current_file_id,
+                    user_id=current_user,
+                    material_name=st.session_state.selected_material,
+                    result=response,
+                    passages=passages
+                ):
+                    streamed_text += text
+                    response_placeholder.markdown(streamed_text + "▌")
+                    for sentence in splitter.feed(text):
+                        pipeline.submit(sentence)
+                    play_audio_segments(pipeline.pop_ready(), turn)
+                turn.record("dify", dify_started, time.perf_counter())
+                if response:
+                    pipeline.submit(splitter.flush())
+                    response_placeholder.markdown(response.get('answer', ''))
+                else:
+                    response_placeholder.empty()
+
+        if not response:
+            # 回答を得られなかった発言は履歴に残さない（入力欄の文はそのまま残るので送り直せる）
+            st.session_state.messages.pop()
+
         if response:
             st.session_state.conversation_id = response.get('conversation_id')
             answer_text = response.get('answer', '')
@@ -422,10 +948,17 @@ if final_prompt:
                 user=current_user,
                 material=st.session_state.selected_material,
                 system_question=st.session_state.last_bot_message,
-                user_answer=final_prompt
+                user_answer=final_prompt,
+                turn_index=sum(1 for m in st.session_state.messages if m["role"] == "user"),
+                turn=turn,
+                is_finished=is_finished
             )
             
             st.session_state.last_bot_message = answer_text
-            st.session_state.audio_html = text_to_speech_autoplay(answer_text)
+            save_session()
 
-            st.rerun()
+            # 残りの音声は合成を続けたまま再描画し、再描画後に順番どおり再生キューへ送る
+            st.session_state.pending_speech = (turn, pipeline)
+            rerun_chat_panel()
+
+chat_panel()
@@ -0,0 +1,249 @@
+"""外部APIの呼び出しを、全セッション共通の順番待ち列で提供元ごとの上限内に収める
+
+クラス全員が一斉に話し始めると、各セッションが Whisper・gpt-4o-mini・tts-1-hd・Dify・
+スプレッドシートを同時に呼び、429（レート制限）がまとめて返ってくる。
+ここでは提供元ごとにトークンバケット（1分あたりの回数と瞬間的に許す回数）を1つ持ち、
+呼び出しは空きが出るまで列に並ぶ。
+
+- 列は優先度ごとに分かれ、対話の呼び出し（INTERACTIVE）はログ送信や音声合成（BACKGROUND）より先に通る
+- 同じ優先度の中では学生ごとに順番に1件ずつ通す（1人が大量に投げても他の学生が待たされ続けない）
+- 待っている間は on_position(前に並んでいる件数) が呼ばれるので、画面に順番を出せる
+- 429 が返ってきたら、Retry-After（なければ既定の秒数）の間その提供元への送信を止める
+
+serve_workers.py で複数ワーカーを動かしている場合、並ぶ列はワーカーごとだが、トークンバケットと
+送信の停止は shared_state で全ワーカー共通にする（上限はワーカー数で割らずに、全体で守られる）。
+"""
+import threading
+import time
+from collections import OrderedDict, deque
+from contextlib import contextmanager
+
+import metrics
+import shared_state
+
+INTERACTIVE = 0
+BACKGROUND = 1
+
+# 提供元ごとの (1分あたりの回数, 瞬間的に許す回数)。OpenAI は Tier 1 の上限を想定した値で、
+# 実際の上限に合わせて secrets の [rate_limits] で上書きする（configure を参照）
+DEFAULT_LIMITS = {
+    "dify": (600, 20),
+    "whisper": (500, 20),
+    "chat": (500, 20),
+    "tts": (500, 10),
+    "embeddings": (3000, 50),
+    # Sheets API の書き込みは 1分あたり60回（ユーザーごと）
+    "sheets": (60, 5),
+}
+# 429 に Retry-After がなかった場合に送信を止める秒数
+THROTTLE_SECONDS = 5.0
+# 順番待ちの表示を更新する間隔の上限
+POSITION_REFRESH_SECONDS = 1.0
+
+
+class ProviderQueue:
+    """1つの提供元のトークンバケットと、優先度・学生ごとの順番待ち列"""
+
+    def __init__(self, name, per_minute, burst):
+        self.name = name
+        self.shared = shared_state.get_state()
+        self.cond = threading.Condition()
+        self.set_limit(per_minute, burst)
+        self.tokens = float(self.burst)
+        self.updated = time.monotonic()
+        self.blocked_until = 0.0
+        # 優先度 -> OrderedDict(学生 -> 並んでいる呼び出しの deque)。先頭の学生が次に通る
+        self.levels = {INTERACTIVE: OrderedDict(), BACKGROUND: OrderedDict()}
+        self.granted = 0
+        self.throttled = 0
+
+    def set_limit(self, per_minute, burst):
+        with self.cond:
+            self.rate = per_minute / 60.0
+            self.burst = max(1, burst)
+            self.cond.notify_all()
+
+    def _refill(self, now):
+        self.tokens = min(self.burst, self.tokens + (now - self.updated) * self.rate)
+        self.updated = now
+
+    def _order(self):
+        """並んでいる呼び出しを、通る順番に返す"""
+        for priority in sorted(self.levels):
+            queues = [list(q) for q in self.levels[priority].values()]
+            for i in range(max(map(len, queues), default=0)):
+                for q in queues:
+                    if i < len(q):
+                        yield q[i]
+
+    def _head(self):
+        return next(self._order(), None)
+
+    def _dequeue(self, ticket):
+        users = self.levels[ticket.priority]
+        waiting = users[ticket.user]
+        waiting.remove(ticket)
+        # 通った学生は最後尾に回す（次は別の学生の番）
+        del users[ticket.user]
+        if waiting:
+            users[ticket.user] = waiting
+
+    def _try_grant(self, ticket):
+        """順番が来ていて空きがあれば通して None を、なければ待つ秒数を返す"""
+        if self._head() is not ticket:
+            return POSITION_REFRESH_SECONDS
+        if self.shared is not None:
+            wait = self.shared.take_token(self.name, self.rate, self.burst)
+            if wait > 0:
+                return wait
+            self._grant(ticket)
+            return None
+        now = time.monotonic()
+        self._refill(now)
+        if now < self.blocked_until:
+            return self.blocked_until - now
+        if self.tokens >= 1:
+            self.tokens -= 1
+            self._grant(ticket)
+            return None
+        return (1 - self.tokens) / self.rate
+
+    def _grant(self, ticket):
+        self.granted += 1
+        self._dequeue(ticket)
+        self.cond.notify_all()
+
+    def acquire(self, user, priority, on_position=None):
+        """順番が来るまで待つ。待った秒数を返す
+
+        on_position は待っている間、前に並んでいる件数が変わるたびに呼び出し元のスレッドで呼ばれる。
+        """
+        ticket = _Ticket(user, priority)
+        start = time.monotonic()
+        reported = None
+        with self.cond:
+            self.levels[priority].setdefault(user, deque()).append(ticket)
+        try:
+            while True:
+                with self.cond:
+                    wait = self._try_grant(ticket)
+                    if wait is None:
+                        return time.monotonic() - start
+                    ahead = list(self._order()).index(ticket)
+                    if on_position is None or ahead == reported:
+                        self.cond.wait(timeout=min(wait, POSITION_REFRESH_SECONDS))
+                        continue
+                # 画面の更新などはロックの外で行う
+                reported = ahead
+                on_position(ahead)
+        except BaseException:
+            with self.cond:
+                if ticket in self.levels[priority].get(user, ()):
+                    self._dequeue(ticket)
+                self.cond.notify_all()
+            raise
+
+    def throttle(self, seconds):
+        """429 を受けたので、しばらく誰も通さない"""
+        with self.cond:
+            self.blocked_until = max(self.blocked_until, time.monotonic() + seconds)
+            self.tokens = 0.0
+            self.throttled += 1
+        if self.shared is not None:
+            self.shared.block(self.name, seconds)
+
+    def stats(self):
+        with self.cond:
+            self._refill(time.monotonic())
+            tokens = self.tokens if self.shared is None else self.shared.tokens(self.name, self.rate, self.burst)
+            return {
+                "provider": self.name,
+                "waiting_interactive": sum(map(len, self.levels[INTERACTIVE].values())),
+                "waiting_background": sum(map(len, self.levels[BACKGROUND].values())),
+                "tokens": round(tokens, 1),
+                "granted": self.granted,
+                "throttled": self.throttled,
+            }
+
+
+class _Ticket:
+    __slots__ = ("user", "priority")
+
+    def __init__(self, user, priority):
+        self.user = user
+        self.priority = priority
+
+
+_lock = threading.Lock()
+_queues = {}
+
+
+def get_queue(provider):
+    """提供元ごとに1つの列をプロセス全体で共有する"""
+    with _lock:
+        queue = _queues.get(provider)
+        if queue is None:
+            per_minute, burst = DEFAULT_LIMITS[provider]
+            queue = ProviderQueue(provider, per_minute, burst)
+            _queues[provider] = queue
+        return queue
+
+
+def configure(limits):
+    """secrets の [rate_limits] などから上限を設定する
+
+    値は1分あたりの回数か、[1分あたりの回数, 瞬間的に許す回数]。
+        [rate_limits]
+        whisper = 50
+        tts = [100, 5]
+    """
+    for provider, value in limits.items():
+        if isinstance(value, (list, tuple)):
+            per_minute, burst = value
+        else:
+            per_minute, burst = value, DEFAULT_LIMITS.get(provider, (value, 10))[1]
+        if provider not in DEFAULT_LIMITS:
+            DEFAULT_LIMITS[provider] = (per_minute, burst)
+        get_queue(provider).set_limit(per_minute, burst)
+
+
+def _status_and_retry_after(error):
+    """例外から HTTP ステータスと Retry-After を取り出す（openai / requests / gspread の例外に対応）"""
+    response = getattr(error, "response", None)
+    status = getattr(error, "status_code", None) or getattr(response, "status_code", None)
+    headers = getattr(response, "headers", None) or {}
+    return status, headers.get("Retry-After")
+
+
+def throttle(provider, retry_after=None):
+    """提供元から 429 が返ってきたことを知らせる（Retry-After の秒数だけ全員の送信を止める）"""
+    try:
+        seconds = float(retry_after)
+    except (TypeError, ValueError):
+        seconds = THROTTLE_SECONDS
+    get_queue(provider).throttle(seconds)
+
+
+@contextmanager
+def slot(provider, user=None, priority=INTERACTIVE, on_position=None):
+    """順番が来るまで待ってから with の中を実行する。中で 429 の例外が出たら送信を一時停止する
+
+        with rate_limiter.slot("whisper", user=current_user):
+            openai_client.audio.transcriptions.create(...)
+    """
+    waited = get_queue(provider).acquire(user, priority, on_position)
+    metrics.observe("rate_limit_wait_seconds", waited, provider=provider)
+    try:
+        yield
+    except Exception as e:
+        status, retry_after = _status_and_retry_after(e)
+        if status == 429:
+            throttle(provider, retry_after)
+        raise
+
+
+def stats():
+    """管理画面用に提供元ごとの待ち件数・通した件数・429で止めた回数を返す"""
+    with _lock:
+        queues = list(_queues.values())
+    return [queue.stats() for queue in queues]
@@ -0,0 +1,121 @@
+"""アプリを複数のStreamlitプロセス（ワーカー）で動かす（複数のクラスで同時に使う場合の構成）
+
+1つの `streamlit run` では、全員のスクリプトの実行が1つのプロセスのGILを取り合う。
+ここでは同じアプリを連続したポートでワーカーの数だけ起動し、前段のリバースプロキシで振り分ける。
+ワーカーには環境変数で共有状態のファイルとワーカー番号を渡すので、次のものはワーカー全体で1つになる
+（shared_state.py）。
+
+- DifyのファイルID（講義資料のアップロードはワーカー全体で1回）
+- 外部APIのレート制限（上限は全ワーカーの合計で守られる）
+- 会話ログのシートへの送信（送るのは1つのワーカーだけ。ジャーナルは turn_journal の SQLite を共有）
+- 合成済み音声（ディスク層を共有し、同じ文の合成は1回）
+- 面談の状態（session_store の SQLite を共有。再読み込みで別のワーカーにつながっても続きから再開できる）
+
+語句や講義資料の索引は読み取り専用のファイルから作るのでワーカーごとに持つ。
+ファイルを共有するため、ワーカーはすべて同じホスト（同じリポジトリのディレクトリ）で動かす。
+
+使い方（リポジトリ直下で実行。8501〜8504 で待ち受ける）:
+    python serve_workers.py --workers 4 --port 8501
+
+スティッキーセッションが必要:
+    Streamlit のセッション（session_state、録音のアップロード、st.audio の音声ファイル）は
+    WebSocket をつないだワーカーのメモリにあるため、同じブラウザからの要求は常に同じワーカーに
+    送らなければならない。教室では全員が同じグローバルIPに見えることが多いので、IPアドレスではなく
+    Cookie で振り分ける。nginx の例:
+
+    map $cookie_interview_worker $interview_worker {
+        ""      $request_id;
+        default $cookie_interview_worker;
+    }
+    upstream interview {
+        hash $interview_worker consistent;
+        server 127.0.0.1:8501;
+        server 127.0.0.1:8502;
+        server 127.0.0.1:8503;
+        server 127.0.0.1:8504;
+    }
+    server {
+        listen 80;
+        location / {
+            proxy_pass http://interview;
+            proxy_http_version 1.1;
+            proxy_set_header Upgrade $http_upgrade;
+            proxy_set_header Connection "upgrade";
+            proxy_set_header Host $host;
+            proxy_read_timeout 86400;
+            add_header Set-Cookie "interview_worker=$interview_worker; Path=/; HttpOnly; SameSite=Lax" always;
+        }
+    }
+
+ワーカー数はCPUのコア数までにする（それ以上はGILではなくCPUが足りなくなる）。
+"""
+import argparse
+import os
+import signal
+import subprocess
+import sys
+import time
+
+import shared_state
+
+APP_PATH = os.path.join(os.path.dirname(os.path.abspath(__file__)), "my_app_login3.py")
+
+
+def worker_env(index, state_path=shared_state.STATE_PATH, base_env=None):
+    env = dict(os.environ if base_env is None else base_env)
+    env[shared_state.STATE_ENV] = os.path.abspath(state_path)
+    env[shared_state.WORKER_ENV] = str(index)
+    return env
+
+
+def start_workers(workers, port, state_path=shared_state.STATE_PATH, app_path=APP_PATH, cwd=None,
+                  streamlit_args=(), base_env=None, **popen_kwargs):
+    """ワーカーを port, port + 1, ... で起動し、Popen のリストを返す（起動完了は待たない）
+
+    base_env はワーカーに渡す環境変数の元（None なら今の環境変数）。
+    """
+    processes = []
+    for i in range(workers):
+        processes.append(subprocess.Popen(
+            [sys.executable, "-m", "streamlit", "run", app_path,
+             "--server.headless", "true", "--server.port", str(port + i), *streamlit_args],
+            cwd=cwd, env=worker_env(i, state_path, base_env), **popen_kwargs,
+        ))
+    return processes
+
+
+def stop_workers(processes, timeout=30):
+    for process in processes:
+        if process.poll() is None:
+            process.terminate()
+    for process in processes:
+        try:
+            process.wait(timeout=timeout)
+        except subprocess.TimeoutExpired:
+            process.kill()
+
+
+def main(argv):
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument("--workers", type=int, default=os.cpu_count() or 1)
+    parser.add_argument("--port", type=int, default=8501, help="最初のワーカーのポート")
+    parser.add_argument("--state", default=shared_state.STATE_PATH, help="共有状態の SQLite ファイル")
+    parser.add_argument("streamlit_args", nargs="*", help="streamlit run に渡す引数（-- の後に書く）")
+    args = parser.parse_args(argv)
+
+    processes = start_workers(args.workers, args.port, args.state, streamlit_args=args.streamlit_args)
+    print(f"ワーカー {args.workers}個: ポート {args.port}〜{args.port + args.workers - 1}")
+    signal.signal(signal.SIGTERM, lambda *_: sys.exit(0))
+    try:
+        # どれか1つでも止まったら全体を止める（再起動はプロセス管理側に任せる）
+        while all(process.poll() is None for process in processes):
+            time.sleep(1)
+        return next(process.returncode for process in processes if process.poll() is not None)
+    except KeyboardInterrupt:
+        return 0
+    finally:
+        stop_workers(processes)
+
+
+if __name__ == "__main__":
+    sys.exit(main(sys.argv[1:]))
@@ -0,0 +1,151 @@
+"""面談の状態をサーバー側に残すストア（SQLite WALモード、ユーザー名 + 講義名ごと）
+
+面談の状態は st.session_state にしかないため、ブラウザの再読み込みやWebSocketの再接続で
+最初からやり直しになり、講義資料のアップロードと挨拶の音声合成をやり直し、Difyの会話IDも失われる。
+ここでは1ターンごとに会話ID・ファイルID・直前の質問・終了フラグと、増えた分の発言だけを書き込み、
+再開時は主キーで面談の1行を読み、発言は SavedSession.messages() で主キーの範囲を読んで状態を戻す
+（外部APIは呼ばない）。アプリは再開時に発言を全件読み込む（重要語句の採点とターン番号に全発言を使うため）。
+"""
+import os
+import sqlite3
+import threading
+import time
+
+STORE_ENV = "INTERVIEW_SESSION_STORE"
+# 別のファイルを使う場合（負荷試験など）は環境変数で指定する
+STORE_PATH = os.environ.get(STORE_ENV) or os.path.join(os.path.dirname(os.path.abspath(__file__)), ".session_store.sqlite3")
+# この期間更新のない面談は消す（次に開いたときは最初から）
+SESSION_RETENTION_SECONDS = 30 * 24 * 60 * 60
+
+_SCHEMA = """
+CREATE TABLE IF NOT EXISTS sessions (
+    username TEXT NOT NULL,
+    material TEXT NOT NULL,
+    conversation_id TEXT NOT NULL,
+    current_file_id TEXT,
+    last_bot_message TEXT NOT NULL,
+    is_completed INTEGER NOT NULL,
+    message_count INTEGER NOT NULL,
+    updated_at REAL NOT NULL,
+    PRIMARY KEY (username, material)
+) WITHOUT ROWID;
+CREATE TABLE IF NOT EXISTS messages (
+    username TEXT NOT NULL,
+    material TEXT NOT NULL,
+    seq INTEGER NOT NULL,
+    role TEXT NOT NULL,
+    content TEXT NOT NULL,
+    PRIMARY KEY (username, material, seq)
+) WITHOUT ROWID;
+"""
+
+# 発言の役割は1文字で持つ
+_ROLE_CODES = {"user": "u", "assistant": "a"}
+_ROLES = {code: role for role, code in _ROLE_CODES.items()}
+
+
+class SavedSession:
+    """保存されていた面談の状態。発言は messages() を呼んだときに読み込む"""
+
+    def __init__(self, store, username, material, conversation_id, current_file_id,
+                 last_bot_message, is_completed, message_count):
+        self.store = store
+        self.username = username
+        self.material = material
+        self.conversation_id = conversation_id
+        self.current_file_id = current_file_id
+        self.last_bot_message = last_bot_message
+        self.is_completed = bool(is_completed)
+        self.message_count = message_count
+
+    def messages(self):
+        return self.store.messages(self.username, self.material, self.message_count)
+
+
+class SessionStore:
+    def __init__(self, path=STORE_PATH):
+        self.path = path
+        self.lock = threading.Lock()
+        self.conn = sqlite3.connect(path, check_same_thread=False, isolation_level=None)
+        self.conn.execute("PRAGMA journal_mode=WAL")
+        self.conn.execute("PRAGMA synchronous=NORMAL")
+        self.conn.executescript(_SCHEMA)
+
+    def load(self, username, material):
+        """保存されている面談を返す（なければ None）"""
+        with self.lock:
+            row = self.conn.execute(
+                "SELECT conversation_id, current_file_id, last_bot_message, is_completed, message_count"
+                " FROM sessions WHERE username = ? AND material = ?",
+                (username, material),
+            ).fetchone()
+        return SavedSession(self, username, material, *row) if row else None
+
+    def messages(self, username, material, limit=-1):
+        """発言を [{"role", "content"}, ...] で返す"""
+        with self.lock:
+            cur = self.conn.execute(
+                "SELECT role, content FROM messages WHERE username = ? AND material = ? ORDER BY seq LIMIT ?",
+                (username, material, limit),
+            )
+            return [{"role": _ROLES[role], "content": content} for role, content in cur.fetchall()]
+
+    def save(self, username, material, conversation_id, current_file_id, last_bot_message, is_completed,
+             messages, saved_count=0):
+        """面談の状態と、messages のうち saved_count 番目以降の発言を書き込む。書き込んだ後の発言数を返す"""
+        new_messages = [
+            (username, material, seq, _ROLE_CODES[m["role"]], m["content"])
+            for seq, m in enumerate(messages[saved_count:], saved_count)
+        ]
+        with self.lock:
+            self.conn.execute("BEGIN")
+            try:
+                self.conn.executemany(
+                    "INSERT OR REPLACE INTO messages (username, material, seq, role, content) VALUES (?, ?, ?, ?, ?)",
+                    new_messages,
+                )
+                self.conn.execute(
+                    "INSERT OR REPLACE INTO sessions (username, material, conversation_id, current_file_id,"
+                    " last_bot_message, is_completed, message_count, updated_at) VALUES (?, ?, ?, ?, ?, ?, ?, ?)",
+                    (username, material, conversation_id or "", current_file_id, last_bot_message,
+                     int(bool(is_completed)), len(messages), time.time()),
+                )
+                self.conn.execute("COMMIT")
+            except BaseException:
+                self.conn.execute("ROLLBACK")
+                raise
+        return len(messages)
+
+    def delete(self, username, material):
+        """面談を消す（会話のリセット）"""
+        with self.lock:
+            self.conn.execute("BEGIN")
+            self.conn.execute("DELETE FROM messages WHERE username = ? AND material = ?", (username, material))
+            self.conn.execute("DELETE FROM sessions WHERE username = ? AND material = ?", (username, material))
+            self.conn.execute("COMMIT")
+
+    def purge_stale(self, older_than=SESSION_RETENTION_SECONDS):
+        cutoff = time.time() - older_than
+        with self.lock:
+            self.conn.execute("BEGIN")
+            self.conn.execute(
+                "DELETE FROM messages WHERE (username, material) IN"
+                " (SELECT username, material FROM sessions WHERE updated_at < ?)",
+                (cutoff,),
+            )
+            self.conn.execute("DELETE FROM sessions WHERE updated_at < ?", (cutoff,))
+            self.conn.execute("COMMIT")
+
+
+_lock = threading.Lock()
+_store = None
+
+
+def get_store():
+    """プロセス全体で1つのストアを共有する（初回に古い面談を消す）"""
+    global _store
+    with _lock:
+        if _store is None:
+            _store = SessionStore()
+            _store.purge_stale()
+        return _store
@@ -0,0 +1,207 @@
+"""複数のStreamlitプロセス（ワーカー）で共有する状態（SQLite WALモード）
+
+1つの `streamlit run` では全員のスクリプトが1つのプロセスのGILを取り合うため、
+serve_workers.py で同じアプリを複数プロセス起動して前段で振り分ける。その場合、
+モジュールに置いていたプロセス全体の共有状態はワーカーごとに分かれてしまうので、
+ワーカーをまたいで1つでなければならないものをここに置く。
+
+- 期限付きの値（DifyのファイルIDなど）
+- リース: 一定時間だけ1つのワーカーが持てる権利（ログの送信役、アップロード・音声合成の担当）
+- トークンバケット: 提供元ごとのレート制限の残り回数
+
+serve_workers.py が環境変数 INTERVIEW_SHARED_STATE（SQLiteファイルのパス）を渡した場合だけ使い、
+1プロセスで動かしている間は get_state() が None を返して、各モジュールはこれまでどおりメモリ上で動く。
+同じホストのワーカー同士でファイルを共有する前提（NFSなどのネットワーク越しには置かない）。
+"""
+import os
+import socket
+import sqlite3
+import threading
+import time
+
+STATE_ENV = "INTERVIEW_SHARED_STATE"
+WORKER_ENV = "INTERVIEW_WORKER_ID"
+STATE_PATH = os.path.join(os.path.dirname(os.path.abspath(__file__)), ".shared_state.sqlite3")
+# serve_workers.py が付けるワーカー番号（1プロセスで動かしている場合は None）
+WORKER_ID = os.environ.get(WORKER_ENV)
+# リースの持ち主。再起動したワーカーは別の持ち主になる
+OWNER = f"{socket.gethostname()}:{os.getpid()}"
+# 他のワーカーの担当が終わるのを待つときの確認間隔
+POLL_SECONDS = 0.2
+
+_SCHEMA = """
+CREATE TABLE IF NOT EXISTS entries (
+    namespace TEXT NOT NULL,
+    key TEXT NOT NULL,
+    value TEXT NOT NULL,
+    expires_at REAL NOT NULL,
+    PRIMARY KEY (namespace, key)
+) WITHOUT ROWID;
+CREATE TABLE IF NOT EXISTS leases (
+    name TEXT PRIMARY KEY,
+    owner TEXT NOT NULL,
+    expires_at REAL NOT NULL
+) WITHOUT ROWID;
+CREATE TABLE IF NOT EXISTS buckets (
+    name TEXT PRIMARY KEY,
+    tokens REAL NOT NULL,
+    updated REAL NOT NULL,
+    blocked_until REAL NOT NULL
+) WITHOUT ROWID;
+"""
+
+
+class SharedState:
+    def __init__(self, path=STATE_PATH):
+        self.path = path
+        self.lock = threading.Lock()
+        # 他のワーカーが書き込み中なら最大 timeout 秒待つ
+        self.conn = sqlite3.connect(path, timeout=10, check_same_thread=False, isolation_level=None)
+        self.conn.execute("PRAGMA journal_mode=WAL")
+        self.conn.execute("PRAGMA synchronous=NORMAL")
+        self.conn.executescript(_SCHEMA)
+
+    # ---- 期限付きの値 ----
+
+    def get(self, namespace, key):
+        """(値, 有効期限) を返す（ないか期限切れなら None）"""
+        with self.lock:
+            return self.conn.execute(
+                "SELECT value, expires_at FROM entries WHERE namespace = ? AND key = ? AND expires_at > ?",
+                (namespace, key, time.time()),
+            ).fetchone()
+
+    def put(self, namespace, key, value, expires_at):
+        with self.lock:
+            self.conn.execute(
+                "INSERT OR REPLACE INTO entries (namespace, key, value, expires_at) VALUES (?, ?, ?, ?)",
+                (namespace, key, value, expires_at),
+            )
+
+    def delete(self, namespace, key, value=None):
+        """値を消す（value を渡した場合は、その値のときだけ消す）"""
+        with self.lock:
+            if value is None:
+                self.conn.execute("DELETE FROM entries WHERE namespace = ? AND key = ?", (namespace, key))
+            else:
+                self.conn.execute(
+                    "DELETE FROM entries WHERE namespace = ? AND key = ? AND value = ?", (namespace, key, value)
+                )
+
+    # ---- リース ----
+
+    def acquire_lease(self, name, seconds, owner=OWNER):
+        """リースを取るか延長する。他のワーカーが期限内のリースを持っていれば False"""
+        now = time.time()
+        with self.lock:
+            cur = self.conn.execute(
+                "INSERT INTO leases (name, owner, expires_at) VALUES (?, ?, ?)"
+                " ON CONFLICT (name) DO UPDATE SET owner = excluded.owner, expires_at = excluded.expires_at"
+                " WHERE leases.owner = excluded.owner OR leases.expires_at <= ?",
+                (name, owner, now + seconds, now),
+            )
+            return cur.rowcount > 0
+
+    def release_lease(self, name, owner=OWNER):
+        with self.lock:
+            self.conn.execute("DELETE FROM leases WHERE name = ? AND owner = ?", (name, owner))
+
+    def run_once(self, name, lookup, produce, lease_seconds):
+        """lookup() が None の間、ワーカー全体で1つだけが produce() を実行する（プロセスをまたぐ single-flight）
+
+        他のワーカーが実行中なら、lookup() で結果が見えるか、リースが外れるまで待つ。
+        実行したワーカーが失敗した場合（結果が残らなかった場合）は、待っていた側が改めて実行する。
+        """
+        while True:
+            value = lookup()
+            if value is not None:
+                return value
+            if self.acquire_lease(name, lease_seconds):
+                try:
+                    # リースを取る直前に他のワーカーが終えていることがある
+                    value = lookup()
+                    return value if value is not None else produce()
+                finally:
+                    self.release_lease(name)
+            time.sleep(POLL_SECONDS)
+
+    # ---- トークンバケット ----
+
+    def take_token(self, name, per_second, burst):
+        """バケットから1回分を取る。取れたら 0 を、取れなければ空くまでの秒数を返す"""
+        now = time.time()
+        with self.lock:
+            # 読んでから書くまでの間に他のワーカーが取らないよう、書き込みロックを先に取る
+            self.conn.execute("BEGIN IMMEDIATE")
+            try:
+                tokens, blocked_until = self._refill(name, per_second, burst, now)
+                if now < blocked_until:
+                    wait = blocked_until - now
+                elif tokens >= 1:
+                    tokens -= 1
+                    wait = 0.0
+                else:
+                    wait = (1 - tokens) / per_second
+                self._store_bucket(name, tokens, now, blocked_until)
+                self.conn.execute("COMMIT")
+            except BaseException:
+                self.conn.execute("ROLLBACK")
+                raise
+        return wait
+
+    def block(self, name, seconds):
+        """しばらく誰にも取らせない（429 を受けたとき）"""
+        now = time.time()
+        with self.lock:
+            self.conn.execute("BEGIN IMMEDIATE")
+            try:
+                row = self.conn.execute("SELECT blocked_until FROM buckets WHERE name = ?", (name,)).fetchone()
+                self._store_bucket(name, 0.0, now, max(row[0] if row else 0.0, now + seconds))
+                self.conn.execute("COMMIT")
+            except BaseException:
+                self.conn.execute("ROLLBACK")
+                raise
+
+    def tokens(self, name, per_second, burst):
+        """今取れる回数（管理画面用）"""
+        with self.lock:
+            return self._refill(name, per_second, burst, time.time())[0]
+
+    def _refill(self, name, per_second, burst, now):
+        """(補充後の残り回数, 停止期限) を返す（self.lock を持った状態で呼ぶ）"""
+        row = self.conn.execute(
+            "SELECT tokens, updated, blocked_until FROM buckets WHERE name = ?", (name,)
+        ).fetchone()
+        if row is None:
+            return float(burst), 0.0
+        tokens, updated, blocked_until = row
+        return min(burst, tokens + max(0.0, now - updated) * per_second), blocked_until
+
+    def _store_bucket(self, name, tokens, updated, blocked_until):
+        self.conn.execute(
+            "INSERT OR REPLACE INTO buckets (name, tokens, updated, blocked_until) VALUES (?, ?, ?, ?)",
+            (name, tokens, updated, blocked_until),
+        )
+
+    def purge_expired(self):
+        now = time.time()
+        with self.lock:
+            self.conn.execute("DELETE FROM entries WHERE expires_at <= ?", (now,))
+            self.conn.execute("DELETE FROM leases WHERE expires_at <= ?", (now,))
+
+
+_lock = threading.Lock()
+_state = None
+
+
+def get_state():
+    """複数ワーカーで動かしている場合は共有の状態を、1プロセスなら None を返す"""
+    global _state
+    path = os.environ.get(STATE_ENV)
+    if not path:
+        return None
+    with _lock:
+        if _state is None:
+            _state = SharedState(path)
+            _state.purge_expired()
+        return _state
@@ -0,0 +1,241 @@
+"""会話ログをローカルのジャーナルからGoogleスプレッドシートへ送るレプリケーター
+
+チャットの1ターンごとに認証・シートを開く・1行追記…とAPIを何度も呼ぶ代わりに、
+行を turn_journal に追記して即座に戻り、専用スレッドが1つの認証済みクライアントで
+append_rows によりまとめて追記する。シートが使えない間も行はジャーナルに残り、
+復旧後に順番どおり送られる（シートは結果整合の書き出し先という位置づけ）。
+
+各行の末尾にはターンキー（会話ID:ターン番号）の列を付ける。送信結果が不明なまま
+失敗した場合や再起動時には、シートのキー列を読んで送信済みの行を飛ばすので、
+同じターンが二重に追記されることはない。
+
+ジャーナルの行・送信役のリース・ライターは、送り先とキー列の組（sink_name）ごとに分ける。
+キー列の違うアプリ（my_app_login2.py と my_app_login3.py）が同じシートとジャーナルを使っても、
+互いの行を自分のキー列の位置で送ったり、突き合わせで見落として二重に追記したりしない。
+
+serve_workers.py で複数ワーカーを動かしている場合、ジャーナルへの追記はどのワーカーからも行うが、
+シートへ送るのは shared_state のリースを持つ1つのワーカーだけにする（送信役が落ちたら、
+リースの期限が切れた後に別のワーカーが、シートと突き合わせてから引き継ぐ）。
+"""
+import json
+import logging
+import random
+import sys
+import threading
+import time
+from urllib.parse import urlparse
+
+import requests
+
+import metrics
+import rate_limiter
+import shared_state
+import turn_journal
+
+# この行数がたまるか、最も古い未送信行から一定時間経ったらまとめて書き込む
+BATCH_SIZE = 20
+FLUSH_INTERVAL_SECONDS = 2.0
+# 429 / 5xx の時の再試行間隔（上限に達した後も、成功するまでこの間隔で試し続ける）
+RETRY_BASE_SECONDS = 1.0
+RETRY_MAX_SECONDS = 60.0
+RETRYABLE_STATUS = {429, 500, 502, 503, 504}
+# HttpWorksheet の (接続, 読み取り) タイムアウト秒
+HTTP_TIMEOUT = (5, 30)
+# 送信役のリースの長さ（1回の送信が終わる時間より十分長く）
+SHIPPER_LEASE_SECONDS = 120
+
+logger = logging.getLogger(__name__)
+
+
+def is_api_error(error):
+    """Google Sheets API のエラーか（gspread を読み込む前なら、その例外は起こりえない）"""
+    gspread = sys.modules.get("gspread")
+    return gspread is not None and isinstance(error, gspread.exceptions.APIError)
+
+
+def is_retryable(error):
+    """一時的なエラー（レート制限・サーバーエラー・通信エラー）なら True"""
+    if is_api_error(error) or isinstance(error, requests.HTTPError):
+        status = getattr(error.response, "status_code", None)
+        return status in RETRYABLE_STATUS
+    return isinstance(error, (ConnectionError, TimeoutError, OSError))
+
+
+class HttpWorksheet:
+    """負荷試験用のモック（benchmarks/mock_services.py）に書くワークシート。認証しないので本番では使わない
+
+    ライターと log_export.py が使う append_rows / col_values / get_values だけを、JSONのHTTP APIで実装する。
+    """
+
+    def __init__(self, url):
+        self.url = url.rstrip("/")
+        self.session = requests.Session()
+
+    def append_rows(self, rows):
+        response = self.session.post(f"{self.url}/append", json={"values": rows}, timeout=HTTP_TIMEOUT)
+        response.raise_for_status()
+
+    def col_values(self, column):
+        response = self.session.get(f"{self.url}/values", params={"column": column}, timeout=HTTP_TIMEOUT)
+        response.raise_for_status()
+        return response.json()["values"]
+
+    def get_values(self, range_name):
+        """"A2:H" のような範囲の行を返す（開始行以降の全行）"""
+        response = self.session.get(f"{self.url}/values", params={"range": range_name}, timeout=HTTP_TIMEOUT)
+        response.raise_for_status()
+        return response.json()["values"]
+
+
+def open_worksheet(creds_dict, spreadsheet_url, mock_url=None):
+    """スプレッドシートの先頭のワークシートを開く
+
+    mock_url（secrets の SHEETS_MOCK_URL）を明示した場合だけ、代わりにモックの HttpWorksheet に書く。
+    それ以外はGoogleスプレッドシートのURLしか受け付けない（設定の誤りでログを認証なしに外へ送らないため）。
+    """
+    if mock_url:
+        return HttpWorksheet(mock_url)
+    if urlparse(spreadsheet_url).hostname != "docs.google.com":
+        raise ValueError(f"GoogleスプレッドシートのURLではありません: {spreadsheet_url}")
+    # gspread の読み込みには時間がかかるので、送信スレッドで初めてシートを開くときに読み込む
+    import gspread
+
+    gc = gspread.service_account_from_dict(dict(creds_dict))
+    return gc.open_by_url(spreadsheet_url).get_worksheet(0)
+
+
+def sink_name(destination, key_column):
+    """ジャーナル上の送信先の名前（送り先のURLとキー列の番号）"""
+    return f"{destination}#key_column={key_column}"
+
+
+class SheetLogWriter:
+    """1つのスプレッドシート(先頭のワークシート)へジャーナルの行を送るバックグラウンドライター
+
+    key_column はターンキーを書き込む列番号（1始まり）。行がそれより長い場合、残りの列はキーの後ろに書く。
+    mock_url を渡すとモックに書く（ジャーナルの行は送り先ごとに分かれ、本番のシートには送られない）。
+    """
+
+    def __init__(self, creds_dict, spreadsheet_url, key_column, journal=None, mock_url=None):
+        self.creds_dict = dict(creds_dict)
+        self.spreadsheet_url = spreadsheet_url
+        self.mock_url = mock_url
+        self.destination = mock_url or spreadsheet_url
+        self.key_column = key_column
+        self.sink = sink_name(self.destination, key_column)
+        self.journal = journal or turn_journal.get_journal()
+        self.wakeup = threading.Event()
+        self.worksheet = None
+        # 起動直後は前回のプロセスが送信途中だった可能性があるので、シートと突き合わせてから送る
+        self.needs_reconcile = True
+        self.shared = shared_state.get_state()
+        self.is_shipper = False
+        self.written_rows = 0
+        self.last_error = None
+        self.thread = threading.Thread(target=self._run, name="sheet-log-writer", daemon=True)
+        self.thread.start()
+
+    def enqueue(self, turn_key, row):
+        """行をジャーナルに追記し、送信スレッドを起こす（シートへの書き込みは待たない）"""
+        self.journal.append(self.sink, turn_key, row)
+        self.wakeup.set()
+        return True
+
+    def _open_worksheet(self):
+        if self.worksheet is None:
+            self.worksheet = open_worksheet(self.creds_dict, self.spreadsheet_url, self.mock_url)
+        return self.worksheet
+
+    def _reconcile(self, batch):
+        """シートに既にあるターンキーの行を送信済みにし、残りの行を返す"""
+        existing = set(self._open_worksheet().col_values(self.key_column))
+        shipped = [seq for seq, key, _, _ in batch if key in existing]
+        self.journal.mark_shipped(shipped)
+        self.needs_reconcile = False
+        return [item for item in batch if item[0] not in shipped]
+
+    def _ship(self, batch):
+        if self.needs_reconcile:
+            batch = self._reconcile(batch)
+        if batch:
+            split = self.key_column - 1
+            rows = [row[:split] + [key] + row[split:] for _, key, row, _ in batch]
+            # 書き込み上限はユーザー（サービスアカウント）単位なので、対話の呼び出しより後回しにする
+            with rate_limiter.slot("sheets", priority=rate_limiter.BACKGROUND), metrics.track("sheets_append") as m:
+                m.size(len(json.dumps(rows, ensure_ascii=False).encode("utf-8")))
+                self._open_worksheet().append_rows(rows)
+            self.journal.mark_shipped([seq for seq, _, _, _ in batch])
+            self.written_rows += len(batch)
+
+    def _hold_lease(self):
+        """送信役なら True。複数ワーカーの場合はリースを取るか延長する"""
+        if self.shared is None:
+            return True
+        held = self.shared.acquire_lease(f"sheet_writer:{self.sink}", SHIPPER_LEASE_SECONDS)
+        if held and not self.is_shipper:
+            # 前の送信役が送信の途中で止まった可能性があるので、シートと突き合わせてから送る
+            self.needs_reconcile = True
+        self.is_shipper = held
+        return held
+
+    def _next_batch(self):
+        """送るべき行がそろうまで待ってから返す"""
+        while True:
+            batch = self.journal.pending(self.sink, BATCH_SIZE)
+            # 複数ワーカーの場合は、他のワーカーが追記した行や送信役の交代に気づけるよう定期的に見直す
+            wait = None if self.shared is None else FLUSH_INTERVAL_SECONDS
+            if batch and self._hold_lease():
+                wait = batch[0][3] + FLUSH_INTERVAL_SECONDS - time.time()
+                if len(batch) >= BATCH_SIZE or wait <= 0:
+                    return batch
+            self.wakeup.wait(timeout=wait)
+            self.wakeup.clear()
+
+    def _run(self):
+        self.journal.purge_shipped()
+        legacy = self.journal.pending_count(self.destination)
+        if legacy:
+            # キー列を送信先の名前に含める前の行は、どちらのアプリの行か区別できないので自動では送らない
+            logger.warning("キー列のない送信先名で未送信の行が %d 行あります（%s）", legacy, self.destination)
+        attempt = 0
+        while True:
+            batch = self._next_batch()
+            try:
+                self._ship(batch)
+                attempt = 0
+            except Exception as e:
+                self.last_error = e
+                logger.warning("ログ送信エラー (%d行は未送信のまま保持): %s", len(batch), e)
+                # 書き込みが反映されたか分からないので、次回はシートと突き合わせる
+                self.needs_reconcile = True
+                if not is_api_error(e):
+                    # 通信エラーの場合は接続を作り直す
+                    self.worksheet = None
+                delay = min(RETRY_MAX_SECONDS, RETRY_BASE_SECONDS * 2 ** attempt)
+                if not is_retryable(e):
+                    delay = RETRY_MAX_SECONDS
+                attempt += 1
+                time.sleep(delay * random.uniform(0.5, 1.0))
+
+    def stats(self):
+        return {
+            "pending_rows": self.journal.pending_count(self.sink),
+            "written_rows": self.written_rows,
+            "is_shipper": self.shared is None or self.is_shipper,
+            "last_error": str(self.last_error) if self.last_error else None,
+        }
+
+
+_lock = threading.Lock()
+_writers = {}
+
+
+def get_writer(creds_dict, spreadsheet_url, key_column, mock_url=None):
+    """送り先とキー列の組ごとに1つのライターをプロセス全体で共有する"""
+    sink = sink_name(mock_url or spreadsheet_url, key_column)
+    with _lock:
+        writer = _writers.get(sink)
+        if writer is None:
+            writer = SheetLogWriter(creds_dict, spreadsheet_url, key_column, mock_url=mock_url)
+            _writers[sink] = writer
+        return writer
@@ -0,0 +1,254 @@
+"""合成済み音声のキャッシュ（メモリ上のLRU + ディスク）
+
+キーは (接続先, モデル, 声, テキストのハッシュ)。同じ挨拶文やよくある質問の音声は
+全セッションで使い回し、TTS APIの呼び出しを省く。接続先（OPENAI_BASE_URL）が違えば別の音声として扱うので、
+負荷試験のモックが返した音声が本番の音声として使われることはない。
+
+ディスク層は同じホストのワーカー全体で共有される。serve_workers.py で複数ワーカーを動かしている場合は、
+同じ音声の合成も shared_state のリースでワーカー全体で1回にする（メモリ層はワーカーごと）。
+"""
+import hashlib
+import os
+import threading
+import time
+from collections import OrderedDict
+
+import shared_state
+
+MEMORY_LIMIT_BYTES = 32 * 1024 * 1024
+DISK_LIMIT_BYTES = 256 * 1024 * 1024
+CACHE_DIR_ENV = "INTERVIEW_TTS_CACHE_DIR"
+# 環境変数で置き場所を変えられる（負荷試験は一時ディレクトリに向け、本番のキャッシュに書かない）
+CACHE_DIR = os.environ.get(CACHE_DIR_ENV) or os.path.join(os.path.dirname(os.path.abspath(__file__)), ".tts_cache")
+# tts-1-hd の料金（USD / 100万文字）。節約額の目安の計算に使う
+COST_PER_MILLION_CHARS = 30.0
+# 他のワーカーの合成を待つ上限（合成の途中でワーカーが落ちた場合は、この後に引き継ぐ）
+SYNTH_LEASE_SECONDS = 60
+
+_lock = threading.Lock()
+_memory = OrderedDict()  # key -> bytes（末尾ほど最近使われた）
+_memory_bytes = 0
+_inflight = {}           # key -> threading.Event
+_disk_bytes = None       # 初回アクセス時にディレクトリを走査して求める
+_prewarmed = set()       # 事前準備を開始済みのキー
+_stats = {
+    "memory_hits": 0,
+    "disk_hits": 0,
+    "misses": 0,
+    "saved_chars": 0,
+    "synth_seconds": 0.0,
+}
+
+
+def cache_key(model, voice, text, base_url=None):
+    """base_url は OpenAI の接続先（None は公式のAPI。キーはこれまでと同じになる）"""
+    identity = f"{model}\0{voice}\0{text}" if base_url is None else f"{base_url}\0{model}\0{voice}\0{text}"
+    return hashlib.sha256(identity.encode("utf-8")).hexdigest()
+
+
+def _disk_path(key):
+    return os.path.join(CACHE_DIR, key[:2], f"{key}.mp3")
+
+
+def _remember(key, audio_bytes):
+    """メモリ層に入れ、上限を超えた分を古い順に捨てる（_lock を持った状態で呼ぶ）"""
+    global _memory_bytes
+    if key in _memory:
+        _memory.move_to_end(key)
+        return
+    _memory[key] = audio_bytes
+    _memory_bytes += len(audio_bytes)
+    while _memory_bytes > MEMORY_LIMIT_BYTES and len(_memory) > 1:
+        _, old = _memory.popitem(last=False)
+        _memory_bytes -= len(old)
+
+
+def _scan_disk():
+    total = 0
+    for root, _, names in os.walk(CACHE_DIR):
+        for name in names:
+            total += os.path.getsize(os.path.join(root, name))
+    return total
+
+
+def _read_disk(key):
+    path = _disk_path(key)
+    try:
+        with open(path, "rb") as f:
+            audio_bytes = f.read()
+        # 最終利用時刻として更新時刻を使う（LRUで消す順番の判断に使う）
+        os.utime(path)
+        return audio_bytes
+    except OSError:
+        return None
+
+
+def _write_disk(key, audio_bytes):
+    global _disk_bytes
+    path = _disk_path(key)
+    os.makedirs(os.path.dirname(path), exist_ok=True)
+    tmp_path = f"{path}.{os.getpid()}.{threading.get_ident()}.tmp"
+    with open(tmp_path, "wb") as f:
+        f.write(audio_bytes)
+    os.replace(tmp_path, path)
+
+    with _lock:
+        if _disk_bytes is None:
+            _disk_bytes = _scan_disk()
+        else:
+            _disk_bytes += len(audio_bytes)
+        over = _disk_bytes > DISK_LIMIT_BYTES
+    if over:
+        _evict_disk()
+
+
+def _evict_disk():
+    """ディスク層が上限を超えたら、最後に使われた時刻が古いファイルから消す"""
+    global _disk_bytes
+    files = []
+    for root, _, names in os.walk(CACHE_DIR):
+        for name in names:
+            path = os.path.join(root, name)
+            try:
+                st = os.stat(path)
+            except OSError:
+                continue
+            files.append((st.st_mtime, st.st_size, path))
+    files.sort()
+    total = sum(size for _, size, _ in files)
+    target = DISK_LIMIT_BYTES * 0.9
+    for _, size, path in files:
+        if total <= target:
+            break
+        try:
+            os.remove(path)
+            total -= size
+        except OSError:
+            pass
+    with _lock:
+        _disk_bytes = total
+
+
+def get_or_synthesize(model, voice, text, synthesize, base_url=None):
+    """キャッシュにあればその音声を、なければ synthesize(model, voice, text) の結果を保存して返す"""
+    key = cache_key(model, voice, text, base_url)
+
+    while True:
+        with _lock:
+            audio_bytes = _memory.get(key)
+            if audio_bytes is not None:
+                _memory.move_to_end(key)
+                _stats["memory_hits"] += 1
+                _stats["saved_chars"] += len(text)
+                return audio_bytes
+            event = _inflight.get(key)
+            if event is None:
+                event = threading.Event()
+                _inflight[key] = event
+                break
+        # 同じ音声を合成中のセッションがあれば、その完了を待ってメモリ層から取り直す
+        # （合成に失敗していた場合は、次の周回で自分が合成を担当する）
+        event.wait()
+
+    try:
+        state = shared_state.get_state()
+        if state is None:
+            audio_bytes = _read_disk(key)
+            synthesized = audio_bytes is None
+            if synthesized:
+                audio_bytes = _synthesize(key, model, voice, text, synthesize)
+        else:
+            # 他のワーカーが同じ音声を合成中なら、ディスク層に書かれるのを待つ
+            audio_bytes, synthesized = state.run_once(
+                f"tts:{key}",
+                lambda: _disk_hit(key),
+                lambda: (_synthesize(key, model, voice, text, synthesize), True),
+                SYNTH_LEASE_SECONDS,
+            )
+        with _lock:
+            if not synthesized:
+                _stats["disk_hits"] += 1
+                _stats["saved_chars"] += len(text)
+            _remember(key, audio_bytes)
+        return audio_bytes
+    finally:
+        with _lock:
+            del _inflight[key]
+        event.set()
+
+
+def _disk_hit(key):
+    audio_bytes = _read_disk(key)
+    return None if audio_bytes is None else (audio_bytes, False)
+
+
+def _synthesize(key, model, voice, text, synthesize):
+    """合成してディスク層に書く"""
+    start = time.perf_counter()
+    audio_bytes = synthesize(model, voice, text)
+    elapsed = time.perf_counter() - start
+    with _lock:
+        _stats["misses"] += 1
+        _stats["synth_seconds"] += elapsed
+    _write_disk(key, audio_bytes)
+    return audio_bytes
+
+
+def synthesize_to_key(model, voice, text, synthesize, base_url=None):
+    """音声をキャッシュに用意し、その参照キーを返す（セッション側は音声データではなくキーだけを持つ）"""
+    get_or_synthesize(model, voice, text, synthesize, base_url)
+    return cache_key(model, voice, text, base_url)
+
+
+def get_audio(key):
+    """参照キーから音声データを取り出す（メモリ層 → ディスク層。どちらにもなければ None）"""
+    with _lock:
+        audio_bytes = _memory.get(key)
+        if audio_bytes is not None:
+            _memory.move_to_end(key)
+            return audio_bytes
+    audio_bytes = _read_disk(key)
+    if audio_bytes is not None:
+        with _lock:
+            _remember(key, audio_bytes)
+    return audio_bytes
+
+
+def prewarm(model, voice, texts, synthesize, base_url=None):
+    """よく使う文（最初の挨拶など）の音声をバックグラウンドで用意しておく
+
+    スクリプトの再実行ごとに呼ばれても、同じ文の準備はプロセス内で1度しか行わない。
+    """
+    with _lock:
+        texts = [t for t in texts if cache_key(model, voice, t, base_url) not in _prewarmed]
+        _prewarmed.update(cache_key(model, voice, t, base_url) for t in texts)
+    if not texts:
+        return None
+
+    def run():
+        for text in texts:
+            try:
+                get_or_synthesize(model, voice, text, synthesize, base_url)
+            except Exception:
+                # 事前準備に失敗しても、実際に必要になった時点で改めて合成される
+                pass
+
+    thread = threading.Thread(target=run, name="tts-prewarm", daemon=True)
+    thread.start()
+    return thread
+
+
+def stats():
+    """ヒット数・ミス数と、節約できたTTS時間・料金の目安を返す"""
+    with _lock:
+        result = dict(_stats)
+        result["memory_bytes"] = _memory_bytes
+        result["memory_entries"] = len(_memory)
+        result["disk_bytes"] = _disk_bytes
+    hits = result["memory_hits"] + result["disk_hits"]
+    lookups = hits + result["misses"]
+    result["hit_rate"] = hits / lookups if lookups else 0.0
+    avg_synth = result["synth_seconds"] / result["misses"] if result["misses"] else 0.0
+    result["saved_seconds"] = avg_synth * hits
+    result["saved_usd"] = result["saved_chars"] / 1_000_000 * COST_PER_MILLION_CHARS
+    return result
@@ -0,0 +1,169 @@
+"""回答テキストを文単位に区切って並列に音声合成し、順番どおりに再生するパイプライン
+
+Difyの回答がストリーミングで届く間に、文が1つ完成するたびに音声合成を開始する。
+合成はプロセス全体で共有するワーカー数の限られた fair_executor で行い、
+出来上がった音声は元の文の順番でブラウザ側の再生キューに積む。
+各ターンの最初の文は、他の学生の2文目以降より先に合成する（話し始めるまでの待ち時間を短くする）。
+2文目以降は学生ごとに順番に合成するので、長い回答の学生がいても他の学生が後ろで待たされ続けない。
+"""
+import json
+
+from fair_executor import FairExecutor
+
+# 同時に実行する音声合成リクエスト数の上限（全セッション合計）
+TTS_MAX_WORKERS = 4
+# 合成の優先度（小さいほど先）
+FIRST_SENTENCE_PRIORITY = 0
+FOLLOWING_PRIORITY = 1
+# 文の区切りとみなす文字
+SENTENCE_ENDINGS = "。！？!?\n"
+# これより短い文（「はい。」など）は次の文とまとめて合成する
+MIN_SENTENCE_CHARS = 6
+
+_executor = FairExecutor(TTS_MAX_WORKERS, "tts")
+
+
+class SentenceSplitter:
+    """少しずつ届くテキストを日本語の文末（。！？）で区切る"""
+
+    def __init__(self):
+        self.buffer = ""
+
+    def feed(self, text):
+        """テキストを追加し、完成した文のリストを返す"""
+        self.buffer += text
+        sentences = []
+        start = 0
+        for i, ch in enumerate(self.buffer):
+            if ch in SENTENCE_ENDINGS:
+                # 「！？」のように文末記号が続く場合は最後の記号までを1文とする
+                # （末尾の記号は次の文字が届くまで確定しない）
+                if i + 1 == len(self.buffer) or self.buffer[i + 1] in SENTENCE_ENDINGS:
+                    continue
+                if len(self.buffer[start:i + 1].strip()) >= MIN_SENTENCE_CHARS:
+                    sentences.append(self.buffer[start:i + 1].strip())
+                    start = i + 1
+        self.buffer = self.buffer[start:]
+        return sentences
+
+    def flush(self):
+        """残りのテキストを最後の文として返す（空なら None）"""
+        rest = self.buffer.strip()
+        self.buffer = ""
+        return rest or None
+
+
+def split_sentences(text):
+    """完成済みのテキストを文のリストに分割する"""
+    splitter = SentenceSplitter()
+    sentences = splitter.feed(text)
+    rest = splitter.flush()
+    if rest:
+        sentences.append(rest)
+    return sentences
+
+
+class TTSPipeline:
+    """文ごとの音声合成を並列に進め、完成した音声を文の順番どおりに取り出す
+
+    synthesize(text) は合成した音声の参照ID（共有の音声ストア上のキー）を返す関数。
+    スクリプトスレッド外で実行されるため st.* を呼ばないこと。
+    user は合成を学生ごとに順番に行うための、学生を区別する値。
+    """
+
+    def __init__(self, synthesize, turn_id, user=None):
+        self.synthesize = synthesize
+        self.turn_id = turn_id
+        self.user = user
+        self.futures = []
+        self.next_index = 0
+        self.errors = []
+
+    def submit(self, sentence):
+        if sentence:
+            priority = FOLLOWING_PRIORITY if self.futures else FIRST_SENTENCE_PRIORITY
+            self.futures.append(_executor.submit(self.user, priority, self.synthesize, sentence))
+
+    def submit_text(self, text):
+        for sentence in split_sentences(text):
+            self.submit(sentence)
+
+    def _take(self, index, future):
+        try:
+            audio_ref = future.result()
+        except Exception as e:
+            self.errors.append(e)
+            return None
+        return {"id": f"{self.turn_id}-{index}", "ref": audio_ref}
+
+    def pop_ready(self):
+        """先頭から連続して完成している音声を返す（待たない）"""
+        segments = []
+        while self.next_index < len(self.futures) and self.futures[self.next_index].done():
+            segment = self._take(self.next_index, self.futures[self.next_index])
+            self.next_index += 1
+            if segment:
+                segments.append(segment)
+        return segments
+
+    def iter_remaining(self):
+        """残りの音声を文の順番どおりに、完成を待ちながら返す"""
+        while self.next_index < len(self.futures):
+            segment = self._take(self.next_index, self.futures[self.next_index])
+            self.next_index += 1
+            if segment:
+                yield segment
+
+
+# 親ページ側に1つだけ置く再生キュー。iframe（components.html）が消えても再生を続けられるよう、
+# スクリプトを親ドキュメントに挿入して親のコンテキストで動かす。
+_PLAYER_JS = """
+window.__ttsPlayer = (function () {
+  var queue = [], seen = new Set(), playing = false;
+  function playNext() {
+    if (playing || queue.length === 0) return;
+    playing = true;
+    var audio = queue.shift();
+    var done = function () { playing = false; playNext(); };
+    audio.onended = done;
+    audio.onerror = done;
+    audio.play().catch(done);
+  }
+  return {
+    enqueue: function (id, src) {
+      if (seen.has(id)) return;
+      seen.add(id);
+      // 積んだ時点で取りに行く（配信側は古い音声から配信をやめるので、再生の順番を待たない）
+      var audio = new Audio(src);
+      audio.preload = "auto";
+      queue.push(audio);
+      playNext();
+    }
+  };
+})();
+"""
+
+
+def audio_queue_html(segments, audio_url):
+    """音声セグメントを親ページの再生キューに積むHTML（components.html で描画する）
+
+    audio_url(segment) はブラウザが音声を取りに来るURLを返す関数（音声がストアから消えていれば None）。
+    HTMLにはIDとURLだけを書くので、音声データはWebSocketを通らない。
+    同じIDのセグメントは1度しか再生されないので、再描画や rerun で重複して送っても問題ない。
+    """
+    items = []
+    for seg in segments:
+        src = audio_url(seg)
+        if src:
+            items.append({"id": seg["id"], "src": src})
+    return f"""<script>
+(function () {{
+  var w = window.parent;
+  if (!w.__ttsPlayer) {{
+    var s = w.document.createElement("script");
+    s.textContent = {json.dumps(_PLAYER_JS)};
+    w.document.head.appendChild(s);
+  }}
+  {json.dumps(items)}.forEach(function (item) {{ w.__ttsPlayer.enqueue(String(item.id), String(item.src)); }});
+}})();
+</script>"""
@@ -0,0 +1,93 @@
+"""会話ターンのローカル追記ジャーナル（SQLite WALモード）
+
+ログはまずこのジャーナルに書き込み、スプレッドシートへの反映は
+sheet_logger の送信スレッドが後から行う。シートが落ちていても、
+アプリが再起動しても、未送信の行はここに残り続ける。
+"""
+import json
+import os
+import sqlite3
+import threading
+import time
+
+JOURNAL_ENV = "INTERVIEW_TURN_JOURNAL"
+# benchmarks/ の負荷試験は環境変数で一時ディレクトリのファイルに向ける
+JOURNAL_PATH = os.environ.get(JOURNAL_ENV) or os.path.join(os.path.dirname(os.path.abspath(__file__)), ".turn_journal.sqlite3")
+# 送信済みの行をジャーナルに残しておく期間
+SHIPPED_RETENTION_SECONDS = 7 * 24 * 60 * 60
+
+_SCHEMA = """
+CREATE TABLE IF NOT EXISTS turns (
+    seq INTEGER PRIMARY KEY AUTOINCREMENT,
+    sink TEXT NOT NULL,
+    turn_key TEXT NOT NULL,
+    row_json TEXT NOT NULL,
+    created_at REAL NOT NULL,
+    shipped_at REAL,
+    UNIQUE (sink, turn_key)
+);
+CREATE INDEX IF NOT EXISTS turns_pending ON turns (sink, shipped_at, seq);
+"""
+
+
+class TurnJournal:
+    """送信先(sink)ごとに、ターンキー(会話ID:ターン番号)で一意な行を保持する"""
+
+    def __init__(self, path=JOURNAL_PATH):
+        self.path = path
+        self.lock = threading.Lock()
+        self.conn = sqlite3.connect(path, check_same_thread=False, isolation_level=None)
+        # WAL + synchronous=NORMAL: コミットはWALへの追記だけで終わり、fsyncはチェックポイント時にまとめて行う
+        self.conn.execute("PRAGMA journal_mode=WAL")
+        self.conn.execute("PRAGMA synchronous=NORMAL")
+        self.conn.executescript(_SCHEMA)
+
+    def append(self, sink, turn_key, row):
+        """行を追記する。同じターンキーが既にあれば何もしない（二重送信の防止）"""
+        with self.lock:
+            self.conn.execute(
+                "INSERT OR IGNORE INTO turns (sink, turn_key, row_json, created_at) VALUES (?, ?, ?, ?)",
+                (sink, turn_key, json.dumps(row, ensure_ascii=False), time.time()),
+            )
+
+    def pending(self, sink, limit):
+        """未送信の行を古い順に返す: [(seq, turn_key, row, created_at), ...]"""
+        with self.lock:
+            cur = self.conn.execute(
+                "SELECT seq, turn_key, row_json, created_at FROM turns"
+                " WHERE sink = ? AND shipped_at IS NULL ORDER BY seq LIMIT ?",
+                (sink, limit),
+            )
+            return [(seq, key, json.loads(row), created) for seq, key, row, created in cur.fetchall()]
+
+    def pending_count(self, sink):
+        with self.lock:
+            return self.conn.execute(
+                "SELECT COUNT(*) FROM turns WHERE sink = ? AND shipped_at IS NULL", (sink,)
+            ).fetchone()[0]
+
+    def mark_shipped(self, seqs):
+        if not seqs:
+            return
+        now = time.time()
+        with self.lock:
+            self.conn.executemany("UPDATE turns SET shipped_at = ? WHERE seq = ?", [(now, s) for s in seqs])
+
+    def purge_shipped(self, older_than=SHIPPED_RETENTION_SECONDS):
+        with self.lock:
+            self.conn.execute(
+                "DELETE FROM turns WHERE shipped_at IS NOT NULL AND shipped_at < ?", (time.time() - older_than,)
+            )
+
+
+_lock = threading.Lock()
+_journal = None
+
+
+def get_journal():
+    """プロセス全体で1つのジャーナルを共有する"""
+    global _journal
+    with _lock:
+        if _journal is None:
+            _journal = TurnJournal()
+        return _journal
@@ -0,0 +1,103 @@
+"""1ターン分の処理（音声認識・校正・Dify・ログ・音声合成）の並行実行と段階ごとの計測
+
+互いに依存しない処理はワーカースレッドで先に始め、各段階の開始・終了時刻を記録する。
+ターン全体の所要時間（wall）と各段階の合計（sum）を比べれば、どれだけ重ねて実行できたかが分かる。
+ワーカーは全セッションで共有し、学生ごとに順番に割り当てる（fair_executor）。
+"""
+import threading
+import time
+from contextlib import contextmanager
+
+from fair_executor import FairExecutor
+
+TURN_MAX_WORKERS = 8
+
+_executor = FairExecutor(TURN_MAX_WORKERS, "turn")
+
+
+class TurnPipeline:
+    """1ターンの段階ごとの所要時間を記録する。ワーカースレッドからも記録できる
+
+    user はワーカーで行う段階を学生ごとに順番に実行するための、学生を区別する値。
+    """
+
+    def __init__(self, kind, user=None):
+        self.kind = kind
+        self.user = user
+        self.started = time.perf_counter()
+        self.finished = None
+        self.lock = threading.Lock()
+        self.spans = {}  # 段階名 -> [開始, 終了]（ターン開始からの秒数）
+        self.marks = {}  # 節目（最初の音声の再生開始など）-> ターン開始からの秒数
+        self.futures = []
+
+    def record(self, name, start, end):
+        """段階の実行区間を記録する（同じ名前の段階が複数回あれば、最初の開始から最後の終了までにまとめる）"""
+        start -= self.started
+        end -= self.started
+        with self.lock:
+            span = self.spans.get(name)
+            if span is None:
+                self.spans[name] = [start, end]
+            else:
+                span[0] = min(span[0], start)
+                span[1] = max(span[1], end)
+
+    def mark(self, name):
+        """節目の時刻を記録する（最初の1回だけ）"""
+        with self.lock:
+            self.marks.setdefault(name, time.perf_counter() - self.started)
+
+    @contextmanager
+    def stage(self, name):
+        """スクリプトスレッドで順番に行う段階を計測する"""
+        start = time.perf_counter()
+        try:
+            yield
+        finally:
+            self.record(name, start, time.perf_counter())
+
+    def timed(self, name, fn):
+        """fn を呼ぶと所要時間が name の段階として記録される関数を返す（ワーカーに渡す用）"""
+        def wrapper(*args, **kwargs):
+            start = time.perf_counter()
+            try:
+                return fn(*args, **kwargs)
+            finally:
+                self.record(name, start, time.perf_counter())
+        return wrapper
+
+    def submit(self, name, fn, *args, **kwargs):
+        """段階をワーカースレッドで始め、Future を返す（ターンの終了はこれらの完了を待つ）"""
+        future = _executor.submit(self.user, 0, self.timed(name, fn), *args, **kwargs)
+        self.futures.append((name, future))
+        return future
+
+    def errors(self):
+        """ワーカーで失敗した段階を [(段階名, 例外), ...] で返す（完了を待つ）"""
+        result = []
+        for name, future in self.futures:
+            error = future.exception()
+            if error is not None:
+                result.append((name, error))
+        return result
+
+    def finish(self):
+        """ターンを終える（バックグラウンドの段階が残っていれば完了を待つ）"""
+        for _, future in self.futures:
+            future.exception()
+        if self.finished is None:
+            self.finished = time.perf_counter()
+
+    def summary(self):
+        """{"kind", "wall", "sum", "stages": [(段階名, 開始, 所要時間), ...], "marks": {...}} を返す（秒）"""
+        end = (self.finished or time.perf_counter()) - self.started
+        with self.lock:
+            stages = sorted(((name, s, e - s) for name, (s, e) in self.spans.items()), key=lambda r: r[1])
+        return {
+            "kind": self.kind,
+            "wall": end,
+            "sum": sum(d for _, _, d in stages),
+            "stages": stages,
+            "marks": dict(self.marks),
+        }
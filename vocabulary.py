@@ -0,0 +1,224 @@
+"""講義ごとの重要語句ファイル（keywords*.txt）の索引
+
+ファイルは1行に1語句。同じ語句の別表記（かな書きなど）はカンマ区切りで同じ行に書き、
+先頭を正式な表記として扱う（例: "橄欖石, かんらん石, カンラン石"）。
+
+索引はファイルごとにプロセス内で1度だけ作り、更新時刻が変わったら作り直す。
+"""
+import os
+import threading
+import unicodedata
+from collections import deque
+
+# Whisper の prompt は末尾の224トークンしか使われない
+WHISPER_PROMPT_MAX_TOKENS = 224
+
+
+def estimate_tokens(text):
+    """トークン数を控えめに見積もる（日本語は1文字1.5トークン、英数字は4文字1トークンとみなす）"""
+    return sum(1.5 if ord(ch) > 127 else 0.25 for ch in text)
+
+
+# 語句の末尾によく現れる漢字の読み。「かくせん石」→「カクセンセキ」のように、
+# かなと組み合わさった表記から全部かなの読みを作るのに使う
+KANJI_READINGS = {
+    "石": ("セキ",),
+    "岩": ("ガン",),
+    "層": ("ソウ",),
+    "山": ("サン", "ザン"),
+    "物": ("ブツ",),
+    "母": ("モ",),
+    "曲": ("キョク",),
+    "緑": ("リョク",),
+    "灰": ("バイ", "ハイ"),
+    "花": ("カ",),
+}
+
+
+def _to_katakana(ch):
+    code = ord(ch)
+    if 0x3041 <= code <= 0x3096:
+        return chr(code + 0x60)
+    return ch
+
+
+def normalize(text):
+    """照合用に正規化する（全角半角の統一・ひらがなをカタカナに・英字を小文字に）"""
+    return "".join(_to_katakana(ch) for ch in unicodedata.normalize("NFKC", text)).lower()
+
+
+def normalize_with_map(text):
+    """正規化した文字列と、各文字が元の文字列の何文字目に由来するかの対応表を返す"""
+    chars = []
+    origin = []
+    for i, ch in enumerate(text):
+        for n in normalize(ch):
+            chars.append(n)
+            origin.append(i)
+    return "".join(chars), origin
+
+
+def is_kana(text):
+    return all("\u30a0" <= ch <= "\u30ff" for ch in text)
+
+
+def reading_variants(word):
+    """かなと末尾の漢字からなる表記の、全部カタカナの読みを返す（作れない場合は空）"""
+    variants = [""]
+    for ch in normalize(word):
+        if ch in KANJI_READINGS:
+            variants = [v + r for v in variants for r in KANJI_READINGS[ch]]
+        else:
+            variants = [v + ch for v in variants]
+    return [v for v in variants if is_kana(v) and v != normalize(word)]
+
+
+class AhoCorasick:
+    """複数の語句を1回の走査で探すためのAho-Corasickオートマトン"""
+
+    def __init__(self, patterns):
+        # patterns: {語句: 値}
+        self.goto = [{}]
+        self.fail = [0]
+        self.output = [[]]  # ノード -> [(語句の長さ, 値), ...]
+        for pattern, value in patterns.items():
+            node = 0
+            for ch in pattern:
+                nxt = self.goto[node].get(ch)
+                if nxt is None:
+                    nxt = len(self.goto)
+                    self.goto[node][ch] = nxt
+                    self.goto.append({})
+                    self.fail.append(0)
+                    self.output.append([])
+                node = nxt
+            self.output[node].append((len(pattern), value))
+
+        queue = deque(self.goto[0].values())
+        while queue:
+            node = queue.popleft()
+            for ch, nxt in self.goto[node].items():
+                queue.append(nxt)
+                f = self.fail[node]
+                while f and ch not in self.goto[f]:
+                    f = self.fail[f]
+                self.fail[nxt] = self.goto[f].get(ch, 0)
+                self.output[nxt] = self.output[nxt] + self.output[self.fail[nxt]]
+
+    def iter_matches(self, text):
+        """すべての出現を (開始位置, 終了位置, 値) で返す（重なりあり）"""
+        node = 0
+        for i, ch in enumerate(text):
+            while node and ch not in self.goto[node]:
+                node = self.fail[node]
+            node = self.goto[node].get(ch, 0)
+            for length, value in self.output[node]:
+                yield i + 1 - length, i + 1, value
+
+    def find_longest(self, text):
+        """重ならないよう、左から順に最長の出現を選んで返す"""
+        matches = sorted(self.iter_matches(text), key=lambda m: (m[0], -(m[1] - m[0])))
+        result = []
+        end = 0
+        for start, stop, value in matches:
+            if start >= end:
+                result.append((start, stop, value))
+                end = stop
+        return result
+
+
+def parse_keyword_lines(content):
+    """語句ファイルの内容を [(正式表記, (別表記, ...)), ...] に変換する（同じ正式表記の行はまとめる）"""
+    groups = {}
+    for line in content.splitlines():
+        words = [p.strip() for p in line.split(',')]
+        words = list(dict.fromkeys(w for w in words if w))
+        if not words:
+            continue
+        aliases = groups.setdefault(words[0], [])
+        for w in words[1:]:
+            if w not in aliases:
+                aliases.append(w)
+    return [(canonical, tuple(aliases)) for canonical, aliases in groups.items()]
+
+
+class KeywordIndex:
+    """1つの語句ファイルから作った索引"""
+
+    def __init__(self, groups):
+        self.groups = groups
+        self.canonical_terms = [canonical for canonical, _ in groups]
+        # 別表記 -> 正式表記（正式表記自身も含む）
+        self.alias_to_canonical = {}
+        for canonical, aliases in groups:
+            for word in (canonical,) + aliases:
+                self.alias_to_canonical.setdefault(word, canonical)
+        # 校正プロンプト用: すべての表記をカンマ区切りで
+        self.all_words = list(self.alias_to_canonical)
+        self.correction_prompt = ",".join(self.all_words)
+        self.whisper_prompt = self._build_whisper_prompt()
+        self._matcher = None
+
+    @property
+    def matcher(self):
+        """正規化した全表記と読みから作った照合器（値は (正式表記, 語句ファイルにある表記か)）"""
+        if self._matcher is None:
+            patterns = {}
+            for word, canonical in self.alias_to_canonical.items():
+                patterns.setdefault(normalize(word), (canonical, True))
+            for word, canonical in self.alias_to_canonical.items():
+                for reading in reading_variants(word):
+                    patterns.setdefault(reading, (canonical, False))
+            self._matcher = AhoCorasick(patterns)
+        return self._matcher
+
+    def _build_whisper_prompt(self):
+        """トークン上限に収まるよう、正式表記を優先し、余裕があれば別表記も加えた語句の羅列を作る"""
+        budget = WHISPER_PROMPT_MAX_TOKENS
+        words = []
+        for word in self.canonical_terms + [a for _, aliases in self.groups for a in aliases]:
+            cost = estimate_tokens(word) + 1  # 区切りのカンマ分
+            if cost > budget:
+                continue
+            words.append(word)
+            budget -= cost
+        return ",".join(words)
+
+    def canonical(self, word):
+        """表記から正式表記を返す（語句ファイルにない場合は None）"""
+        return self.alias_to_canonical.get(word)
+
+    def find_terms(self, text):
+        """文中に現れる語句の正式表記の集合を返す（かな書きの読みも含めて照合する）"""
+        return {value[0] for _, _, value in self.matcher.iter_matches(normalize(text))}
+
+    def __bool__(self):
+        return bool(self.groups)
+
+
+EMPTY_INDEX = KeywordIndex([])
+
+_lock = threading.Lock()
+_indexes = {}  # 絶対パス -> (mtime, KeywordIndex)
+
+
+def get_index(keyword_file):
+    """語句ファイルの索引を返す。ファイルがなければ空の索引を返す"""
+    path = os.path.abspath(keyword_file)
+    try:
+        mtime = os.stat(path).st_mtime
+    except OSError:
+        return EMPTY_INDEX
+
+    cached = _indexes.get(path)
+    if cached and cached[0] == mtime:
+        return cached[1]
+
+    with _lock:
+        cached = _indexes.get(path)
+        if cached and cached[0] == mtime:
+            return cached[1]
+        with open(path, "r", encoding="utf-8") as f:
+            index = KeywordIndex(parse_keyword_lines(f.read()))
+        _indexes[path] = (mtime, index)
+        return index